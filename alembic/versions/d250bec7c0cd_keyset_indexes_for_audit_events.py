@@ -0,0 +1,70 @@
+"""keyset indexes for audit_events
+
+Revision ID: d250bec7c0cd
+Revises: 5d7198d34b91
+Create Date: 2020-01-27 10:14:52.301736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d250bec7c0cd"  # pragma: allowlist secret
+down_revision = "5d7198d34b91"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+# The audit log is paginated newest first by (time_created, id), optionally
+# filtered by one of these columns. Each filter's index leads with the
+# filtered column, so it replaces that column's single column index.
+FILTERS = ["portfolio_id", "application_id", "resource_id"]
+
+
+def upgrade():
+    # audit_events is large and written to constantly, so the indexes are
+    # built without locking it, which can't be done inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_audit_events_time_created_id",
+            "audit_events",
+            ["time_created", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        for column in FILTERS:
+            op.create_index(
+                f"ix_audit_events_{column}_time_created_id",
+                "audit_events",
+                [column, "time_created", "id"],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f"ix_audit_events_{column}",
+                table_name="audit_events",
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column in FILTERS:
+            op.create_index(
+                f"ix_audit_events_{column}",
+                "audit_events",
+                [column],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f"ix_audit_events_{column}_time_created_id",
+                table_name="audit_events",
+                postgresql_concurrently=True,
+            )
+        op.drop_index(
+            "ix_audit_events_time_created_id",
+            table_name="audit_events",
+            postgresql_concurrently=True,
+        )
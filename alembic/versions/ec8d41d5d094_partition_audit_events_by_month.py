@@ -0,0 +1,130 @@
+"""partition audit_events by month
+
+Needs Postgres 11 or later.
+
+The table is rebuilt and every existing event copied into it in one
+transaction, which holds an exclusive lock on audit_events throughout, so
+nothing can record audit events until it finishes. Run it in a maintenance
+window sized to the table; the indexes are built after the copy, so it takes
+roughly as long as copying the table and indexing it once.
+
+Revision ID: ec8d41d5d094
+Revises: d250bec7c0cd
+Create Date: 2020-02-03 09:41:27.518203
+
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "ec8d41d5d094"  # pragma: allowlist secret
+down_revision = "d250bec7c0cd"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+# partitions are created for this many months after the current one; the
+# maintenance task keeps creating them from here on
+MONTHS_AHEAD = 3
+
+INDEXES = {
+    "ix_audit_events_user_id": ["user_id"],
+    "ix_audit_events_time_created_id": ["time_created", "id"],
+    "ix_audit_events_portfolio_id_time_created_id": [
+        "portfolio_id",
+        "time_created",
+        "id",
+    ],
+    "ix_audit_events_application_id_time_created_id": [
+        "application_id",
+        "time_created",
+        "id",
+    ],
+    "ix_audit_events_resource_id_time_created_id": [
+        "resource_id",
+        "time_created",
+        "id",
+    ],
+}
+FOREIGN_KEYS = {
+    "user_id": "users",
+    "portfolio_id": "portfolios",
+    "application_id": "applications",
+}
+
+
+def _add_months(month, months):
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return datetime(month.year + year, month_index + 1, 1, tzinfo=timezone.utc)
+
+
+def _bound(month):
+    # Postgres before 12 only accepts plain literals as partition bounds, so
+    # they can't be bind parameters, which psycopg2 sends as casts
+    return "'{:%Y-%m-%d %H:%M:%S}+00'".format(month.astimezone(timezone.utc))
+
+
+def _create_constraints_and_indexes(primary_key):
+    # built after the events are copied in, which is quicker than
+    # maintaining them row by row
+    op.create_primary_key("audit_events_pkey", "audit_events", primary_key)
+    for column, table in FOREIGN_KEYS.items():
+        op.create_foreign_key(
+            f"audit_events_{column}_fkey", "audit_events", table, [column], ["id"]
+        )
+    for name, columns in INDEXES.items():
+        op.create_index(name, "audit_events", columns, unique=False)
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.rename_table("audit_events", "audit_events_unpartitioned")
+    op.execute(
+        """
+        CREATE TABLE audit_events (
+            LIKE audit_events_unpartitioned INCLUDING DEFAULTS
+        ) PARTITION BY RANGE (time_created)
+        """
+    )
+
+    oldest = conn.execute(
+        "SELECT min(time_created) FROM audit_events_unpartitioned"
+    ).scalar()
+    now = datetime.now(timezone.utc)
+    month = _add_months(min(oldest or now, now).astimezone(timezone.utc), 0)
+    last_month = _add_months(now, MONTHS_AHEAD)
+    while month <= last_month:
+        op.execute(
+            "CREATE TABLE audit_events_y{:04d}m{:02d} PARTITION OF audit_events "
+            "FOR VALUES FROM ({}) TO ({})".format(
+                month.year, month.month, _bound(month), _bound(_add_months(month, 1))
+            )
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE audit_events_default PARTITION OF audit_events DEFAULT")
+
+    op.execute("INSERT INTO audit_events SELECT * FROM audit_events_unpartitioned")
+    op.drop_table("audit_events_unpartitioned")
+
+    # a partitioned table's primary key has to include its partition key
+    _create_constraints_and_indexes(["id", "time_created"])
+
+
+def downgrade():
+    op.rename_table("audit_events", "audit_events_partitioned")
+    op.execute(
+        """
+        CREATE TABLE audit_events (
+            LIKE audit_events_partitioned INCLUDING DEFAULTS
+        )
+        """
+    )
+    op.execute("INSERT INTO audit_events SELECT * FROM audit_events_partitioned")
+    # drops every partition with it
+    op.drop_table("audit_events_partitioned")
+
+    _create_constraints_and_indexes(["id"])
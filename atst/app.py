@@ -20,17 +20,22 @@ from atst.routes.dev import bp as dev_routes
 from atst.routes.users import bp as user_routes
 from atst.routes.errors import make_error_pages
 from atst.routes.ccpo import bp as ccpo_routes
-from atst.domain.authnid.crl import CRLCache, NoOpCRLCache
+from atst.domain.authnid.crl import CRLCache, CRLResultCache, NoOpCRLCache
 from atst.domain.auth import apply_authentication
 from atst.domain.authz import Authorization
+from atst.domain.authz.snapshot import AuthorizationSnapshots
 from atst.domain.csp import make_csp_provider
-from atst.domain.portfolios import Portfolios
+from atst.domain.portfolios.sidebar import SidebarPortfolios
 from atst.models.permissions import Permissions
 from atst.queue import celery, update_celery
 from atst.utils import mailer
+from atst.utils.audit_event_stream import AuditEventStream
 from atst.utils.form_cache import FormCache
 from atst.utils.json import CustomJSONEncoder, sqlalchemy_dumps
+from atst.utils.metrics import Metrics, StatsdMetrics
 from atst.utils.notification_sender import NotificationSender
+from atst.utils.query_stats import make_query_stats
+from atst.utils.rate_limiter import RateLimiter
 from atst.utils.session_limiter import SessionLimiter
 
 from logging.config import dictConfig
@@ -62,10 +67,12 @@ def make_app(config):
 
     update_celery(celery, app)
 
+    make_query_stats(app)
     make_flask_callbacks(app)
     register_filters(app)
     register_jinja_globals(app)
     make_csp_provider(app, config.get("CSP", "mock"))
+    make_metrics(app)
     make_crl_validator(app)
     make_mailer(app)
     make_notification_sender(app)
@@ -88,6 +95,28 @@ def make_app(config):
         app.register_blueprint(dev_routes)
 
     app.form_cache = FormCache(app.redis)
+    app.audit_event_stream = AuditEventStream(app.redis)
+    app.csp_rate_limiter = RateLimiter(
+        app.redis,
+        {
+            "atst.jobs.create_environment": app.config[
+                "CSP_CREATE_ENVIRONMENT_RATE_LIMIT"
+            ],
+            "atst.jobs.create_atat_admin_user": app.config[
+                "CSP_CREATE_ATAT_ADMIN_USER_RATE_LIMIT"
+            ],
+            # provision_users shares this limit, see atst.jobs.SHARED_RATE_LIMITS
+            "atst.jobs.provision_user": app.config["CSP_PROVISION_USER_RATE_LIMIT"],
+        },
+        burst=app.config["CSP_RATE_LIMIT_BURST"],
+        logger=app.logger,
+    )
+    app.authz_snapshots = AuthorizationSnapshots(
+        app.redis, app.config["AUTHZ_SNAPSHOT_TTL"], logger=app.logger
+    )
+    app.sidebar_portfolios = SidebarPortfolios(
+        app.redis, app.config["SIDEBAR_PORTFOLIOS_TTL"], logger=app.logger
+    )
 
     apply_authentication(app)
     set_default_headers(app)
@@ -114,12 +143,17 @@ def make_flask_callbacks(app):
         if not g.current_user:
             return {}
 
-        portfolios = Portfolios.for_user(g.current_user)
-        return {"portfolios": portfolios}
+        # every render_template call runs this, including the ones for each
+        # event in an activity log, so it is loaded once per request
+        if g.get("sidebar_portfolios") is None:
+            g.sidebar_portfolios = app.sidebar_portfolios.for_user(g.current_user)
+
+        return {"portfolios": g.sidebar_portfolios}
 
     @app.after_request
     def _cleanup(response):
         g.current_user = None
+        g.sidebar_portfolios = None
         g.portfolio = None
         g.application = None
         g.task_order = None
@@ -156,6 +190,13 @@ def map_config(config):
     return {
         **config["default"],
         "USE_AUDIT_LOG": config["default"].getboolean("USE_AUDIT_LOG"),
+        "AUDIT_LOG_RETENTION_MONTHS": config.getint(
+            "default", "AUDIT_LOG_RETENTION_MONTHS"
+        ),
+        "AUDIT_LOG_STREAM": config.getboolean("default", "AUDIT_LOG_STREAM"),
+        "AUDIT_LOG_STREAM_BATCH_SIZE": config.getint(
+            "default", "AUDIT_LOG_STREAM_BATCH_SIZE"
+        ),
         "ENV": config["default"]["ENVIRONMENT"],
         "BROKER_URL": config["default"]["REDIS_URI"],
         "DEBUG": config["default"].getboolean("DEBUG"),
@@ -174,9 +215,40 @@ def map_config(config):
         "PERMANENT_SESSION_LIFETIME": config.getint(
             "default", "PERMANENT_SESSION_LIFETIME"
         ),
+        "PROVISIONING_BATCH_SIZE": config.getint("default", "PROVISIONING_BATCH_SIZE"),
+        "PROVISIONING_MAX_ATTEMPTS": config.getint(
+            "default", "PROVISIONING_MAX_ATTEMPTS"
+        ),
         "DISABLE_CRL_CHECK": config.getboolean("default", "DISABLE_CRL_CHECK"),
+        "AUTHZ_SNAPSHOT_TTL": config.getint("default", "AUTHZ_SNAPSHOT_TTL"),
         "CRL_FAIL_OPEN": config.getboolean("default", "CRL_FAIL_OPEN"),
+        "CSP_CREATE_ATAT_ADMIN_USER_RATE_LIMIT": config.getint(
+            "default", "CSP_CREATE_ATAT_ADMIN_USER_RATE_LIMIT"
+        ),
+        "CSP_CREATE_ENVIRONMENT_RATE_LIMIT": config.getint(
+            "default", "CSP_CREATE_ENVIRONMENT_RATE_LIMIT"
+        ),
+        "CSP_PROVISION_USER_RATE_LIMIT": config.getint(
+            "default", "CSP_PROVISION_USER_RATE_LIMIT"
+        ),
+        "CSP_RATE_LIMIT_BURST": config.getint("default", "CSP_RATE_LIMIT_BURST"),
+        "CSP_RETRY_BASE_DELAY": config.getint("default", "CSP_RETRY_BASE_DELAY"),
+        "CSP_RETRY_MAX_DELAY": config.getint("default", "CSP_RETRY_MAX_DELAY"),
+        "CRL_REFRESH_INTERVAL": config.getint("default", "CRL_REFRESH_INTERVAL"),
+        "CRL_RESULT_CACHE_TTL": config.getint("default", "CRL_RESULT_CACHE_TTL"),
+        "CRL_RESULT_CACHE_SIZE": config.getint("default", "CRL_RESULT_CACHE_SIZE"),
         "LOG_JSON": config.getboolean("default", "LOG_JSON"),
+        "MAIL_IDLE_TIMEOUT": config.getint("default", "MAIL_IDLE_TIMEOUT"),
+        "MAIL_POOL_SIZE": config.getint("default", "MAIL_POOL_SIZE"),
+        "STATSD_PORT": config.getint("default", "STATSD_PORT"),
+        "SIDEBAR_PORTFOLIOS_TTL": config.getint("default", "SIDEBAR_PORTFOLIOS_TTL"),
+        "SQL_QUERY_BUDGET": config.getint("default", "SQL_QUERY_BUDGET"),
+        "SQL_QUERY_BUDGET_ENFORCE": config.getboolean(
+            "default", "SQL_QUERY_BUDGET_ENFORCE"
+        ),
+        "SQL_REPEATED_QUERY_THRESHOLD": config.getint(
+            "default", "SQL_REPEATED_QUERY_THRESHOLD"
+        ),
         "LIMIT_CONCURRENT_SESSIONS": config.getboolean(
             "default", "LIMIT_CONCURRENT_SESSIONS"
         ),
@@ -277,6 +349,17 @@ def make_redis(app, config):
     app.redis = r
 
 
+def make_metrics(app):
+    if app.config.get("STATSD_HOST"):
+        app.metrics = StatsdMetrics(
+            app.config["STATSD_HOST"],
+            port=app.config["STATSD_PORT"],
+            prefix=app.config["STATSD_PREFIX"],
+        )
+    else:
+        app.metrics = Metrics()
+
+
 def make_crl_validator(app):
     if app.config.get("DISABLE_CRL_CHECK"):
         app.crl_cache = NoOpCRLCache(logger=app.logger)
@@ -285,7 +368,23 @@ def make_crl_validator(app):
         if not os.path.isdir(crl_dir):
             os.makedirs(crl_dir, exist_ok=True)
 
-        app.crl_cache = CRLCache(app.config["CA_CHAIN"], crl_dir, logger=app.logger,)
+        result_cache = None
+        if app.config.get("CRL_RESULT_CACHE_TTL"):
+            result_cache = CRLResultCache(
+                app.config["CRL_RESULT_CACHE_TTL"],
+                maxsize=app.config["CRL_RESULT_CACHE_SIZE"],
+                redis=app.redis,
+                logger=app.logger,
+            )
+
+        app.crl_cache = CRLCache(
+            app.config["CA_CHAIN"],
+            crl_dir,
+            logger=app.logger,
+            refresh_interval=app.config.get("CRL_REFRESH_INTERVAL"),
+            result_cache=result_cache,
+            metrics=app.metrics,
+        )
 
 
 def make_mailer(app):
@@ -298,6 +397,8 @@ def make_mailer(app):
             username=app.config.get("MAIL_SENDER"),
             password=app.config.get("MAIL_PASSWORD"),
             use_tls=app.config.get("MAIL_TLS"),
+            pool_size=app.config.get("MAIL_POOL_SIZE"),
+            idle_timeout=app.config.get("MAIL_IDLE_TIMEOUT"),
         )
     sender = app.config.get("MAIL_SENDER")
     app.mailer = mailer.Mailer(mailer_connection, sender)
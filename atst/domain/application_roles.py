@@ -1,8 +1,9 @@
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from atst.database import db
 from atst.domain.environment_roles import EnvironmentRoles
-from atst.models import ApplicationRole, ApplicationRoleStatus
+from atst.models import ApplicationRole, ApplicationRoleStatus, EnvironmentRole
 from .permission_sets import PermissionSets
 from .exceptions import NotFoundError
 
@@ -61,6 +62,29 @@ class ApplicationRoles(object):
         except NoResultFound:
             raise NotFoundError("application_role")
 
+    @classmethod
+    def get_members(cls, application_id):
+        """
+        Returns the application's members with their users, permission sets,
+        invitations and environment roles (with each role's environment)
+        already loaded, so listing them takes a fixed number of queries
+        however many members and environments the application has.
+        """
+        return (
+            db.session.query(ApplicationRole)
+            .filter(ApplicationRole.application_id == application_id)
+            .filter(ApplicationRole.deleted == False)
+            .options(
+                joinedload(ApplicationRole.user),
+                selectinload(ApplicationRole.permission_sets),
+                selectinload(ApplicationRole.invitations),
+                selectinload(ApplicationRole.environment_roles).joinedload(
+                    EnvironmentRole.environment
+                ),
+            )
+            .all()
+        )
+
     @classmethod
     def update_permission_sets(cls, application_role, new_perm_sets_names):
         application_role.permission_sets = ApplicationRoles._permission_sets_for_names(
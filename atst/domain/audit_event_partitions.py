@@ -0,0 +1,203 @@
+from datetime import datetime, timezone
+import gzip
+import json
+import os
+import re
+
+from sqlalchemy import text
+
+from atst.database import db
+
+
+def _month_start(time):
+    return datetime(time.year, time.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(month, months):
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return datetime(month.year + year, month_index + 1, 1, tzinfo=timezone.utc)
+
+
+def _bound(month):
+    # Postgres before 12 only accepts plain literals as partition bounds, so
+    # they can't be bind parameters, which psycopg2 sends as casts
+    return "'{:%Y-%m-%d %H:%M:%S}+00'".format(month.astimezone(timezone.utc))
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    else:
+        return str(obj)
+
+
+class AuditEventPartitions(object):
+    """
+    audit_events is partitioned by month of time_created, one partition per
+    month named like audit_events_y2020m01. Events outside every month's
+    partition go to the default partition, so writes never fail for want of
+    one, but partitions are created ahead of time so it stays empty.
+
+    Once every event in a month's partition is older than the retention
+    period, the partition is exported to a compressed JSON Lines file and
+    removed from the table.
+    """
+
+    TABLE = "audit_events"
+    DEFAULT_PARTITION = "audit_events_default"
+    NAME_PATTERN = re.compile(r"^audit_events_y(\d{4})m(\d{2})$")
+    # how many months after the current one to create partitions for
+    MONTHS_AHEAD = 3
+
+    @classmethod
+    def name(cls, month):
+        return "{}_y{:04d}m{:02d}".format(cls.TABLE, month.year, month.month)
+
+    @classmethod
+    def months(cls):
+        """The months that have partitions, oldest first."""
+        names = db.session.execute(
+            text(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = CAST(:table AS regclass)
+                """
+            ),
+            {"table": cls.TABLE},
+        ).fetchall()
+
+        months = []
+        for (name,) in names:
+            match = cls.NAME_PATTERN.match(name)
+            if match:
+                year, month = match.groups()
+                months.append(datetime(int(year), int(month), 1, tzinfo=timezone.utc))
+
+        return sorted(months)
+
+    @classmethod
+    def create(cls, month):
+        """
+        Creates the partition for the month containing `month`, moving any
+        of its events out of the default partition.
+        """
+        start = _month_start(month)
+        bounds = {"start": start, "end": _add_months(start, 1)}
+        partition = cls.name(start)
+
+        stray_events = db.session.execute(
+            text(
+                f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM {cls.DEFAULT_PARTITION}
+                    WHERE time_created >= :start AND time_created < :end
+                )
+                """
+            ),
+            bounds,
+        ).scalar()
+
+        # a partition can't be created for events already in the default
+        # partition, so it is detached while they are moved
+        if stray_events:
+            db.session.execute(
+                f"ALTER TABLE {cls.TABLE} DETACH PARTITION {cls.DEFAULT_PARTITION}"
+            )
+
+        db.session.execute(
+            f"""
+            CREATE TABLE {partition} PARTITION OF {cls.TABLE}
+            FOR VALUES FROM ({_bound(start)}) TO ({_bound(bounds["end"])})
+            """
+        )
+
+        if stray_events:
+            db.session.execute(
+                text(
+                    f"""
+                    WITH moved AS (
+                        DELETE FROM {cls.DEFAULT_PARTITION}
+                        WHERE time_created >= :start AND time_created < :end
+                        RETURNING *
+                    )
+                    INSERT INTO {cls.TABLE} SELECT * FROM moved
+                    """
+                ),
+                bounds,
+            )
+            db.session.execute(
+                f"ALTER TABLE {cls.TABLE} ATTACH PARTITION {cls.DEFAULT_PARTITION} DEFAULT"
+            )
+
+        db.session.commit()
+        return partition
+
+    @classmethod
+    def create_upcoming(cls, now=None):
+        """
+        Creates the partitions missing for the current month and the
+        MONTHS_AHEAD after it. Returns the names of those created.
+        """
+        current = _month_start(now or datetime.now(timezone.utc))
+        existing = set(cls.months())
+
+        return [
+            cls.create(month)
+            for month in [_add_months(current, n) for n in range(cls.MONTHS_AHEAD + 1)]
+            if month not in existing
+        ]
+
+    @classmethod
+    def expired(cls, retention_months, now=None):
+        """The months whose events are all older than retention_months."""
+        current = _month_start(now or datetime.now(timezone.utc))
+        oldest_kept = _add_months(current, -retention_months)
+        return [month for month in cls.months() if month < oldest_kept]
+
+    @classmethod
+    def export(cls, month, directory):
+        """
+        Writes the month's events, one JSON object per line, to a gzipped
+        file in `directory`, and returns its path. Rows are streamed from a
+        server side cursor, so the partition is never held in memory.
+        """
+        partition = cls.name(month)
+        path = os.path.join(directory, "{}.jsonl.gz".format(partition))
+        partial_path = path + ".partial"
+
+        rows = (
+            db.session.connection()
+            .execution_options(stream_results=True)
+            .execute(f"SELECT * FROM {partition} ORDER BY time_created, id")
+        )
+        with gzip.open(partial_path, "wt") as archive:
+            for row in rows:
+                archive.write(json.dumps(dict(row), default=_default) + "\n")
+
+        # only a complete export has the archive's name
+        os.replace(partial_path, path)
+        return path
+
+    @classmethod
+    def archive(cls, month, directory):
+        """
+        Exports the month's partition, then detaches and drops it. Returns
+        the path of the export.
+        """
+        partition = cls.name(month)
+        path = cls.export(month, directory)
+
+        db.session.execute(f"ALTER TABLE {cls.TABLE} DETACH PARTITION {partition}")
+        db.session.execute(f"DROP TABLE {partition}")
+        db.session.commit()
+        return path
+
+    @classmethod
+    def archive_expired(cls, directory, retention_months, now=None):
+        """Archives every expired partition. Returns the paths of the exports."""
+        return [
+            cls.archive(month, directory)
+            for month in cls.expired(retention_months, now=now)
+        ]
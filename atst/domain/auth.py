@@ -48,7 +48,7 @@ def should_redirect_to_user_profile(request, user):
 def get_current_user():
     user_id = session.get("user_id")
     if user_id:
-        return Users.get(user_id)
+        return app.authz_snapshots.get_user(user_id)
     else:
         return False
 
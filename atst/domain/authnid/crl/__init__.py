@@ -1,16 +1,32 @@
 import os
-import re
 import hashlib
 import logging
+import threading
+import calendar
 
 from OpenSSL import crypto, SSL
 from datetime import datetime
 from flask import current_app as app
 
-from .util import load_crl_locations_cache, serialize_crl_locations_cache, CRL_LIST
-
-# error codes from OpenSSL: https://github.com/openssl/openssl/blob/2c75f03b39de2fa7d006bc0f0d7c58235a54d9bb/include/openssl/x509_vfy.h#L111
-CRL_EXPIRED_ERROR_CODE = 12
+from atst.utils.metrics import Metrics, StageTimer
+
+from .index import (
+    RevocationIndex,
+    RevocationIndexError,
+    build_revocation_index,
+    crl_file_signature,
+    revocation_index_lock,
+    write_revocation_index,
+)
+from .result_cache import CRLResultCache
+from .util import (
+    load_certificate_authorities,
+    load_crl_locations_cache,
+    serialize_crl_locations_cache,
+    crl_locations_cache_path,
+    revocation_index_path,
+    CRL_LIST,
+)
 
 
 def get_common_name(x509_name_object):
@@ -33,9 +49,11 @@ class CRLInterface:
     def __init__(self, *args, logger=None, **kwargs):
         self.logger = logger
 
-    def _log(self, message, level=logging.INFO):
+    def _log(self, message, level=logging.INFO, **extra):
         if self.logger:
-            self.logger.log(level, message, extra={"tags": ["authorization", "crl"]})
+            self.logger.log(
+                level, message, extra=dict(extra, tags=["authorization", "crl"])
+            )
 
     def crl_check(self, cert):
         raise NotImplementedError()
@@ -62,13 +80,32 @@ class NoOpCRLCache(CRLInterface):
         return True
 
 
-class CRLCache(CRLInterface):
+class CRLRefresher(threading.Thread):
+    """
+    Periodically asks a CRLCache to pick up CRLs that have changed on disk, so
+    that request threads never have to re-parse a CRL themselves.
+    """
+
+    def __init__(self, crl_cache, interval):
+        super().__init__(name="crl-refresher", daemon=True)
+        self.crl_cache = crl_cache
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.crl_cache.refresh()
+            except Exception as err:
+                self.crl_cache._log(
+                    "Error refreshing CRLs: {}".format(err), level=logging.ERROR
+                )
+
+    def stop(self):
+        self._stopped.set()
 
-    _PEM_RE = re.compile(
-        b"-----BEGIN CERTIFICATE-----\r?.+?\r?-----END CERTIFICATE-----\r?\n?",
-        re.DOTALL,
-    )
 
+class CRLCache(CRLInterface):
     def __init__(
         self,
         root_location,
@@ -76,26 +113,110 @@ class CRLCache(CRLInterface):
         store_class=crypto.X509Store,
         logger=None,
         crl_list=CRL_LIST,
+        refresh_interval=None,
+        result_cache=None,
+        metrics=None,
     ):
         self._crl_dir = crl_dir
         self.logger = logger
         self.store_class = store_class
-        self.certificate_authorities = {}
         self.crl_list = crl_list
-        self._load_roots(root_location)
+        self.refresh_interval = refresh_interval
+        self.result_cache = result_cache
+        self.metrics = metrics or Metrics()
+        self._stores = {}
+        self._refresher = None
+        self._refresher_pid = None
+        self._refresher_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._index_signature = None
+        self.certificate_authorities = load_certificate_authorities(root_location)
         self._build_crl_cache()
+        self._load_revocation_index()
 
-    def _get_store(self, cert):
-        return self._build_store(cert.get_issuer())
+    def _get_store(self, issuer):
+        store = self._stores.get(issuer.der())
+        if store is None:
+            store = self._build_store(issuer)
+            self._stores[issuer.der()] = store
 
-    def _load_roots(self, root_location):
-        with open(root_location, "rb") as f:
-            for raw_ca in self._parse_roots(f.read()):
-                ca = crypto.load_certificate(crypto.FILETYPE_PEM, raw_ca)
-                self.certificate_authorities[ca.get_subject().der()] = ca
+        return store
 
-    def _parse_roots(self, root_str):
-        return [match.group(0) for match in self._PEM_RE.finditer(root_str)]
+    def _get_revocations(self, issuer):
+        """
+        Returns the current revocation index and its entry for an issuer,
+        re-indexing first if the issuer's CRL has changed on disk and no
+        background refresher is keeping the index up to date.
+        """
+        refreshing = self._ensure_refresher()
+        issuer_der = issuer.der()
+        crl_location = self.crl_cache.get(issuer_der)
+
+        if not crl_location:
+            raise CRLInvalidException(
+                "Could not find matching CRL for issuer with Common Name {}".format(
+                    get_common_name(issuer)
+                )
+            )
+
+        index = self.revocations
+        entry = index.get(issuer_der)
+        if not refreshing and (entry is None or not entry.is_current(crl_location)):
+            self._refresh_revocation_index()
+            index = self.revocations
+            entry = index.get(issuer_der)
+
+        if entry is None or entry.failed:
+            raise CRLInvalidException(
+                "Could not load CRL for issuer with Common Name {}".format(
+                    get_common_name(issuer)
+                )
+            )
+
+        return index, entry
+
+    def _ensure_refresher(self):
+        """
+        Starts the background refresher if one is configured and not already
+        running in this process. Threads do not survive a fork, so each uwsgi
+        worker starts its own on first use.
+        """
+        if not self.refresh_interval:
+            return False
+
+        with self._refresher_lock:
+            if (
+                self._refresher is None
+                or self._refresher_pid != os.getpid()
+                or not self._refresher.is_alive()
+            ):
+                self._refresher = CRLRefresher(self, self.refresh_interval)
+                self._refresher_pid = os.getpid()
+                self._refresher.start()
+
+        return True
+
+    def stop_refresher(self):
+        if self._refresher:
+            self._refresher.stop()
+            self._refresher = None
+
+    def refresh(self):
+        """
+        Re-reads the CRL locations map and re-indexes any CRL whose file has
+        changed since the revocation index was written. The new index is built
+        off to the side and swapped in whole, so concurrent checks always see
+        either the old index or the new one.
+        """
+        self._refresh_crl_locations()
+        if not self._revocation_index_is_current(self.revocations):
+            self._refresh_revocation_index()
+
+    def _refresh_crl_locations(self):
+        signature = crl_file_signature(crl_locations_cache_path(self._crl_dir))
+        if signature and signature != self._crl_locations_signature:
+            self.crl_cache = load_crl_locations_cache(self._crl_dir)
+            self._crl_locations_signature = signature
 
     def _build_crl_cache(self):
         try:
@@ -104,42 +225,97 @@ class CRLCache(CRLInterface):
             self.crl_cache = serialize_crl_locations_cache(
                 self._crl_dir, crl_list=self.crl_list
             )
+        self._crl_locations_signature = crl_file_signature(
+            crl_locations_cache_path(self._crl_dir)
+        )
+
+    def _load_revocation_index(self):
+        self.revocations = RevocationIndex.empty()
+        if not self._adopt_published_index():
+            self._refresh_revocation_index()
+
+    def _adopt_published_index(self):
+        """
+        Switches to the index on disk if it has been replaced since this cache
+        last mapped it and it covers the current CRLs. The index is written
+        by the sync job or by whichever worker first noticed a CRL change;
+        every other worker maps the same file, and its pages are shared
+        between processes, so no worker holds its own copy of the
+        revocation data.
+        """
+        index_path = revocation_index_path(self._crl_dir)
+        signature = crl_file_signature(index_path)
+        if signature is None or signature == self._index_signature:
+            return False
+
+        try:
+            index = RevocationIndex.load(index_path)
+        except (OSError, RevocationIndexError):
+            return False
+
+        if not self._revocation_index_is_current(index):
+            return False
+
+        self.revocations = index
+        self._index_signature = signature
+        return True
+
+    def _revocation_index_is_current(self, index):
+        crl_locations = {
+            issuer: location for issuer, location in self.crl_cache.items() if location
+        }
+        if index.issuers() != set(crl_locations):
+            return False
+
+        return all(
+            index.get(issuer).is_current(location)
+            for issuer, location in crl_locations.items()
+        )
+
+    def _refresh_revocation_index(self):
+        index_path = revocation_index_path(self._crl_dir)
+        with self._index_lock:
+            if self._adopt_published_index():
+                return
 
-    def _load_crl(self, crl_location):
-        with open(crl_location, "rb") as crl_file:
             try:
-                return crypto.load_crl(crypto.FILETYPE_ASN1, crl_file.read())
-            except crypto.Error:
+                self._write_revocation_index(index_path)
+            except OSError as err:
+                # the CRL directory is read-only to this process, say because
+                # the sync job that owns it runs as another user
                 self._log(
-                    "Could not load CRL at location {}".format(crl_location),
+                    "Could not write CRL revocation index to {}, building it in "
+                    "memory: {}".format(index_path, err),
                     level=logging.WARNING,
                 )
-
-    def _build_store(self, issuer):
-        store = self.store_class()
-        self._log("STORE ID: {}. Building store.".format(id(store)))
-        store.set_flags(crypto.X509StoreFlags.CRL_CHECK)
-        crl_location = self.crl_cache.get(issuer.der())
-        issuer_name = get_common_name(issuer)
-
-        if not crl_location:
-            raise CRLInvalidException(
-                "Could not find matching CRL for issuer with Common Name {}".format(
-                    issuer_name
+                self.revocations = build_revocation_index(
+                    self.crl_cache,
+                    previous=self.revocations,
+                    certificate_authorities=self.certificate_authorities,
+                    logger=self.logger,
                 )
-            )
-
-        crl = self._load_crl(crl_location)
-        store.add_crl(crl)
 
-        self._log(
-            "STORE ID: {}. Adding CRL with issuer Common Name {}".format(
-                id(store), issuer_name
+    def _write_revocation_index(self, index_path):
+        with revocation_index_lock(index_path):
+            # another process may have re-indexed while we waited
+            if self._adopt_published_index():
+                return
+
+            self._log("Writing CRL revocation index to {}".format(index_path))
+            write_revocation_index(
+                index_path,
+                self.crl_cache,
+                previous=self.revocations,
+                certificate_authorities=self.certificate_authorities,
+                logger=self.logger,
             )
-        )
+            self._index_signature = crl_file_signature(index_path)
+            self.revocations = RevocationIndex.load(index_path)
 
-        store = self._add_certificate_chain_to_store(store, crl.get_issuer())
-        return store
+    def _build_store(self, issuer):
+        store = self.store_class()
+        self._log("STORE ID: {}. Building store.".format(id(store)))
+        return self._add_certificate_chain_to_store(store, issuer)
 
     # this _should_ happen just twice for the DoD PKI (intermediary, root) but
     # theoretically it can build a longer certificate chain
@@ -160,28 +336,106 @@ class CRLCache(CRLInterface):
         else:
             return self._add_certificate_chain_to_store(store, ca.get_issuer())
 
+    def _result_key(self, parsed, entry):
+        """
+        Identifies a check of this certificate against this particular copy
+        of its issuer's CRL, so a cached result no longer matches once the CRL
+        is replaced.
+        """
+        fingerprint = hashlib.sha256(
+            crypto.dump_certificate(crypto.FILETYPE_ASN1, parsed)
+        ).hexdigest()
+        mtime_ns, size = entry.crl_signature
+        return "{}:{}:{}".format(fingerprint, mtime_ns, size)
+
+    def _result_expiry(self, parsed, entry):
+        not_after = datetime.strptime(parsed.get_notAfter().decode(), "%Y%m%d%H%M%SZ")
+        expires_at = calendar.timegm(not_after.utctimetuple())
+        if entry.next_update:
+            expires_at = min(expires_at, entry.next_update)
+
+        return expires_at
+
     def crl_check(self, cert):
-        parsed = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
-        store = self._get_store(parsed)
-        context = crypto.X509StoreContext(store, parsed)
+        timer = StageTimer()
+        issuer_cn = "unknown"
+        outcome = "error"
         try:
-            context.verify_certificate()
+            parsed = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
+            issuer = parsed.get_issuer()
+            issuer_cn = issuer.CN
+            timer.mark("parse_cert")
+            outcome = self._check_certificate(parsed, issuer, timer)
             return True
+        except CRLRevocationException:
+            outcome = "revoked"
+            raise
+        except CRLInvalidException:
+            outcome = "invalid"
+            raise
+        finally:
+            timer.stop()
+            self._report_timings(timer, issuer_cn, outcome)
+
+    def _report_timings(self, timer, issuer_cn, outcome):
+        timer.report(
+            self.metrics, "crl_check", tags={"issuer": issuer_cn, "outcome": outcome}
+        )
+        self._log(
+            "CRL check for issuer CN {}: {} in {:.2f}ms".format(
+                issuer_cn, outcome, timer.total
+            ),
+            timings=dict(timer.stages, total=timer.total),
+        )
 
+    def _check_certificate(self, parsed, issuer, timer):
+        revocations, entry = self._get_revocations(issuer)
+        timer.mark("load_crl")
+        if self.result_cache:
+            result_key = self._result_key(parsed, entry)
+            cached = self.result_cache.get(result_key)
+            timer.mark("result_cache")
+            if cached:
+                return "cached"
+
+        store = self._get_store(issuer)
+        timer.mark("store")
+        context = crypto.X509StoreContext(store, parsed)
+        try:
+            context.verify_certificate()
         except crypto.X509StoreContextError as err:
-            if err.args[0][0] == CRL_EXPIRED_ERROR_CODE:
-                if app.config.get("CRL_FAIL_OPEN"):
-                    self._log(
-                        "Encountered expired CRL for certificate with CN {} and issuer CN {}, failing open.".format(
-                            parsed.get_subject().CN, parsed.get_issuer().CN
-                        ),
-                        level=logging.WARNING,
-                    )
-                    return True
-                else:
-                    raise CRLInvalidException("CRL expired. Args: {}".format(err.args))
             raise CRLRevocationException(
                 "Certificate revoked or errored. Error: {}. Args: {}".format(
                     type(err), err.args
                 )
             )
+        finally:
+            timer.mark("verify")
+
+        revoked = revocations.is_revoked(entry, parsed.get_serial_number())
+        timer.mark("revocation_lookup")
+        if revoked:
+            raise CRLRevocationException(
+                "Certificate with serial {} has been revoked by issuer CN {}".format(
+                    parsed.get_serial_number(), issuer.CN
+                )
+            )
+
+        if entry.is_expired():
+            if app.config.get("CRL_FAIL_OPEN"):
+                self._log(
+                    "Encountered expired CRL for certificate with CN {} and issuer CN {}, failing open.".format(
+                        parsed.get_subject().CN, issuer.CN
+                    ),
+                    level=logging.WARNING,
+                )
+                return "failed_open"
+            else:
+                raise CRLInvalidException(
+                    "CRL expired for issuer CN {}".format(issuer.CN)
+                )
+
+        if self.result_cache:
+            self.result_cache.add(result_key, self._result_expiry(parsed, entry))
+
+        return "passed"
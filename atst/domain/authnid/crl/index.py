@@ -0,0 +1,371 @@
+import calendar
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+
+class RevocationIndexError(Exception):
+    pass
+
+
+def crl_file_signature(crl_location):
+    """
+    Returns a cheap fingerprint for a file on disk, used to tell whether it
+    has been replaced since it was last parsed.
+    """
+    try:
+        stat = os.stat(crl_location)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+# On-disk layout, all integers big-endian:
+#
+#   header:   magic, format version, reserved, number of issuers, and the
+#             generation (write time in nanoseconds) of this snapshot
+#   records:  one fixed-size record per issuer (see _RECORD), flagged
+#             _FAILED if its CRL couldn't be indexed
+#   issuers:  the DER-encoded issuer names, back to back
+#   serials:  for each issuer, its revoked serial numbers as sorted,
+#             zero-padded unsigned integers of a fixed per-issuer width
+#
+# Because every serial within an issuer's block has the same width, bytewise
+# comparison matches numeric comparison and lookups can binary search the
+# mapped file directly without loading it into Python objects.
+
+_MAGIC = b"ATATCRLI"
+INDEX_VERSION = 3
+_HEADER = struct.Struct(">8sHHIQ")
+_RECORD = struct.Struct(">IIqqqQIHH")
+_FAILED = 1
+# the signature recorded for a CRL whose file is missing
+_NO_FILE = (0, 0)
+
+
+def _is_past(next_update):
+    return bool(next_update) and time.time() >= next_update
+
+
+@dataclass
+class IndexEntry:
+    issuer: bytes
+    next_update: int
+    crl_signature: tuple
+    serials_offset: int
+    serial_count: int
+    serial_width: int
+    # the CRL couldn't be parsed or trusted; it is tried again once its file
+    # changes
+    failed: bool = False
+
+    def is_current(self, crl_location):
+        return (crl_file_signature(crl_location) or _NO_FILE) == self.crl_signature
+
+    def is_expired(self):
+        return _is_past(self.next_update)
+
+
+@dataclass
+class CRLSerials:
+    issuer: bytes
+    next_update: int
+    serial_count: int
+    serial_width: int
+    encoded: bytes
+
+    def is_expired(self):
+        return _is_past(self.next_update)
+
+
+class RevocationIndex:
+    def __init__(self, buf, entries, generation=0):
+        self._buf = buf
+        self._entries = entries
+        self.generation = generation
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as index_file:
+            try:
+                buf = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise RevocationIndexError("Empty revocation index at {}".format(path))
+
+        return cls.from_buffer(buf)
+
+    @classmethod
+    def from_buffer(cls, buf):
+        generation, entries = _read_entries(buf)
+        return cls(buf, entries, generation)
+
+    @classmethod
+    def empty(cls):
+        return cls(b"", {})
+
+    def get(self, issuer):
+        return self._entries.get(issuer)
+
+    def issuers(self):
+        return set(self._entries.keys())
+
+    def serials(self, entry):
+        end = entry.serials_offset + entry.serial_count * entry.serial_width
+        return self._buf[entry.serials_offset : end]
+
+    def is_revoked(self, entry, serial_number):
+        width = entry.serial_width
+        if serial_number < 0 or serial_number.bit_length() > width * 8:
+            return False
+
+        needle = serial_number.to_bytes(width, "big")
+        low, high = 0, entry.serial_count
+        while low < high:
+            mid = (low + high) // 2
+            start = entry.serials_offset + mid * width
+            value = self._buf[start : start + width]
+            if value < needle:
+                low = mid + 1
+            elif value > needle:
+                high = mid
+            else:
+                return True
+
+        return False
+
+
+def _read_entries(buf):
+    if len(buf) < _HEADER.size:
+        raise RevocationIndexError("Revocation index is truncated")
+
+    magic, version, _, count, generation = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != INDEX_VERSION:
+        raise RevocationIndexError("Unrecognized revocation index format")
+
+    entries = {}
+    for i in range(count):
+        (
+            issuer_offset,
+            issuer_length,
+            next_update,
+            mtime_ns,
+            size,
+            serials_offset,
+            serial_count,
+            serial_width,
+            flags,
+        ) = _RECORD.unpack_from(buf, _HEADER.size + i * _RECORD.size)
+        issuer = bytes(buf[issuer_offset : issuer_offset + issuer_length])
+        entries[issuer] = IndexEntry(
+            issuer=issuer,
+            next_update=next_update,
+            crl_signature=(mtime_ns, size),
+            serials_offset=serials_offset,
+            serial_count=serial_count,
+            serial_width=serial_width,
+            failed=bool(flags & _FAILED),
+        )
+
+    return generation, entries
+
+
+def load_crl_serials(crl_location, certificate_authorities=None):
+    """
+    Parses a DER CRL into its issuer, nextUpdate (as a UTC timestamp, or 0 if
+    it has none), and the sorted, fixed-width encoding of its revoked serial
+    numbers. If certificate_authorities is given, the CRL must be signed by
+    the CA matching its issuer.
+    """
+    with open(crl_location, "rb") as crl_file:
+        try:
+            crl = x509.load_der_x509_crl(crl_file.read(), default_backend())
+        except ValueError as err:
+            raise RevocationIndexError(
+                "Could not parse CRL at {}: {}".format(crl_location, err)
+            )
+
+    issuer = crl.issuer.public_bytes(default_backend())
+    if certificate_authorities is not None:
+        ca = certificate_authorities.get(issuer)
+        if ca is None or not crl.is_signature_valid(ca.to_cryptography().public_key()):
+            raise RevocationIndexError(
+                "CRL at {} is not signed by a trusted issuer".format(crl_location)
+            )
+
+    next_update = (
+        calendar.timegm(crl.next_update.utctimetuple()) if crl.next_update else 0
+    )
+    serials = sorted(
+        revoked.serial_number for revoked in crl if revoked.serial_number >= 0
+    )
+    width = max(1, (serials[-1].bit_length() + 7) // 8) if serials else 1
+
+    return CRLSerials(
+        issuer=issuer,
+        next_update=next_update,
+        serial_count=len(serials),
+        serial_width=width,
+        encoded=b"".join(serial.to_bytes(width, "big") for serial in serials),
+    )
+
+
+def validate_crl(crl_location, expected_issuer, certificate_authorities=None):
+    """
+    Parses a freshly downloaded CRL and checks that it is the CRL we asked for
+    and is still usable: it must be issued by expected_issuer, signed by that
+    issuer's CA (when certificate_authorities is given), and not yet past its
+    nextUpdate.
+    """
+    serials = load_crl_serials(crl_location, certificate_authorities)
+    if serials.issuer != expected_issuer:
+        raise RevocationIndexError(
+            "CRL at {} was not issued by the expected issuer".format(crl_location)
+        )
+
+    if serials.is_expired():
+        raise RevocationIndexError("CRL at {} has expired".format(crl_location))
+
+    return serials
+
+
+@contextmanager
+def revocation_index_lock(path):
+    """
+    Holds an exclusive lock shared by every process that writes the index at
+    path, so that only one of them parses a changed CRL at a time.
+    """
+    with open("{}.lock".format(path), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _encode_revocation_index(
+    crl_locations,
+    previous=None,
+    certificate_authorities=None,
+    logger=None,
+    parsed=None,
+):
+    """
+    Returns a revocation index for the CRLs in crl_locations (a map of issuer
+    DER to CRL path), as the chunks of bytes written to disk. CRLs already parsed by
+    the caller can be passed in parsed, keyed by issuer DER; CRLs whose files
+    are unchanged since the previous index was written are copied from it.
+    Anything else is parsed here. A CRL that can't be parsed or trusted is
+    recorded as failed, so it isn't parsed again until its file changes.
+    """
+    previous = previous or RevocationIndex.empty()
+    parsed = parsed or {}
+    blocks = []
+    for issuer, crl_location in crl_locations.items():
+        if not crl_location:
+            continue
+
+        signature = crl_file_signature(crl_location) or _NO_FILE
+        entry = previous.get(issuer)
+        failed = False
+        if issuer in parsed:
+            serials = parsed[issuer]
+        elif entry and entry.crl_signature == signature:
+            failed = entry.failed
+            serials = CRLSerials(
+                issuer=issuer,
+                next_update=entry.next_update,
+                serial_count=entry.serial_count,
+                serial_width=entry.serial_width,
+                encoded=previous.serials(entry),
+            )
+        else:
+            try:
+                serials = load_crl_serials(crl_location, certificate_authorities)
+                if serials.issuer != issuer:
+                    raise RevocationIndexError(
+                        "CRL at {} does not match its issuer".format(crl_location)
+                    )
+            except (OSError, RevocationIndexError) as err:
+                if logger:
+                    logger.warning(
+                        "Recording CRL as failed in revocation index: {}".format(err)
+                    )
+                failed = True
+                serials = CRLSerials(
+                    issuer=issuer,
+                    next_update=0,
+                    serial_count=0,
+                    serial_width=1,
+                    encoded=b"",
+                )
+
+        blocks.append((signature, serials, failed))
+
+    issuers_offset = _HEADER.size + len(blocks) * _RECORD.size
+    serials_offset = issuers_offset + sum(len(s.issuer) for _, s, _ in blocks)
+
+    header = _HEADER.pack(_MAGIC, INDEX_VERSION, 0, len(blocks), time.time_ns())
+    records = []
+    for (mtime_ns, size), serials, failed in blocks:
+        records.append(
+            _RECORD.pack(
+                issuers_offset,
+                len(serials.issuer),
+                serials.next_update,
+                mtime_ns,
+                size,
+                serials_offset,
+                serials.serial_count,
+                serials.serial_width,
+                _FAILED if failed else 0,
+            )
+        )
+        issuers_offset += len(serials.issuer)
+        serials_offset += len(serials.encoded)
+
+    return (
+        [header, *records]
+        + [s.issuer for _, s, _ in blocks]
+        + [s.encoded for _, s, _ in blocks]
+    )
+
+
+def build_revocation_index(crl_locations, **kwargs):
+    """
+    Builds a revocation index in memory, for a process that can't write or
+    read the one on disk. Takes the same arguments as write_revocation_index
+    but for the path.
+    """
+    return RevocationIndex.from_buffer(
+        b"".join(_encode_revocation_index(crl_locations, **kwargs))
+    )
+
+
+def write_revocation_index(path, crl_locations, **kwargs):
+    """
+    Writes a revocation index to path, for the CRLs and with the arguments
+    described by _encode_revocation_index. It is written to a temporary file
+    and renamed into place, so readers with the old file mapped are
+    unaffected.
+    """
+    chunks = _encode_revocation_index(crl_locations, **kwargs)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as index_file:
+            index_file.writelines(chunks)
+        # mkstemp creates the file readable only by its owner, but the web
+        # workers may run as a different user to the sync job
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+
+
+class CRLResultCache:
+    """
+    Remembers certificates that recently passed a CRL check so that repeat
+    logins can skip verification. Results are held in a per-process LRU and,
+    if a Redis client is given, shared with other processes through Redis.
+
+    Callers build keys that change whenever the relevant CRL changes, so
+    stale results are never read back; they simply age out.
+    """
+
+    KEY_PREFIX = "crl_check"
+
+    def __init__(self, ttl, maxsize=1024, redis=None, logger=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.redis = redis
+        self.logger = logger
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return "{}:{}".format(self.KEY_PREFIX, key)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            expires_at = self._results.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._results.move_to_end(key)
+                    return True
+                del self._results[key]
+
+        if self.redis is None:
+            return False
+
+        try:
+            ttl = self.redis.ttl(self._key(key))
+        except RedisError as err:
+            self._log_error(err)
+            return False
+
+        if ttl is None or ttl <= 0:
+            return False
+
+        self._remember(key, now + ttl)
+        return True
+
+    def add(self, key, expires_at=None):
+        """
+        Records a passing result for key, for at most ttl seconds and never
+        past expires_at.
+        """
+        now = time.time()
+        ttl = self.ttl if expires_at is None else min(self.ttl, expires_at - now)
+        if ttl <= 0:
+            return
+
+        self._remember(key, now + ttl)
+        if self.redis is not None and int(ttl) > 0:
+            try:
+                self.redis.setex(name=self._key(key), value=1, time=int(ttl))
+            except RedisError as err:
+                self._log_error(err)
+
+    def _remember(self, key, expires_at):
+        with self._lock:
+            self._results[key] = expires_at
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def _log_error(self, err):
+        if self.logger:
+            self.logger.warning("CRL result cache unavailable: {}".format(err))
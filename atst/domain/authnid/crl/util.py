@@ -1,9 +1,24 @@
 import json
+import logging
 import os
 import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 import pendulum
 import requests
+from OpenSSL import crypto
+from requests.adapters import HTTPAdapter
+
+from atst.domain.authnid.crl.index import (
+    RevocationIndex,
+    RevocationIndexError,
+    revocation_index_lock,
+    validate_crl,
+    write_revocation_index,
+)
 
 
 class CRLNotFoundError(Exception):
@@ -16,6 +31,12 @@ class CRLParseError(Exception):
 
 MODIFIED_TIME_BUFFER = 15 * 60
 
+SYNC_WORKERS = 8
+# (connect, read) timeouts in seconds for each CRL download
+SYNC_TIMEOUT = (10, 120)
+SYNC_RETRIES = 2
+SYNC_RETRY_BACKOFF = 2
+
 
 CRL_LIST = [
     (
@@ -238,14 +259,42 @@ CRL_LIST = [
 
 
 JSON_CACHE = "crl_locations.json"
+REVOCATION_INDEX = "crl_revocations.idx"
+
+
+_PEM_RE = re.compile(
+    b"-----BEGIN CERTIFICATE-----\r?.+?\r?-----END CERTIFICATE-----\r?\n?", re.DOTALL,
+)
+
+
+def load_certificate_authorities(root_location):
+    """
+    Reads a PEM bundle of CA certificates into a map of subject DER to
+    certificate.
+    """
+    certificate_authorities = {}
+    with open(root_location, "rb") as f:
+        for match in _PEM_RE.finditer(f.read()):
+            ca = crypto.load_certificate(crypto.FILETYPE_PEM, match.group(0))
+            certificate_authorities[ca.get_subject().der()] = ca
+
+    return certificate_authorities
 
 
 def _deserialize_cache_items(cache):
     return {bytes.fromhex(der): data for (der, data) in cache.items()}
 
 
+def crl_locations_cache_path(crl_dir):
+    return "{}/{}".format(crl_dir, JSON_CACHE)
+
+
+def revocation_index_path(crl_dir):
+    return "{}/{}".format(crl_dir, REVOCATION_INDEX)
+
+
 def load_crl_locations_cache(crl_dir):
-    json_location = "{}/{}".format(crl_dir, JSON_CACHE)
+    json_location = crl_locations_cache_path(crl_dir)
     with open(json_location, "r") as json_file:
         cache = json.load(json_file)
         return _deserialize_cache_items(cache)
@@ -258,7 +307,7 @@ def serialize_crl_locations_cache(crl_dir, crl_list=CRL_LIST):
         if os.path.isfile(crl_path):
             crl_cache[crl_issuer] = crl_path
 
-    json_location = "{}/{}".format(crl_dir, JSON_CACHE)
+    json_location = crl_locations_cache_path(crl_dir)
     with open(json_location, "w") as json_file:
         json.dump(crl_cache, json_file)
 
@@ -283,32 +332,54 @@ def existing_crl_modification_time(crl):
         return False
 
 
-def write_crl(out_dir, target_dir, crl_location):
+def write_crl(out_dir, target_dir, crl_location, session=requests, timeout=None):
     crl = crl_local_path(out_dir, crl_location)
     existing = crl_local_path(target_dir, crl_location)
-    options = {"stream": True}
+    options = {"stream": True, "timeout": timeout}
     mod_time = existing_crl_modification_time(existing)
     if mod_time:
         options["headers"] = {"If-Modified-Since": mod_time}
 
-    with requests.get(crl_location, **options) as response:
+    bytes_written = 0
+    with session.get(crl_location, **options) as response:
         if response.status_code > 399:
             raise CRLNotFoundError()
 
         if response.status_code == 304:
-            return (False, existing)
+            return (False, existing, bytes_written)
 
         with open(crl, "wb") as crl_file:
             for chunk in response.iter_content(chunk_size=1024):
                 if chunk:
-                    crl_file.write(chunk)
+                    bytes_written += crl_file.write(chunk)
 
-    return (True, existing)
+    return (True, existing, bytes_written)
 
 
 def remove_bad_crl(out_dir, crl_location):
     crl = crl_local_path(out_dir, crl_location)
+    if os.path.exists(crl):
+        os.remove(crl)
+
+
+def publish_crl(out_dir, target_dir, crl_location):
+    """
+    Moves a downloaded CRL into the target directory. The file is staged
+    next to its destination and renamed over it, so a reader never sees a
+    partially written CRL.
+    """
+    crl = crl_local_path(out_dir, crl_location)
+    published = crl_local_path(target_dir, crl_location)
+    staged = "{}.tmp".format(published)
+    shutil.copyfile(crl, staged)
+    os.replace(staged, published)
     os.remove(crl)
+    return published
+
+
+def _existing_crl(target_dir, crl_location):
+    existing = crl_local_path(target_dir, crl_location)
+    return existing if os.path.isfile(existing) else None
 
 
 def log_error(logger, crl_location):
@@ -320,37 +391,243 @@ def log_error(logger, crl_location):
         )
 
 
-def refresh_crl(out_dir, target_dir, crl_uri, logger):
+_RETRYABLE_ERRORS = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+@dataclass
+class CRLSyncResult:
+    crl_uri: str
+    crl_path: str = None
+    status: str = "failed"
+    bytes_written: int = 0
+    seconds: float = 0
+    attempts: int = 0
+
+
+def refresh_crl(
+    out_dir,
+    target_dir,
+    crl_uri,
+    logger,
+    session=requests,
+    timeout=None,
+    retries=0,
+    retry_backoff=SYNC_RETRY_BACKOFF,
+):
     logger.info("updating CRL from {}".format(crl_uri))
-    try:
-        was_updated, crl_path = write_crl(out_dir, target_dir, crl_uri)
-        if was_updated:
-            logger.info("successfully synced CRL from {}".format(crl_uri))
+    result = CRLSyncResult(crl_uri=crl_uri)
+    start = time.monotonic()
+    while True:
+        result.attempts += 1
+        try:
+            was_updated, crl_path, bytes_written = write_crl(
+                out_dir, target_dir, crl_uri, session=session, timeout=timeout
+            )
+        except _RETRYABLE_ERRORS:
+            remove_bad_crl(out_dir, crl_uri)
+            if result.attempts <= retries:
+                logger.warning(
+                    "retrying CRL from {} (attempt {})".format(crl_uri, result.attempts)
+                )
+                time.sleep(retry_backoff * result.attempts)
+                continue
+            log_error(logger, crl_uri)
+        except CRLNotFoundError:
+            log_error(logger, crl_uri)
         else:
-            logger.info("no updates for CRL from {}".format(crl_uri))
+            if was_updated:
+                logger.info("successfully synced CRL from {}".format(crl_uri))
+            else:
+                logger.info("no updates for CRL from {}".format(crl_uri))
+
+            result.crl_path = crl_path
+            result.status = "updated" if was_updated else "unchanged"
+            result.bytes_written = bytes_written
+        break
+
+    if result.status == "failed":
+        # keep serving the last good copy, if there is one
+        result.crl_path = _existing_crl(target_dir, crl_uri)
+
+    result.seconds = time.monotonic() - start
+    return result
+
+
+def make_sync_session(max_workers=SYNC_WORKERS):
+    """
+    Returns a requests session whose connection pool is large enough that
+    every sync worker can hold a kept-alive connection to the CRL host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def log_sync_summary(logger, results, seconds):
+    for result in results:
+        logger.info(
+            "{}: {}, {} bytes in {:.2f}s after {} attempt(s)".format(
+                result.crl_uri,
+                result.status,
+                result.bytes_written,
+                result.seconds,
+                result.attempts,
+            )
+        )
 
-        return crl_path
-    except requests.exceptions.ChunkedEncodingError:
-        log_error(logger, crl_uri)
-        remove_bad_crl(out_dir, crl_uri)
-    except CRLNotFoundError:
-        log_error(logger, crl_uri)
+    statuses = [result.status for result in results]
+    logger.info(
+        "Synced {} CRLs in {:.2f}s: {} updated, {} unchanged, {} rejected, {} failed, {} bytes downloaded".format(
+            len(results),
+            seconds,
+            statuses.count("updated"),
+            statuses.count("unchanged"),
+            statuses.count("rejected"),
+            statuses.count("failed"),
+            sum(result.bytes_written for result in results),
+        )
+    )
 
 
-def sync_crls(tmp_location, final_location):
-    crl_cache = {}
-    for crl_uri, crl_issuer in CRL_LIST:
-        crl_path = refresh_crl(tmp_location, final_location, crl_uri, logger)
-        crl_cache[crl_issuer] = crl_path
+def validate_and_publish_crls(
+    tmp_location, final_location, crl_list, results, certificate_authorities, logger
+):
+    """
+    Checks each newly downloaded CRL before it replaces the published copy.
+    Valid CRLs are moved into final_location and their parsed serials
+    returned, keyed by issuer DER, so the revocation index can be written
+    without parsing them again. Invalid CRLs are discarded and the previous
+    copy, if any, stays in place.
+    """
+    parsed = {}
+    for (crl_uri, crl_issuer), result in zip(crl_list, results):
+        if result.status != "updated":
+            continue
+
+        issuer = bytes.fromhex(crl_issuer)
+        try:
+            parsed[issuer] = validate_crl(
+                crl_local_path(tmp_location, crl_uri), issuer, certificate_authorities
+            )
+        except RevocationIndexError as err:
+            logger.error("Rejecting CRL from {}: {}".format(crl_uri, err))
+            remove_bad_crl(tmp_location, crl_uri)
+            result.status = "rejected"
+            result.crl_path = _existing_crl(final_location, crl_uri)
+            continue
+
+        result.crl_path = publish_crl(tmp_location, final_location, crl_uri)
+
+    return parsed
+
+
+def write_crl_snapshot(
+    final_location, crl_cache, parsed, certificate_authorities, logger
+):
+    """
+    Writes the revocation index that app workers map instead of parsing CRLs
+    themselves, then the locations map that points them at it. The index is
+    written first so a worker that notices the new locations map finds an
+    index that already matches it.
+    """
+    index_path = revocation_index_path(final_location)
+    with revocation_index_lock(index_path):
+        try:
+            previous = RevocationIndex.load(index_path)
+        except (FileNotFoundError, RevocationIndexError):
+            previous = None
+
+        write_revocation_index(
+            index_path,
+            {bytes.fromhex(issuer): path for issuer, path in crl_cache.items()},
+            previous=previous,
+            certificate_authorities=certificate_authorities,
+            logger=logger,
+            parsed=parsed,
+        )
 
-    json_location = "{}/{}".format(final_location, JSON_CACHE)
-    with open(json_location, "w") as json_file:
+    json_location = crl_locations_cache_path(final_location)
+    staged = "{}.tmp".format(json_location)
+    with open(staged, "w") as json_file:
         json.dump(crl_cache, json_file)
+    os.replace(staged, json_location)
+
+
+def sync_crls(
+    tmp_location,
+    final_location,
+    crl_list=CRL_LIST,
+    logger=None,
+    max_workers=SYNC_WORKERS,
+    timeout=SYNC_TIMEOUT,
+    retries=SYNC_RETRIES,
+    retry_backoff=SYNC_RETRY_BACKOFF,
+    certificate_authorities=None,
+):
+    """
+    Downloads the CRLs in crl_list, validates them, and publishes them to
+    final_location along with a revocation index built from them. If
+    certificate_authorities is given, each CRL must be signed by its
+    issuer's CA to be published.
+    """
+    logger = logger or logging.getLogger(__name__)
+    start = time.monotonic()
+
+    def _refresh(crl_uri):
+        return refresh_crl(
+            tmp_location,
+            final_location,
+            crl_uri,
+            logger,
+            session=session,
+            timeout=timeout,
+            retries=retries,
+            retry_backoff=retry_backoff,
+        )
+
+    with make_sync_session(max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_refresh, [uri for uri, _ in crl_list]))
+
+    parsed = validate_and_publish_crls(
+        tmp_location,
+        final_location,
+        crl_list,
+        results,
+        certificate_authorities,
+        logger,
+    )
+
+    crl_cache = {}
+    for (_, crl_issuer), result in zip(crl_list, results):
+        crl_cache[crl_issuer] = result.crl_path
+
+    write_crl_snapshot(
+        final_location, crl_cache, parsed, certificate_authorities, logger
+    )
+
+    log_sync_summary(logger, results, time.monotonic() - start)
+    return results
 
 
 if __name__ == "__main__":
+    import argparse
     import sys
-    import logging
+
+    parser = argparse.ArgumentParser(description="Download and publish the DoD CRLs")
+    parser.add_argument("tmp_location")
+    parser.add_argument("final_location")
+    parser.add_argument("max_workers", nargs="?", type=int, default=SYNC_WORKERS)
+    parser.add_argument(
+        "--ca-chain", help="PEM bundle of CAs whose signatures the CRLs must carry"
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(
         level=logging.INFO, format="[%(asctime)s]:%(levelname)s: %(message)s"
@@ -358,9 +635,16 @@ if __name__ == "__main__":
     logger = logging.getLogger()
     logger.info("Updating CRLs")
     try:
-        tmp_location = sys.argv[1]
-        final_location = sys.argv[2]
-        sync_crls(tmp_location, final_location)
+        certificate_authorities = (
+            load_certificate_authorities(args.ca_chain) if args.ca_chain else None
+        )
+        sync_crls(
+            args.tmp_location,
+            args.final_location,
+            logger=logger,
+            max_workers=args.max_workers,
+            certificate_authorities=certificate_authorities,
+        )
     except Exception as err:
         logger.exception("Fatal error encountered, stopping")
         sys.exit(1)
@@ -1,42 +1,25 @@
-from atst.utils import first_or_none
 from atst.models.permissions import Permissions
 from atst.domain.exceptions import UnauthorizedError
-from atst.models.portfolio_role import Status as PortfolioRoleStatus
-from atst.models.application_role import Status as ApplicationRoleStatus
+
+from .context import authorization_context
 
 
 class Authorization(object):
     @classmethod
     def has_atat_permission(cls, user, permission):
-        return permission in user.permissions
+        return authorization_context(user).has_atat_permission(permission)
 
     @classmethod
     def has_portfolio_permission(cls, user, portfolio, permission):
-        if Authorization.has_atat_permission(user, permission):
-            return True
-
-        port_role = first_or_none(
-            lambda pr: pr.portfolio == portfolio, user.portfolio_roles
-        )
-        if port_role and port_role.status is not PortfolioRoleStatus.DISABLED:
-            return permission in port_role.permissions
-        else:
-            return False
+        context = authorization_context(user, portfolio.id)
+        return context.has_portfolio_permission(portfolio.id, permission)
 
     @classmethod
     def has_application_permission(cls, user, application, permission):
-        if Authorization.has_portfolio_permission(
-            user, application.portfolio, permission
-        ):
-            return True
-
-        app_role = first_or_none(
-            lambda app_role: app_role.application == application, user.application_roles
+        context = authorization_context(user, application.portfolio_id, application.id)
+        return context.has_application_permission(
+            application.portfolio_id, application.id, permission
         )
-        if app_role and app_role.status is not ApplicationRoleStatus.DISABLED:
-            return permission in app_role.permissions
-        else:
-            return False
 
     @classmethod
     def check_atat_permission(cls, user, permission, message):
@@ -0,0 +1,179 @@
+from dataclasses import dataclass, replace
+from enum import Enum
+
+from atst.models.application_role import Status as ApplicationRoleStatus
+from atst.models.portfolio_role import Status as PortfolioRoleStatus
+
+
+_CONTEXT_ATTR = "_authorization_context"
+
+
+@dataclass(frozen=True)
+class RoleGrant:
+    status: Enum
+    permissions: frozenset
+
+
+@dataclass(frozen=True)
+class AuthorizationContext:
+    """
+    A user's ATAT-wide permissions and their portfolio and application roles
+    keyed by portfolio and application id, so each permission check is a
+    dict lookup rather than a scan over the user's roles.
+
+    A context built for a single resource only holds the user's roles on that
+    resource; portfolio_scope and application_scope then list the ids it can
+    answer for. They are None when every role was loaded.
+    """
+
+    atat_permissions: frozenset
+    portfolio_roles: dict
+    application_roles: dict
+    portfolio_scope: frozenset = None
+    application_scope: frozenset = None
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            atat_permissions=user.permissions,
+            portfolio_roles={
+                role.portfolio_id: RoleGrant(role.status, role.permissions)
+                for role in user.portfolio_roles
+            },
+            application_roles={
+                role.application_id: RoleGrant(role.status, role.permissions)
+                for role in user.application_roles
+            },
+        )
+
+    @classmethod
+    def for_resource(
+        cls,
+        user,
+        portfolio_id,
+        portfolio_role=None,
+        application_id=None,
+        application_role=None,
+    ):
+        """
+        Builds a context scoped to one portfolio and, optionally, one of its
+        applications from the user's roles on them, which may be None.
+        """
+        portfolio_roles = {}
+        if portfolio_role:
+            portfolio_roles[portfolio_id] = RoleGrant(
+                portfolio_role.status, portfolio_role.permissions
+            )
+
+        application_roles = {}
+        if application_role:
+            application_roles[application_id] = RoleGrant(
+                application_role.status, application_role.permissions
+            )
+
+        return cls(
+            atat_permissions=user.permissions,
+            portfolio_roles=portfolio_roles,
+            application_roles=application_roles,
+            portfolio_scope=frozenset([portfolio_id]),
+            application_scope=frozenset([application_id] if application_id else []),
+        )
+
+    def merge(self, scoped):
+        """
+        Returns this context with the user's roles on the resources scoped
+        covers replaced by scoped's, which were read more recently.
+        """
+        portfolio_roles = {
+            portfolio_id: grant
+            for portfolio_id, grant in self.portfolio_roles.items()
+            if portfolio_id not in scoped.portfolio_scope
+        }
+        portfolio_roles.update(scoped.portfolio_roles)
+
+        application_roles = {
+            application_id: grant
+            for application_id, grant in self.application_roles.items()
+            if application_id not in scoped.application_scope
+        }
+        application_roles.update(scoped.application_roles)
+
+        return replace(
+            self,
+            atat_permissions=scoped.atat_permissions,
+            portfolio_roles=portfolio_roles,
+            application_roles=application_roles,
+            portfolio_scope=_union(self.portfolio_scope, scoped.portfolio_scope),
+            application_scope=_union(self.application_scope, scoped.application_scope),
+        )
+
+    def covers(self, portfolio_id=None, application_id=None):
+        if portfolio_id is not None and self.portfolio_scope is not None:
+            if portfolio_id not in self.portfolio_scope:
+                return False
+
+        if application_id is not None and self.application_scope is not None:
+            if application_id not in self.application_scope:
+                return False
+
+        return True
+
+    def has_atat_permission(self, permission):
+        return permission in self.atat_permissions
+
+    def has_portfolio_permission(self, portfolio_id, permission):
+        if self.has_atat_permission(permission):
+            return True
+
+        grant = self.portfolio_roles.get(portfolio_id)
+        return (
+            grant is not None
+            and grant.status is not PortfolioRoleStatus.DISABLED
+            and permission in grant.permissions
+        )
+
+    def has_application_permission(self, portfolio_id, application_id, permission):
+        if self.has_portfolio_permission(portfolio_id, permission):
+            return True
+
+        grant = self.application_roles.get(application_id)
+        return (
+            grant is not None
+            and grant.status is not ApplicationRoleStatus.DISABLED
+            and permission in grant.permissions
+        )
+
+
+def _union(scope, other):
+    # a scope of None already covers everything
+    return None if scope is None else scope | other
+
+
+def attach_context(user, context):
+    user.__dict__[_CONTEXT_ATTR] = context
+
+
+def detach_context(user):
+    user.__dict__.pop(_CONTEXT_ATTR, None)
+
+
+def context_for(user):
+    return user.__dict__.get(_CONTEXT_ATTR)
+
+
+def authorization_context(user, portfolio_id=None, application_id=None):
+    """
+    Returns the AuthorizationContext for user, building it from the user's
+    roles the first time it is asked for. It is kept on the instance, so it
+    lives as long as the request's session does; flushing a change to the
+    user's roles detaches it.
+
+    If the attached context is scoped to a different resource than the one
+    given, it is replaced with one built from all of the user's roles.
+    """
+    context = context_for(user)
+    if context is None or not context.covers(portfolio_id, application_id):
+        context = AuthorizationContext.from_user(user)
+        attach_context(user, context)
+
+    return context
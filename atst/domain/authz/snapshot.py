@@ -0,0 +1,214 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import chain
+from uuid import UUID
+
+from flask import current_app as app, has_app_context
+from sqlalchemy import Date, DateTime, inspect
+from sqlalchemy.dialects.postgresql import UUID as UUIDType
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from atst.database import db
+from atst.domain.users import Users
+from atst.models import ApplicationRole, PermissionSet, PortfolioRole, User
+from atst.models.application_role import Status as ApplicationRoleStatus
+from atst.models.portfolio_role import Status as PortfolioRoleStatus
+from atst.utils.versioned_cache import VersionedCache, invalidate_on_commit
+
+from .context import AuthorizationContext, RoleGrant, attach_context, detach_context
+
+
+_SNAPSHOT_ATTR = "_authorization_snapshot"
+
+
+def _dump_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    elif isinstance(value, UUID):
+        return str(value)
+    else:
+        return value
+
+
+def _load_column(column_type, value):
+    if value is None:
+        return None
+    elif isinstance(column_type, DateTime):
+        return datetime.fromisoformat(value)
+    elif isinstance(column_type, Date):
+        return date.fromisoformat(value)
+    elif isinstance(column_type, UUIDType):
+        return UUID(value)
+    else:
+        return value
+
+
+def _dump_roles(roles):
+    return {
+        str(resource_id): [grant.status.name, sorted(grant.permissions)]
+        for resource_id, grant in roles.items()
+    }
+
+
+def _load_roles(roles, statuses):
+    return {
+        UUID(resource_id): RoleGrant(statuses[status], frozenset(permissions))
+        for resource_id, (status, permissions) in roles.items()
+    }
+
+
+@dataclass(frozen=True)
+class AuthorizationSnapshot:
+    """
+    Everything needed to authorize the current user without touching the
+    database: their user row and their AuthorizationContext.
+    """
+
+    version: tuple
+    user_id: UUID
+    user_columns: dict
+    context: AuthorizationContext
+
+    @classmethod
+    def from_user(cls, user, version=None):
+        return cls(
+            version=version,
+            user_id=user.id,
+            user_columns={
+                attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs
+            },
+            context=AuthorizationContext.from_user(user),
+        )
+
+    def to_user(self, session):
+        """
+        Returns the snapshot's user attached to session. Its columns come from
+        the snapshot, so no query is issued; relationships still lazy load.
+        """
+        user = session.identity_map.get(identity_key(User, self.user_id))
+        if user is None:
+            user = User(**self.user_columns)
+            make_transient_to_detached(user)
+            user = session.merge(user, load=False)
+
+        return user
+
+    def to_dict(self):
+        return {
+            "user_id": str(self.user_id),
+            "user_columns": {
+                key: _dump_value(value) for key, value in self.user_columns.items()
+            },
+            "atat_permissions": sorted(self.context.atat_permissions),
+            "portfolio_roles": _dump_roles(self.context.portfolio_roles),
+            "application_roles": _dump_roles(self.context.application_roles),
+        }
+
+    @classmethod
+    def from_dict(cls, data, version=None):
+        columns = {
+            attr.key: attr.columns[0].type for attr in inspect(User).column_attrs
+        }
+        return cls(
+            version=version,
+            user_id=UUID(data["user_id"]),
+            user_columns={
+                key: _load_column(columns[key], value)
+                for key, value in data["user_columns"].items()
+            },
+            context=AuthorizationContext(
+                atat_permissions=frozenset(data["atat_permissions"]),
+                portfolio_roles=_load_roles(
+                    data["portfolio_roles"], PortfolioRoleStatus
+                ),
+                application_roles=_load_roles(
+                    data["application_roles"], ApplicationRoleStatus
+                ),
+            ),
+        )
+
+
+def attach_snapshot(user, snapshot):
+    setattr(user, _SNAPSHOT_ATTR, snapshot)
+    attach_context(user, snapshot.context)
+
+
+def detach_snapshot(user):
+    user.__dict__.pop(_SNAPSHOT_ATTR, None)
+    detach_context(user)
+
+
+def snapshot_for(user):
+    return user.__dict__.get(_SNAPSHOT_ATTR)
+
+
+class AuthorizationSnapshots(VersionedCache):
+    """
+    Caches AuthorizationSnapshots in Redis. Each user's version is bumped
+    when their user record or roles change, and the epoch when permission
+    sets themselves do.
+
+    A snapshot isn't used while an invalidation is still unsent, since it
+    could grant roles that have since been revoked.
+    """
+
+    KEY_PREFIX = "authz"
+    # bump when AuthorizationSnapshot changes shape so old snapshots are ignored
+    VALUE_KEY = "snapshot:5"
+    DESCRIPTION = "Authorization snapshot cache"
+
+    def get_user(self, user_id):
+        """
+        Returns the user with user_id with their authorization snapshot
+        attached, reading both from Redis when possible.
+        """
+        if not self.ttl:
+            return Users.get(user_id)
+
+        version, cached = self._load(user_id)
+        if cached is None:
+            user = Users.get_with_permissions(user_id)
+            snapshot = AuthorizationSnapshot.from_user(user, version)
+            if version is not None:
+                self._store(user_id, version, snapshot.to_dict())
+        else:
+            snapshot = AuthorizationSnapshot.from_dict(cached, version)
+            user = snapshot.to_user(db.session)
+
+        attach_snapshot(user, snapshot)
+        return user
+
+
+def _changed_authorizations(session):
+    user_ids = set()
+    everyone = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, (PortfolioRole, ApplicationRole)):
+            # include the previous user if the role was reassigned
+            history = inspect(obj).attrs.user_id.history
+            user_ids.update(user_id for user_id in history.sum() if user_id)
+        elif isinstance(obj, PermissionSet):
+            everyone = True
+
+    return user_ids, everyone
+
+
+def _invalidate(session, user_ids, everyone):
+    for user in list(session.identity_map.values()):
+        if isinstance(user, User) and (everyone or user.id in user_ids):
+            detach_snapshot(user)
+
+    if has_app_context() and hasattr(app, "authz_snapshots"):
+        app.authz_snapshots.invalidate(user_ids, everyone)
+
+
+# Invalidating at flush time keeps this session from serving stale snapshots,
+# but another request could rebuild one from the database before the
+# transaction commits. Invalidating again once the change is visible closes
+# that window.
+invalidate_on_commit(
+    "authz_invalidations", _changed_authorizations, _invalidate, on_flush=_invalidate
+)
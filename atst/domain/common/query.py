@@ -1,3 +1,10 @@
+import base64
+import binascii
+from datetime import datetime
+import json
+from uuid import UUID
+
+from sqlalchemy import tuple_
 from sqlalchemy.exc import DataError
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -5,38 +12,98 @@ from atst.domain.exceptions import NotFoundError
 from atst.database import db
 
 
+def encode_cursor(time_created, id_):
+    return base64.urlsafe_b64encode(
+        json.dumps([time_created.isoformat(), str(id_)]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (time_created, id) in a cursor, or None if it isn't valid."""
+    if not cursor:
+        return None
+
+    try:
+        time_created, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(time_created), UUID(id_))
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
 class Paginator(object):
     """
-    Uses the Flask-SQLAlchemy extension's pagination method to paginate
-    a query set.
+    Paginates a query set newest first, by its `time_created` and then `id`.
+
+    Pages are found by seeking past a cursor, the keys of the last (or first)
+    row of the page before (or after), rather than with OFFSET, so a page
+    deep in a large table is as quick to load as the first. Pages aren't
+    numbered, since that would take counting the rows before them: the
+    first, previous, next and last pages are linked to instead. The last
+    page is the oldest `per_page` rows.
 
     Also acts as a proxy object so that the results of the query set can be iterated
     over without needing to call `.items`.
     """
 
-    def __init__(self, query_set):
-        self.query_set = query_set
+    def __init__(self, items, per_page, has_prev, has_next):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
 
     @classmethod
-    def get_pagination_opts(cls, request, default_page=1, default_per_page=100):
+    def get_pagination_opts(cls, request, default_per_page=100):
         return {
-            "page": int(request.args.get("page", default_page)),
             "per_page": int(request.args.get("perPage", default_per_page)),
+            "after": request.args.get("after"),
+            "before": request.args.get("before"),
+            "last": bool(request.args.get("last")),
         }
 
     @classmethod
     def paginate(cls, query, pagination_opts=None):
-        if pagination_opts is not None:
-            return cls(
-                query.paginate(
-                    page=pagination_opts["page"], per_page=pagination_opts["per_page"]
-                )
-            )
-        else:
+        if pagination_opts is None:
             return query.all()
 
-    def __getattr__(self, name):
-        return getattr(self.query_set, name)
+        model = query.column_descriptions[0]["entity"]
+        keys = tuple_(model.time_created, model.id)
+        newest_first = query.order_by(None).order_by(
+            model.time_created.desc(), model.id.desc()
+        )
+        oldest_first = query.order_by(None).order_by(
+            model.time_created.asc(), model.id.asc()
+        )
+        per_page = pagination_opts["per_page"]
+        after = decode_cursor(pagination_opts.get("after"))
+        before = decode_cursor(pagination_opts.get("before"))
+
+        # fetch one row more than a page to find out whether there's another
+        if before is not None or pagination_opts.get("last"):
+            if before is not None:
+                oldest_first = oldest_first.filter(keys > before)
+            rows = oldest_first.limit(per_page + 1).all()
+            items = list(reversed(rows[:per_page]))
+            has_prev = len(rows) > per_page
+            has_next = before is not None
+        else:
+            if after is not None:
+                newest_first = newest_first.filter(keys < after)
+            rows = newest_first.limit(per_page + 1).all()
+            items = rows[:per_page]
+            has_prev = after is not None
+            has_next = len(rows) > per_page
+
+        return cls(items, per_page=per_page, has_prev=has_prev, has_next=has_next)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return encode_cursor(self.items[-1].time_created, self.items[-1].id)
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return encode_cursor(self.items[0].time_created, self.items[0].id)
 
     def __iter__(self):
         return self.items.__iter__()
@@ -1,6 +1,6 @@
-from typing import Dict
+from typing import Dict, List, Union
 import re
-from uuid import uuid4
+from uuid import UUID, uuid4
 
 from atst.models.user import User
 from atst.models.application import Application
@@ -218,6 +218,30 @@ class CloudProviderInterface:
         """
         raise NotImplementedError()
 
+    def create_or_update_users(
+        self, auth_credentials: Dict, environment_roles: List[EnvironmentRole]
+    ) -> Dict[UUID, Union[str, UserProvisioningException]]:
+        """Creates users or updates existing users' roles in a single environment,
+        authenticating once for the whole batch.
+
+        Arguments:
+            auth_credentials -- Object containing CSP account credentials
+            environment_roles -- instances of EnvironmentRole in the same environment,
+                                 each given the CSP role in its `role`
+
+        Returns:
+            dict: The interal csp_user_id of each created/updated user account, or
+            the UserProvisioningException for a user that couldn't be created or
+            modified, keyed by EnvironmentRole id
+
+        Raises:
+            AuthenticationException: Problem with the credentials
+            AuthorizationException: Credentials not authorized for current action(s)
+            ConnectionException: Issue with the CSP API connection
+            UnknownServerException: Unknown issue on the CSP side
+        """
+        raise NotImplementedError()
+
     def disable_user(self, auth_credentials: Dict, csp_user_id: str) -> bool:
         """Revoke all privileges for a user. Used to prevent user access while a full
         delete is being processed.
@@ -343,6 +367,27 @@ class MockCloudProvider(CloudProviderInterface):
         self._maybe_raise(self.UNAUTHORIZED_RATE, self.AUTHORIZATION_EXCEPTION)
         return self._id()
 
+    def create_or_update_users(self, auth_credentials, environment_roles):
+        self._authorize(auth_credentials)
+
+        self._delay(1, 5)
+        self._maybe_raise(self.NETWORK_FAILURE_PCT, self.NETWORK_EXCEPTION)
+        self._maybe_raise(self.SERVER_FAILURE_PCT, self.SERVER_EXCEPTION)
+        self._maybe_raise(self.UNAUTHORIZED_RATE, self.AUTHORIZATION_EXCEPTION)
+
+        results = {}
+        for environment_role in environment_roles:
+            if self._with_failure and self._maybe(self.ATAT_ADMIN_CREATE_FAILURE_PCT):
+                results[environment_role.id] = UserProvisioningException(
+                    environment_role.environment.id,
+                    environment_role.application_role.user_id,
+                    "Could not create user.",
+                )
+            else:
+                results[environment_role.id] = self._id()
+
+        return results
+
     def disable_user(self, auth_credentials, csp_user_id):
         self._authorize(auth_credentials)
         self._maybe_raise(self.NETWORK_FAILURE_PCT, self.NETWORK_EXCEPTION)
@@ -405,6 +450,7 @@ class AzureSDKProvider(object):
         from azure.mgmt.resource import policy
         import azure.graphrbac as graphrbac
         import azure.common.credentials as credentials
+        import msrestazure.azure_exceptions as exceptions
         from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
 
         self.subscription = subscription
@@ -412,6 +458,7 @@ class AzureSDKProvider(object):
         self.managementgroups = managementgroups
         self.graphrbac = graphrbac
         self.credentials = credentials
+        self.exceptions = exceptions
         self.policy = policy
         # may change to a JEDI cloud
         self.cloud = AZURE_PUBLIC_CLOUD
@@ -490,6 +537,64 @@ class AzureCloudProvider(CloudProviderInterface):
             "role_name": role_assignment_id,
         }
 
+    def create_or_update_users(
+        self, auth_credentials: Dict, environment_roles: List[EnvironmentRole]
+    ) -> Dict[UUID, Union[str, UserProvisioningException]]:
+        # every role is in the same environment, so one set of clients serves
+        # the whole batch
+        environment = environment_roles[0].environment
+        credentials = self._get_credential_obj(auth_credentials)
+        auth_client = self.sdk.authorization.AuthorizationManagementClient(
+            credentials, environment.cloud_id
+        )
+        graph_creds = self._get_credential_obj(
+            auth_credentials, resource="https://graph.windows.net"
+        )
+        graph_client = self.sdk.graphrbac.GraphRbacManagementClient(
+            graph_creds, auth_credentials.get("tenant_id")
+        )
+
+        results = {}
+        for environment_role in environment_roles:
+            try:
+                csp_user_id = environment_role.csp_user_id
+                if csp_user_id is None:
+                    csp_user_id = self._create_user(
+                        graph_client, environment_role.application_role.user
+                    )
+
+                role_assignment_create_params = auth_client.role_assignments.models.RoleAssignmentCreateParameters(
+                    role_definition_id=environment_role.role, principal_id=csp_user_id,
+                )
+                auth_client.role_assignments.create(
+                    scope=f"/subscriptions/{environment.cloud_id}/",
+                    role_assignment_name=str(uuid4()),
+                    parameters=role_assignment_create_params,
+                )
+                results[environment_role.id] = csp_user_id
+            except self.sdk.exceptions.CloudError as err:
+                results[environment_role.id] = UserProvisioningException(
+                    environment.id,
+                    environment_role.application_role.user_id,
+                    err.message,
+                )
+
+        return results
+
+    def _create_user(self, graph_client, user: User) -> str:
+        user_create_params = self.sdk.graphrbac.models.UserCreateParameters(
+            account_enabled=True,
+            display_name=user.full_name,
+            mail_nickname="?",  # derived from the user's email
+            user_principal_name="?",  # in one of the tenant's verified domains
+            password_profile=self.sdk.graphrbac.models.PasswordProfile(
+                password="?", force_change_password_next_login=True
+            ),
+        )
+        csp_user = graph_client.users.create(user_create_params)
+
+        return csp_user.object_id
+
     def _create_application(self, auth_credentials: Dict, application: Application):
         management_group_name = str(uuid4())  # can be anything, not just uuid
         display_name = application.name  # Does this need to be unique?
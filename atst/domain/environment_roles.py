@@ -1,3 +1,6 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 from flask import current_app as app
 
@@ -5,13 +8,15 @@ from atst.database import db
 from atst.models import (
     Environment,
     EnvironmentRole,
+    EnvironmentRoleJobFailure,
     Application,
     ApplicationRole,
     ApplicationRoleStatus,
 )
 from atst.domain.exceptions import NotFoundError
+from atst.models.utils import claim_many_for_update
 from uuid import UUID
-from typing import List
+from typing import Dict, List, Tuple
 
 
 class EnvironmentRoles(object):
@@ -90,18 +95,72 @@ class EnvironmentRoles(object):
         )
 
     @classmethod
-    def get_environment_roles_pending_creation(cls) -> List[UUID]:
-        results = (
+    def _pending_creation_query(cls, max_attempts=None):
+        query = (
             db.session.query(EnvironmentRole.id)
             .join(Environment)
             .join(ApplicationRole)
             .filter(Environment.deleted == False)
             .filter(EnvironmentRole.status == EnvironmentRole.Status.PENDING)
             .filter(ApplicationRole.status == ApplicationRoleStatus.ACTIVE)
-            .all()
         )
+
+        if max_attempts is not None:
+            # each failed attempt to provision a role records a job failure
+            given_up = (
+                db.session.query(EnvironmentRoleJobFailure.environment_role_id)
+                .group_by(EnvironmentRoleJobFailure.environment_role_id)
+                .having(func.count(EnvironmentRoleJobFailure.id) >= max_attempts)
+            )
+            query = query.filter(EnvironmentRole.id.notin_(given_up))
+
+        return query
+
+    @classmethod
+    def get_environment_roles_pending_creation(cls) -> List[UUID]:
+        results = cls._pending_creation_query().all()
         return [id_ for id_, in results]
 
+    @classmethod
+    def claim_environment_roles_pending_creation(
+        cls, limit=None, max_attempts=None
+    ) -> List[Tuple[UUID, datetime]]:
+        """
+        Claims up to `limit` of the environment roles pending creation,
+        skipping any that are already claimed or have already failed
+        `max_attempts` times, and returns their ids and claim expiries.
+        """
+        return claim_many_for_update(
+            EnvironmentRole,
+            cls._pending_creation_query(max_attempts=max_attempts),
+            limit=limit,
+        )
+
+    @classmethod
+    def claim_environment_roles_pending_creation_by_environment(
+        cls, limit=None, max_attempts=None
+    ) -> Dict[Tuple[UUID, datetime], List[UUID]]:
+        """
+        Claims environment roles pending creation as
+        claim_environment_roles_pending_creation does, and returns the ids of
+        the roles claimed grouped by their environment id and claim expiry.
+        """
+        claims = dict(
+            cls.claim_environment_roles_pending_creation(
+                limit=limit, max_attempts=max_attempts
+            )
+        )
+        if not claims:
+            return {}
+
+        batches = defaultdict(list)
+        for id_, environment_id in db.session.query(
+            EnvironmentRole.id, EnvironmentRole.environment_id
+        ).filter(EnvironmentRole.id.in_(claims)):
+            batches[(environment_id, claims[id_])].append(id_)
+
+        return dict(batches)
+
     @classmethod
     def disable(cls, environment_role_id):
         environment_role = EnvironmentRoles.get_by_id(environment_role_id)
@@ -1,6 +1,7 @@
+from datetime import datetime
 from sqlalchemy import func, or_
 from sqlalchemy.orm.exc import NoResultFound
-from typing import List
+from typing import List, Tuple
 from uuid import UUID
 
 from atst.database import db
@@ -12,6 +13,7 @@ from atst.models import (
     CLIN,
 )
 from atst.domain.environment_roles import EnvironmentRoles
+from atst.models.utils import claim_many_for_update
 from atst.utils import commit_or_raise_already_exists_error
 
 from .exceptions import NotFoundError, DisabledError
@@ -118,14 +120,24 @@ class Environments(object):
             )
         )
 
+    @classmethod
+    def _pending_creation_query(cls, now):
+        return cls.base_provision_query(now).filter(Environment.cloud_id == None)
+
+    @classmethod
+    def _pending_atat_user_creation_query(cls, now):
+        return (
+            cls.base_provision_query(now)
+            .filter(Environment.cloud_id != None)
+            .filter(Environment.root_user_info == None)
+        )
+
     @classmethod
     def get_environments_pending_creation(cls, now) -> List[UUID]:
         """
         Any environment with an active CLIN that doesn't yet have a `cloud_id`.
         """
-        results = (
-            cls.base_provision_query(now).filter(Environment.cloud_id == None).all()
-        )
+        results = cls._pending_creation_query(now).all()
         return [id_ for id_, in results]
 
     @classmethod
@@ -133,9 +145,30 @@ class Environments(object):
         """
         Any environment with an active CLIN that has a cloud_id but no `root_user_info`.
         """
-        results = (
-            cls.base_provision_query(now)
-            .filter(Environment.cloud_id != None)
-            .filter(Environment.root_user_info == None)
-        ).all()
+        results = cls._pending_atat_user_creation_query(now).all()
         return [id_ for id_, in results]
+
+    @classmethod
+    def claim_environments_pending_creation(
+        cls, now, limit=None
+    ) -> List[Tuple[UUID, datetime]]:
+        """
+        Claims up to `limit` of the environments pending creation, skipping
+        any that are already claimed, and returns their ids and claim expiries.
+        """
+        return claim_many_for_update(
+            Environment, cls._pending_creation_query(now), limit=limit
+        )
+
+    @classmethod
+    def claim_environments_pending_atat_user_creation(
+        cls, now, limit=None
+    ) -> List[Tuple[UUID, datetime]]:
+        """
+        Claims up to `limit` of the environments pending ATAT user creation,
+        skipping any that are already claimed, and returns their ids and claim
+        expiries.
+        """
+        return claim_many_for_update(
+            Environment, cls._pending_atat_user_creation_query(now), limit=limit
+        )
@@ -65,6 +65,28 @@ class Portfolios(object):
             portfolios = PortfoliosQuery.get_for_user(user)
         return portfolios
 
+    @classmethod
+    def summaries_for_user(cls, user):
+        """
+        Like for_user, but returns a row per portfolio with its id, name,
+        application_count, active_task_order_count and funding_end_date
+        rather than Portfolio objects.
+        """
+        if Authorization.has_atat_permission(user, Permissions.VIEW_PORTFOLIO):
+            return PortfoliosQuery.get_all_summaries()
+        else:
+            return PortfoliosQuery.get_summaries_for_user(user)
+
+    @classmethod
+    def links_for_user(cls, user):
+        """
+        Like for_user, but only loads each portfolio's id and name.
+        """
+        if Authorization.has_atat_permission(user, Permissions.VIEW_PORTFOLIO):
+            return PortfoliosQuery.get_all_links()
+        else:
+            return PortfoliosQuery.get_links_for_user(user)
+
     @classmethod
     def add_member(cls, portfolio, member, permission_sets=None):
         portfolio_role = PortfolioRoles.add(member, portfolio.id, permission_sets)
@@ -1,4 +1,6 @@
-from sqlalchemy import or_
+import pendulum
+from sqlalchemy import func
+
 from atst.database import db
 from atst.domain.common import Query
 from atst.models.portfolio import Portfolio
@@ -8,52 +10,132 @@ from atst.models.application_role import (
     Status as ApplicationRoleStatus,
 )
 from atst.models.application import Application
+from atst.models.clin import CLIN
+from atst.models.task_order import TaskOrder
 
 
 class PortfoliosQuery(Query):
     model = Portfolio
 
+    @classmethod
+    def _ids_for_user(cls, user):
+        """
+        The ids of the portfolios user has an active role in, either directly
+        or through one of the portfolio's applications. Each half of the
+        union is a lookup on the role table's (user_id, ...) index.
+        """
+        portfolio_ids = db.session.query(PortfolioRole.portfolio_id).filter(
+            PortfolioRole.user_id == user.id,
+            PortfolioRole.status == PortfolioRoleStatus.ACTIVE,
+        )
+        application_portfolio_ids = (
+            db.session.query(Application.portfolio_id)
+            .join(ApplicationRole, ApplicationRole.application_id == Application.id)
+            .filter(
+                ApplicationRole.user_id == user.id,
+                ApplicationRole.status == ApplicationRoleStatus.ACTIVE,
+                ApplicationRole.deleted == False,
+            )
+        )
+        return portfolio_ids.union(application_portfolio_ids)
+
     @classmethod
     def get_for_user(cls, user):
         return (
             db.session.query(Portfolio)
-            .filter(
-                or_(
-                    Portfolio.id.in_(
-                        db.session.query(Portfolio.id)
-                        .join(Application)
-                        .filter(Portfolio.id == Application.portfolio_id)
-                        .filter(
-                            Application.id.in_(
-                                db.session.query(Application.id)
-                                .join(ApplicationRole)
-                                .filter(
-                                    ApplicationRole.application_id == Application.id
-                                )
-                                .filter(ApplicationRole.user_id == user.id)
-                                .filter(
-                                    ApplicationRole.status
-                                    == ApplicationRoleStatus.ACTIVE
-                                )
-                                .filter(ApplicationRole.deleted == False)
-                                .subquery()
-                            )
-                        )
-                    ),
-                    Portfolio.id.in_(
-                        db.session.query(Portfolio.id)
-                        .join(PortfolioRole)
-                        .filter(PortfolioRole.user == user)
-                        .filter(PortfolioRole.status == PortfolioRoleStatus.ACTIVE)
-                        .subquery()
-                    ),
-                )
+            .filter(Portfolio.id.in_(cls._ids_for_user(user).subquery()))
+            .filter(Portfolio.deleted == False)
+            .order_by(Portfolio.name.asc())
+            .all()
+        )
+
+    @classmethod
+    def get_links_for_user(cls, user):
+        return (
+            db.session.query(Portfolio.id, Portfolio.name)
+            .filter(Portfolio.id.in_(cls._ids_for_user(user).subquery()))
+            .filter(Portfolio.deleted == False)
+            .order_by(Portfolio.name.asc())
+            .all()
+        )
+
+    @classmethod
+    def get_all_links(cls):
+        return (
+            db.session.query(Portfolio.id, Portfolio.name)
+            .filter(Portfolio.deleted == False)
+            .order_by(Portfolio.name.asc())
+            .all()
+        )
+
+    @classmethod
+    def _summaries_query(cls):
+        """
+        One row per portfolio with its id and name, its number of applications
+        and active task orders, and the latest end date of those task orders,
+        all computed by the database.
+
+        A task order is active when it has been signed and today falls between
+        the earliest start date and the latest end date of its CLINs, which is
+        how TaskOrder.status decides it.
+        """
+        today = pendulum.today(tz="UTC").date()
+        task_order_dates = (
+            db.session.query(
+                TaskOrder.id.label("id"),
+                TaskOrder.portfolio_id.label("portfolio_id"),
+                func.max(CLIN.end_date).label("end_date"),
+            )
+            .join(CLIN, CLIN.task_order_id == TaskOrder.id)
+            .filter(TaskOrder.signed_at != None)
+            .group_by(TaskOrder.id)
+            .having(func.min(CLIN.start_date) <= today)
+            .having(func.max(CLIN.end_date) >= today)
+            .subquery()
+        )
+        application_counts = (
+            db.session.query(
+                Application.portfolio_id.label("portfolio_id"),
+                func.count(Application.id).label("count"),
+            )
+            .filter(Application.deleted == False)
+            .group_by(Application.portfolio_id)
+            .subquery()
+        )
+
+        return (
+            db.session.query(
+                Portfolio.id,
+                Portfolio.name,
+                func.coalesce(func.max(application_counts.c.count), 0).label(
+                    "application_count"
+                ),
+                func.count(task_order_dates.c.id).label("active_task_order_count"),
+                func.max(task_order_dates.c.end_date).label("funding_end_date"),
+            )
+            .outerjoin(
+                application_counts, application_counts.c.portfolio_id == Portfolio.id
+            )
+            .outerjoin(
+                task_order_dates, task_order_dates.c.portfolio_id == Portfolio.id
             )
             .filter(Portfolio.deleted == False)
+            .group_by(Portfolio.id)
             .order_by(Portfolio.name.asc())
+        )
+
+    @classmethod
+    def get_summaries_for_user(cls, user):
+        return (
+            cls._summaries_query()
+            .filter(Portfolio.id.in_(cls._ids_for_user(user).subquery()))
             .all()
         )
 
+    @classmethod
+    def get_all_summaries(cls):
+        return cls._summaries_query().all()
+
     @classmethod
     def create_portfolio_role(cls, user, portfolio, **kwargs):
         return PortfolioRole(user=user, portfolio=portfolio, **kwargs)
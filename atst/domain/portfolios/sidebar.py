@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from itertools import chain
+from uuid import UUID
+
+from flask import current_app as app, has_app_context
+from sqlalchemy import inspect
+
+from atst.models import (
+    Application,
+    ApplicationRole,
+    PermissionSet,
+    Portfolio,
+    PortfolioRole,
+    User,
+)
+from atst.utils.versioned_cache import VersionedCache, invalidate_on_commit
+
+from .portfolios import Portfolios
+
+
+@dataclass(frozen=True)
+class PortfolioLink:
+    id: UUID
+    name: str
+
+
+class SidebarPortfolios(VersionedCache):
+    """
+    Caches the id and name of each portfolio a user can see, which is all
+    the navigation sidebar needs, in Redis. Each user's version is bumped
+    when their roles change, and the epoch when portfolios or applications
+    do.
+    """
+
+    KEY_PREFIX = "sidebar"
+    VALUE_KEY = "portfolios:2"
+    DESCRIPTION = "Sidebar portfolio cache"
+
+    def for_user(self, user):
+        if not self.ttl:
+            return self._build(user)
+
+        version, cached = self._load(user.id)
+        if cached is not None:
+            return [PortfolioLink(UUID(id), name) for id, name in cached]
+
+        links = self._build(user)
+        if version is not None:
+            self._store(user.id, version, [[str(link.id), link.name] for link in links])
+
+        return links
+
+    def _build(self, user):
+        return [PortfolioLink(id, name) for id, name in Portfolios.links_for_user(user)]
+
+
+def _changes_listing(session, obj, *attrs):
+    if obj in session.deleted:
+        return True
+
+    state = inspect(obj)
+    return any(getattr(state.attrs, attr).history.has_changes() for attr in attrs)
+
+
+def _changed_sidebars(session):
+    user_ids = set()
+    everyone = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            # a user's permission sets decide whether they see every portfolio
+            user_ids.add(obj.id)
+        elif isinstance(obj, (PortfolioRole, ApplicationRole)):
+            history = inspect(obj).attrs.user_id.history
+            user_ids.update(user_id for user_id in history.sum() if user_id)
+        elif isinstance(obj, Portfolio):
+            # a new portfolio is listed for everyone who can see all of them
+            everyone = (
+                everyone
+                or obj in session.new
+                or _changes_listing(session, obj, "name", "deleted")
+            )
+        elif isinstance(obj, Application):
+            everyone = everyone or _changes_listing(
+                session, obj, "portfolio_id", "deleted"
+            )
+        elif isinstance(obj, PermissionSet):
+            everyone = True
+
+    return user_ids, everyone
+
+
+def _invalidate(session, user_ids, everyone):
+    if has_app_context() and hasattr(app, "sidebar_portfolios"):
+        app.sidebar_portfolios.invalidate(user_ids, everyone)
+
+
+# the cached lists are only read by other requests, so there is nothing to
+# invalidate until the change is visible to them
+invalidate_on_commit("sidebar_invalidations", _changed_sidebars, _invalidate)
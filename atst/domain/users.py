@@ -1,9 +1,10 @@
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 from atst.database import db
-from atst.models import User
+from atst.models import ApplicationRole, PortfolioRole, User
 
 from .permission_sets import PermissionSets
 from .exceptions import NotFoundError, AlreadyExistsError, UnauthorizedError
@@ -19,6 +20,32 @@ class Users(object):
 
         return user
 
+    @classmethod
+    def get_with_permissions(cls, user_id):
+        """
+        Loads a user along with all of their roles and permission sets, in a
+        fixed number of queries.
+        """
+        try:
+            user = (
+                db.session.query(User)
+                .options(
+                    selectinload(User.permission_sets),
+                    selectinload(User.portfolio_roles).selectinload(
+                        PortfolioRole.permission_sets
+                    ),
+                    selectinload(User.application_roles).selectinload(
+                        ApplicationRole.permission_sets
+                    ),
+                )
+                .filter_by(id=user_id)
+                .one()
+            )
+        except NoResultFound:
+            raise NotFoundError("user")
+
+        return user
+
     @classmethod
     def get_by_dod_id(cls, dod_id):
         try:
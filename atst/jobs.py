@@ -1,17 +1,23 @@
+import random
+
+from celery.exceptions import Ignore
 from flask import current_app as app
 import pendulum
+from sqlalchemy import func
 
 from atst.database import db
 from atst.queue import celery
 from atst.models import (
+    AuditEvent,
     EnvironmentJobFailure,
     EnvironmentRoleJobFailure,
     EnvironmentRole,
 )
+from atst.domain.audit_event_partitions import AuditEventPartitions
 from atst.domain.csp.cloud import CloudProviderInterface, GeneralCSPException
 from atst.domain.environments import Environments
 from atst.domain.environment_roles import EnvironmentRoles
-from atst.models.utils import claim_for_update
+from atst.models.utils import claim_all_for_update, claim_expiry, claim_for_update
 from atst.utils.localization import translate
 
 
@@ -50,10 +56,66 @@ def send_notification_mail(recipients, subject, body):
     app.mailer.send(recipients, subject, body)
 
 
-def do_create_environment(csp: CloudProviderInterface, environment_id=None):
+@celery.task(bind=True)
+def write_audit_events(self):
+    """
+    Writes the audit events in the audit event stream to the database, a
+    batch of up to AUDIT_LOG_STREAM_BATCH_SIZE at a time, until it is empty.
+    A batch read again because it was written but not acknowledged is skipped.
+    """
+    consumer = self.request.hostname or self.name
+    batch_size = app.config["AUDIT_LOG_STREAM_BATCH_SIZE"]
+
+    while True:
+        entries = app.audit_event_stream.read(consumer, batch_size)
+        if not entries:
+            return
+
+        ids, audit_events = zip(*entries)
+        AuditEvent.save_all(db.session, list(audit_events), skip_existing=True)
+        db.session.commit()
+        app.audit_event_stream.acknowledge(ids)
+
+
+def do_maintain_audit_events():
+    created = AuditEventPartitions.create_upcoming()
+    for partition in created:
+        app.logger.info("Created audit event partition {}".format(partition))
+
+    archive_dir = app.config.get("AUDIT_LOG_ARCHIVE_DIR")
+    if not archive_dir:
+        return
+
+    archived = AuditEventPartitions.archive_expired(
+        archive_dir, app.config["AUDIT_LOG_RETENTION_MONTHS"]
+    )
+    for path in archived:
+        app.logger.info("Archived audit events to {}".format(path))
+
+
+@celery.task(ignore_result=True)
+def maintain_audit_events():
+    """
+    Creates the audit event partitions for the coming months and, if
+    AUDIT_LOG_ARCHIVE_DIR is set, archives the ones past retention.
+    """
+    do_maintain_audit_events()
+
+
+def do_create_environment(
+    csp: CloudProviderInterface,
+    environment_id=None,
+    claimed_until=None,
+    hold_until=None,
+):
     environment = Environments.get(environment_id)
 
-    with claim_for_update(environment) as environment:
+    with claim_for_update(
+        environment,
+        claimed_until=claimed_until,
+        hold_until=hold_until,
+        hold_on=GeneralCSPException,
+    ) as environment:
 
         if environment.cloud_id is not None:
             # TODO: Return value for this?
@@ -85,10 +147,20 @@ def do_create_environment(csp: CloudProviderInterface, environment_id=None):
         )
 
 
-def do_create_atat_admin_user(csp: CloudProviderInterface, environment_id=None):
+def do_create_atat_admin_user(
+    csp: CloudProviderInterface,
+    environment_id=None,
+    claimed_until=None,
+    hold_until=None,
+):
     environment = Environments.get(environment_id)
 
-    with claim_for_update(environment) as environment:
+    with claim_for_update(
+        environment,
+        claimed_until=claimed_until,
+        hold_until=hold_until,
+        hold_on=GeneralCSPException,
+    ) as environment:
         atat_root_creds = csp.root_creds()
 
         atat_remote_root_user = csp.create_atat_admin_user(
@@ -103,10 +175,20 @@ def render_email(template_path, context):
     return app.jinja_env.get_template(template_path).render(context)
 
 
-def do_provision_user(csp: CloudProviderInterface, environment_role_id=None):
+def do_provision_user(
+    csp: CloudProviderInterface,
+    environment_role_id=None,
+    claimed_until=None,
+    hold_until=None,
+):
     environment_role = EnvironmentRoles.get_by_id(environment_role_id)
 
-    with claim_for_update(environment_role) as environment_role:
+    with claim_for_update(
+        environment_role,
+        claimed_until=claimed_until,
+        hold_until=hold_until,
+        hold_on=GeneralCSPException,
+    ) as environment_role:
         credentials = environment_role.environment.csp_credentials
 
         csp_user_id = csp.create_or_update_user(
@@ -118,51 +200,234 @@ def do_provision_user(csp: CloudProviderInterface, environment_role_id=None):
         db.session.commit()
 
 
-def do_work(fn, task, csp, **kwargs):
+def do_provision_users(
+    csp: CloudProviderInterface,
+    environment_role_ids=(),
+    claimed_until=None,
+    task_id=None,
+    hold_until=None,
+):
+    """
+    Provisions a batch of environment roles, all in the same environment, with
+    a single call to the CSP, and commits the results together. A role the CSP
+    couldn't provision gets a job failure and stays pending, so it is
+    dispatched again after a backoff; a failure of the whole call is raised to
+    be retried.
+    """
+    failed_ids = []
+    with claim_all_for_update(
+        EnvironmentRole,
+        environment_role_ids,
+        claimed_until=claimed_until,
+        hold_until=hold_until,
+        hold_on=GeneralCSPException,
+    ) as environment_roles:
+        if not environment_roles:
+            return
+
+        credentials = environment_roles[0].environment.csp_credentials
+        results = csp.create_or_update_users(credentials, environment_roles)
+
+        for environment_role in environment_roles:
+            result = results[environment_role.id]
+            if isinstance(result, GeneralCSPException):
+                db.session.add(
+                    EnvironmentRoleJobFailure(
+                        environment_role_id=environment_role.id, task_id=task_id
+                    )
+                )
+                failed_ids.append(environment_role.id)
+            else:
+                environment_role.csp_user_id = result
+                environment_role.status = EnvironmentRole.Status.COMPLETED
+                db.session.add(environment_role)
+
+        db.session.commit()
+
+    if failed_ids:
+        back_off_environment_roles(failed_ids)
+
+
+def back_off_environment_roles(environment_role_ids):
+    """
+    Claims environment roles the CSP failed to provision for a backoff that
+    grows with the number of times they have failed, so the dispatcher
+    doesn't provision them again right away. A role the dispatcher claimed
+    again in the meantime is left to it.
+    """
+    failures = dict(
+        db.session.query(
+            EnvironmentRoleJobFailure.environment_role_id,
+            func.count(EnvironmentRoleJobFailure.id),
+        )
+        .filter(EnvironmentRoleJobFailure.environment_role_id.in_(environment_role_ids))
+        .group_by(EnvironmentRoleJobFailure.environment_role_id)
+    )
+    for environment_role_id in environment_role_ids:
+        db.session.query(EnvironmentRole).filter(
+            EnvironmentRole.id == environment_role_id,
+            EnvironmentRole.claimed_until == None,
+        ).update(
+            {
+                "claimed_until": claim_expiry(
+                    retry_delay(failures.get(environment_role_id, 1) - 1)
+                )
+            },
+            synchronize_session="fetch",
+        )
+    db.session.commit()
+
+
+# how long past its countdown a retry has to start and take over its claim
+RETRY_CLAIM_GRACE = 30 * 60
+
+
+def retry_delay(retries):
+    """
+    Exponential backoff with full jitter: a random delay of up to
+    CSP_RETRY_BASE_DELAY seconds doubled for each previous retry, capped at
+    CSP_RETRY_MAX_DELAY, so failed tasks don't retry against the CSP in step.
+    """
+    ceiling = min(
+        app.config["CSP_RETRY_MAX_DELAY"],
+        app.config["CSP_RETRY_BASE_DELAY"] * 2 ** retries,
+    )
+    return random.uniform(0, ceiling)
+
+
+# tasks whose CSP calls count against another task's rate limit
+SHARED_RATE_LIMITS = {"atst.jobs.provision_users": "atst.jobs.provision_user"}
+
+
+def throttle(task, cost=1):
+    """
+    Takes `cost` tokens, one per CSP operation the task will make, from the
+    task's CSP rate limit. If there aren't enough, the task is re-enqueued
+    for when there will be, plus jitter so throttled tasks don't all wake
+    at once. Being throttled isn't a failure, so the task's retry count is
+    left as it was.
+    """
+    wait = app.csp_rate_limiter.acquire(
+        SHARED_RATE_LIMITS.get(task.name, task.name), cost=cost
+    )
+    if wait:
+        task.signature_from_request(
+            countdown=wait + random.uniform(0, wait), retries=task.request.retries
+        ).apply_async()
+        raise Ignore()
+
+
+def do_work(fn, task, csp, rate_limit_cost=1, **kwargs):
+    """
+    Runs fn, retrying it with backoff if the CSP call fails. Unless this is
+    the last try, the claim fn takes is kept rather than released when the
+    call fails, long enough for the retry to take it over, so the
+    dispatchers don't enqueue the resource again in the meantime.
+    """
+    throttle(task, cost=rate_limit_cost)
+    countdown = retry_delay(task.request.retries)
+    hold_until = None
+    if task.max_retries is None or task.request.retries < task.max_retries:
+        hold_until = claim_expiry(countdown + RETRY_CLAIM_GRACE)
+
     try:
-        fn(csp, **kwargs)
+        fn(csp, hold_until=hold_until, **kwargs)
     except GeneralCSPException as e:
-        raise task.retry(exc=e)
+        raise task.retry(
+            exc=e,
+            countdown=countdown,
+            kwargs={**task.request.kwargs, "claimed_until": hold_until},
+        )
 
 
 @celery.task(bind=True, base=RecordEnvironmentFailure)
-def create_environment(self, environment_id=None):
-    do_work(do_create_environment, self, app.csp.cloud, environment_id=environment_id)
+def create_environment(self, environment_id=None, claimed_until=None):
+    do_work(
+        do_create_environment,
+        self,
+        app.csp.cloud,
+        environment_id=environment_id,
+        claimed_until=claimed_until,
+    )
 
 
 @celery.task(bind=True, base=RecordEnvironmentFailure)
-def create_atat_admin_user(self, environment_id=None):
+def create_atat_admin_user(self, environment_id=None, claimed_until=None):
+    do_work(
+        do_create_atat_admin_user,
+        self,
+        app.csp.cloud,
+        environment_id=environment_id,
+        claimed_until=claimed_until,
+    )
+
+
+# Roles are dispatched in batches to provision_users now. This task is kept
+# so that ones already queued still run.
+@celery.task(bind=True)
+def provision_user(self, environment_role_id=None, claimed_until=None):
     do_work(
-        do_create_atat_admin_user, self, app.csp.cloud, environment_id=environment_id
+        do_provision_user,
+        self,
+        app.csp.cloud,
+        environment_role_id=environment_role_id,
+        claimed_until=claimed_until,
     )
 
 
 @celery.task(bind=True)
-def provision_user(self, environment_role_id=None):
+def provision_users(self, environment_role_ids=None, claimed_until=None):
     do_work(
-        do_provision_user, self, app.csp.cloud, environment_role_id=environment_role_id
+        do_provision_users,
+        self,
+        app.csp.cloud,
+        rate_limit_cost=len(environment_role_ids),
+        environment_role_ids=environment_role_ids,
+        claimed_until=claimed_until,
+        task_id=self.request.id,
     )
 
 
+# The dispatchers claim the resources they enqueue tasks for and hand each
+# task its claim, so a resource that is already queued or being worked on is
+# not enqueued again on the next run.
+
+
 @celery.task(bind=True)
 def dispatch_create_environment(self):
-    for environment_id in Environments.get_environments_pending_creation(
-        pendulum.now()
+    for (
+        environment_id,
+        claimed_until,
+    ) in Environments.claim_environments_pending_creation(
+        pendulum.now(), limit=app.config.get("PROVISIONING_BATCH_SIZE")
     ):
-        create_environment.delay(environment_id=environment_id)
+        create_environment.delay(
+            environment_id=environment_id, claimed_until=claimed_until
+        )
 
 
 @celery.task(bind=True)
 def dispatch_create_atat_admin_user(self):
-    for environment_id in Environments.get_environments_pending_atat_user_creation(
-        pendulum.now()
+    for (
+        environment_id,
+        claimed_until,
+    ) in Environments.claim_environments_pending_atat_user_creation(
+        pendulum.now(), limit=app.config.get("PROVISIONING_BATCH_SIZE")
     ):
-        create_atat_admin_user.delay(environment_id=environment_id)
+        create_atat_admin_user.delay(
+            environment_id=environment_id, claimed_until=claimed_until
+        )
 
 
 @celery.task(bind=True)
 def dispatch_provision_user(self):
-    for (
-        environment_role_id
-    ) in EnvironmentRoles.get_environment_roles_pending_creation():
-        provision_user.delay(environment_role_id=environment_role_id)
+    # roles are provisioned an environment at a time, so each batch needs
+    # only one set of CSP credentials
+    batches = EnvironmentRoles.claim_environment_roles_pending_creation_by_environment(
+        limit=app.config.get("PROVISIONING_BATCH_SIZE"),
+        max_attempts=app.config.get("PROVISIONING_MAX_ATTEMPTS"),
+    )
+    for (_environment_id, claimed_until), environment_role_ids in batches.items():
+        provision_users.delay(
+            environment_role_ids=environment_role_ids, claimed_until=claimed_until
+        )
@@ -1,5 +1,5 @@
-from sqlalchemy import String, Column, ForeignKey, inspect
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import String, Column, ForeignKey, Index, TIMESTAMP, func
+from sqlalchemy.dialects.postgresql import UUID, JSONB, insert
 from sqlalchemy.orm import relationship
 
 from atst.models.base import Base
@@ -9,25 +9,52 @@ from atst.models.mixins.timestamps import TimestampsMixin
 
 class AuditEvent(Base, TimestampsMixin):
     __tablename__ = "audit_events"
+    # the audit log is paginated newest first by (time_created, id), either
+    # unfiltered or filtered by one of these columns
+    __table_args__ = (
+        Index("ix_audit_events_time_created_id", "time_created", "id"),
+        Index(
+            "ix_audit_events_portfolio_id_time_created_id",
+            "portfolio_id",
+            "time_created",
+            "id",
+        ),
+        Index(
+            "ix_audit_events_application_id_time_created_id",
+            "application_id",
+            "time_created",
+            "id",
+        ),
+        Index(
+            "ix_audit_events_resource_id_time_created_id",
+            "resource_id",
+            "time_created",
+            "id",
+        ),
+        # see AuditEventPartitions
+        {"postgresql_partition_by": "RANGE (time_created)"},
+    )
 
     id = types.Id()
+    # a partitioned table's primary key has to include its partition key
+    time_created = Column(
+        TIMESTAMP(timezone=True), primary_key=True, server_default=func.now()
+    )
 
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), index=True)
     user = relationship("User", backref="audit_events")
 
-    portfolio_id = Column(UUID(as_uuid=True), ForeignKey("portfolios.id"), index=True)
+    portfolio_id = Column(UUID(as_uuid=True), ForeignKey("portfolios.id"))
     portfolio = relationship("Portfolio", backref="audit_events")
 
-    application_id = Column(
-        UUID(as_uuid=True), ForeignKey("applications.id"), index=True
-    )
+    application_id = Column(UUID(as_uuid=True), ForeignKey("applications.id"))
     application = relationship("Application", backref="audit_events")
 
     changed_state = Column(JSONB())
     event_details = Column(JSONB())
 
     resource_type = Column(String(), nullable=False)
-    resource_id = Column(UUID(as_uuid=True), index=True, nullable=False)
+    resource_id = Column(UUID(as_uuid=True), nullable=False)
 
     display_name = Column(String())
     action = Column(String(), nullable=False)
@@ -45,10 +72,19 @@ class AuditEvent(Base, TimestampsMixin):
             "action": self.action,
         }
 
-    def save(self, connection):
-        attrs = inspect(self).dict
-
-        connection.execute(self.__table__.insert(), **attrs)
+    @classmethod
+    def save_all(cls, connection, audit_events, skip_existing=False):
+        """
+        Inserts a list of audit event dicts in one statement. With
+        skip_existing, events whose id and time_created were already saved are
+        left out rather than failing the insert.
+        """
+        statement = insert(cls.__table__).values(audit_events)
+        if skip_existing:
+            statement = statement.on_conflict_do_nothing(
+                index_elements=["id", "time_created"]
+            )
+        connection.execute(statement)
 
     def __repr__(self):  # pragma: no cover
         return "<AuditEvent(name='{}', action='{}', id='{}')>".format(
@@ -1,5 +1,7 @@
 from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
 from flask import g, current_app as app
+from redis.exceptions import RedisError
 
 from atst.models.audit_event import AuditEvent
 from atst.utils import camel_to_snake, getattr_path
@@ -8,10 +10,24 @@ ACTION_CREATE = "create"
 ACTION_UPDATE = "update"
 ACTION_DELETE = "delete"
 
+# the key in Session.info of the audit events waiting for the session to
+# commit, keyed by the transaction or savepoint they were created in
+PENDING_AUDIT_EVENTS = "pending_audit_events"
+# the key of the audit events to add to the audit event stream once the
+# session's transaction has committed
+COMMITTED_AUDIT_EVENTS = "committed_audit_events"
+
+
+def _savepoint_or_root(transaction):
+    # a flush's subtransaction shares the events of the transaction it is in
+    while not transaction.nested and transaction.parent is not None:
+        transaction = transaction.parent
+    return transaction
+
 
 class AuditableMixin(object):
     @staticmethod
-    def create_audit_event(connection, resource, action, changed_state=None):
+    def create_audit_event(resource, action, changed_state=None):
         user_id = getattr_path(g, "current_user.id")
 
         if changed_state is None:
@@ -38,8 +54,10 @@ class AuditableMixin(object):
         )
 
         if app.config.get("USE_AUDIT_LOG", False):
-            audit_event = AuditEvent(**log_data)
-            audit_event.save(connection)
+            session = object_session(resource)
+            session.info.setdefault(PENDING_AUDIT_EVENTS, {}).setdefault(
+                _savepoint_or_root(session.transaction), []
+            ).append(log_data)
 
     @classmethod
     def __declare_last__(cls):
@@ -50,17 +68,17 @@ class AuditableMixin(object):
     @staticmethod
     def audit_insert(mapper, connection, target):
         """Listen for the `after_insert` event and create an AuditLog entry"""
-        target.create_audit_event(connection, target, ACTION_CREATE)
+        target.create_audit_event(target, ACTION_CREATE)
 
     @staticmethod
     def audit_delete(mapper, connection, target):
         """Listen for the `after_delete` event and create an AuditLog entry"""
-        target.create_audit_event(connection, target, ACTION_DELETE)
+        target.create_audit_event(target, ACTION_DELETE)
 
     @staticmethod
     def audit_update(mapper, connection, target):
         if AuditableMixin.get_changes(target):
-            target.create_audit_event(connection, target, ACTION_UPDATE)
+            target.create_audit_event(target, ACTION_UPDATE)
 
     def get_changes(self):
         """
@@ -72,13 +90,17 @@ class AuditableMixin(object):
         There may be more than one item in the dictionary, but that is not expected.
         """
         previous_state = {}
-        attrs = inspect(self).mapper.column_attrs
-        for attr in attrs:
-            history = getattr(inspect(self).attrs, attr.key).history
+        state = inspect(self)
+        column_attrs = state.mapper.column_attrs
+        # only the attributes set since the last flush can have changed
+        for key in list(state.committed_state):
+            if key not in column_attrs:
+                continue
+            history = state.attrs[key].history
             if history.has_changes():
                 deleted = history.deleted.pop() if history.deleted else None
                 added = history.added.pop() if history.added else None
-                previous_state[attr.key] = [deleted, added]
+                previous_state[key] = [deleted, added]
         return previous_state
 
     @property
@@ -109,13 +131,85 @@ class AuditableMixin(object):
 def record_permission_sets_updates(instance_state, permission_sets, initiator):
     old_perm_sets = instance_state.attrs.get("permission_sets").value
     if instance_state.persistent and old_perm_sets != permission_sets:
-        connection = instance_state.session.connection()
         old_state = [p.name for p in old_perm_sets]
         new_state = [p.name for p in permission_sets]
         changed_state = {"permission_sets": (old_state, new_state)}
         instance_state.object.create_audit_event(
-            connection,
-            instance_state.object,
-            ACTION_UPDATE,
-            changed_state=changed_state,
+            instance_state.object, ACTION_UPDATE, changed_state=changed_state
         )
+
+
+@event.listens_for(Session, "before_commit")
+def write_audit_events(session):
+    """
+    Writes the audit events created while the session's transaction was open
+    with a single multi-row INSERT. If AUDIT_LOG_STREAM is set and the
+    stream can be reached they are kept instead, to add to the stream once
+    the transaction has committed. A savepoint's events are kept until its
+    enclosing transaction commits.
+    """
+    transaction = _savepoint_or_root(session.transaction)
+    if transaction.nested:
+        return
+
+    # the session flushes after this hook, so flush first to include the
+    # events that flush would create
+    session.flush()
+    audit_events = session.info.get(PENDING_AUDIT_EVENTS, {}).pop(transaction, None)
+    if not audit_events:
+        return
+
+    if app.config.get("AUDIT_LOG_STREAM"):
+        if app.audit_event_stream.available():
+            session.info[COMMITTED_AUDIT_EVENTS] = audit_events
+            return
+
+        app.logger.warning("Audit event stream unavailable, writing events directly")
+
+    AuditEvent.save_all(session, audit_events)
+
+
+@event.listens_for(Session, "after_commit")
+def stream_audit_events(session):
+    """
+    Adds the committed transaction's audit events to the audit event stream.
+    If the stream has become unreachable since the transaction began to
+    commit, they are written to the database in a transaction of their own.
+
+    A released savepoint's events are handed to its enclosing transaction.
+    """
+    transaction = session.transaction
+    if transaction.nested:
+        pending = session.info.get(PENDING_AUDIT_EVENTS, {})
+        audit_events = pending.pop(transaction, None)
+        if audit_events:
+            pending.setdefault(_savepoint_or_root(transaction.parent), []).extend(
+                audit_events
+            )
+        return
+
+    audit_events = session.info.pop(COMMITTED_AUDIT_EVENTS, None)
+    if not audit_events:
+        return
+
+    try:
+        app.audit_event_stream.add(audit_events)
+    except RedisError as err:
+        app.logger.warning(
+            "Audit event stream unavailable, writing events directly: {}".format(err)
+        )
+        with session.get_bind().connect() as connection, connection.begin():
+            AuditEvent.save_all(connection, audit_events)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_audit_events(session, transaction):
+    # events left when their transaction or savepoint ends were rolled back
+    pending = session.info.get(PENDING_AUDIT_EVENTS)
+    if pending is not None:
+        pending.pop(transaction, None)
+        if not pending:
+            session.info.pop(PENDING_AUDIT_EVENTS)
+
+    if transaction.parent is None:
+        session.info.pop(COMMITTED_AUDIT_EVENTS, None)
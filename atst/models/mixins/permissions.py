@@ -1,6 +1,46 @@
+from sqlalchemy import event
+
+
+_PERMISSIONS_CACHE = "_permissions"
+
+
 class PermissionsMixin(object):
     @property
     def permissions(self):
-        return [
-            perm for permset in self.permission_sets for perm in permset.permissions
-        ]
+        """
+        The permissions granted by all of this object's permission sets. The
+        set is built once and kept until the permission sets change or the
+        object is expired, so repeated checks are a single set lookup.
+        """
+        permissions = self.__dict__.get(_PERMISSIONS_CACHE)
+        if permissions is None:
+            permissions = frozenset(
+                perm for permset in self.permission_sets for perm in permset.permissions
+            )
+            self.__dict__[_PERMISSIONS_CACHE] = permissions
+
+        return permissions
+
+
+def _reset_permissions(target, *args, **kwargs):
+    target.__dict__.pop(_PERMISSIONS_CACHE, None)
+
+
+@event.listens_for(PermissionsMixin, "mapper_configured", propagate=True)
+def _listen_for_permission_set_changes(mapper, cls):
+    for collection_event in ["append", "remove", "bulk_replace"]:
+        event.listen(cls.permission_sets, collection_event, _reset_permissions)
+
+
+# The instance may already have been garbage collected when its state is
+# expired, so these listen on the raw state and clear its dict directly.
+@event.listens_for(PermissionsMixin, "expire", propagate=True, raw=True)
+def _reset_expired_permissions(state, attrs):
+    if attrs is None or "permission_sets" in attrs:
+        state.dict.pop(_PERMISSIONS_CACHE, None)
+
+
+@event.listens_for(PermissionsMixin, "refresh", propagate=True, raw=True)
+def _reset_refreshed_permissions(state, context, attrs):
+    if attrs is None or "permission_sets" in attrs:
+        state.dict.pop(_PERMISSIONS_CACHE, None)
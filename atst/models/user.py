@@ -122,7 +122,7 @@ class User(
     def audit_update(mapper, connection, target):
         changes = AuditableMixin.get_changes(target)
         if changes and not "last_login" in changes:
-            target.create_audit_event(connection, target, ACTION_UPDATE)
+            target.create_audit_event(target, ACTION_UPDATE)
 
 
 listen(User.permission_sets, "bulk_replace", record_permission_sets_updates, raw=True)
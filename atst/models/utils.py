@@ -5,33 +5,78 @@ from atst.database import db
 from atst.domain.exceptions import ClaimFailedException
 
 
+def _claim_until(minutes):
+    return func.now() + func.cast(sql.functions.concat(minutes, " MINUTES"), Interval)
+
+
+def _unclaimed(Model):
+    return or_(Model.claimed_until == None, Model.claimed_until <= func.now())
+
+
+def claim_expiry(seconds):
+    """
+    The database's time `seconds` from now, for holding a claim until with
+    claim_for_update's hold_until.
+    """
+    return db.session.query(
+        func.now() + func.cast(sql.functions.concat(seconds, " SECONDS"), Interval)
+    ).scalar()
+
+
+def _set_claims(Model, ids, claimed_until):
+    db.session.query(Model).filter(Model.id.in_(ids)).filter(
+        Model.claimed_until != None
+    ).update({"claimed_until": claimed_until}, synchronize_session="fetch")
+    db.session.commit()
+
+
 @contextmanager
-def claim_for_update(resource, minutes=30):
+def _held_until_released(Model, ids, hold_until, hold_on):
+    # an error the caller will retry after keeps the claim until hold_until,
+    # so the retry can take it over; anything else releases it
+    try:
+        yield
+    except hold_on if hold_until is not None else ():
+        _set_claims(Model, ids, hold_until)
+        raise
+    except BaseException:
+        _set_claims(Model, ids, None)
+        raise
+    else:
+        _set_claims(Model, ids, None)
+
+
+@contextmanager
+def claim_for_update(
+    resource, minutes=30, claimed_until=None, hold_until=None, hold_on=()
+):
     """
     Claim a mutually exclusive expiring hold on a resource.
     Uses the database as a central source of time in case the server clocks have drifted.
 
     Args:
-        resource:   A SQLAlchemy model instance with a `claimed_until` attribute.
-        minutes:    The maximum amount of time, in minutes, to hold the claim.
+        resource:       A SQLAlchemy model instance with a `claimed_until` attribute.
+        minutes:        The maximum amount of time, in minutes, to hold the claim.
+        claimed_until:  The expiry of a claim already taken on the resource by
+                        claim_many_for_update. If it is still held, the claim is
+                        taken over rather than treated as someone else's.
+        hold_until:     If the caller raises one of the `hold_on` exceptions,
+                        the claim is kept until this time, from claim_expiry,
+                        rather than released, so a retry can take it over.
+        hold_on:        The exceptions to keep the claim on.
     """
     Model = resource.__class__
 
-    claim_until = func.now() + func.cast(
-        sql.functions.concat(minutes, " MINUTES"), Interval
-    )
+    claimable = _unclaimed(Model)
+    if claimed_until is not None:
+        claimable = or_(claimable, Model.claimed_until == claimed_until)
 
     # Optimistically query for and update the resource in question. If it's
     # already claimed, `rows_updated` will be 0 and we can give up.
     rows_updated = (
         db.session.query(Model)
-        .filter(
-            and_(
-                Model.id == resource.id,
-                or_(Model.claimed_until == None, Model.claimed_until <= func.now()),
-            )
-        )
-        .update({"claimed_until": claim_until}, synchronize_session="fetch")
+        .filter(and_(Model.id == resource.id, claimable))
+        .update({"claimed_until": _claim_until(minutes)}, synchronize_session="fetch")
     )
     if rows_updated < 1:
         raise ClaimFailedException(resource)
@@ -39,12 +84,83 @@ def claim_for_update(resource, minutes=30):
     # Fetch the claimed resource
     claimed = db.session.query(Model).filter_by(id=resource.id).one()
 
-    try:
-        # Give the resource to the caller.
+    # Give the resource to the caller.
+    with _held_until_released(Model, [resource.id], hold_until, hold_on):
+        yield claimed
+
+
+@contextmanager
+def claim_all_for_update(
+    Model, ids, minutes=30, claimed_until=None, hold_until=None, hold_on=()
+):
+    """
+    Claim mutually exclusive expiring holds on a batch of resources, as
+    claim_for_update does for one. Resources someone else has claimed are
+    left out of the batch rather than failing it.
+
+    Args:
+        Model:          A SQLAlchemy model with a `claimed_until` column.
+        ids:            The ids of the resources to claim.
+        minutes:        The maximum amount of time, in minutes, to hold the claims.
+        claimed_until:  The expiry of a claim already taken on the resources by
+                        claim_many_for_update, which is taken over.
+        hold_until:     As for claim_for_update.
+        hold_on:        As for claim_for_update.
+    """
+    claimable = _unclaimed(Model)
+    if claimed_until is not None:
+        claimable = or_(claimable, Model.claimed_until == claimed_until)
+
+    claimed_ids = [
+        id_
+        for id_, in db.session.execute(
+            Model.__table__.update()
+            .where(and_(Model.id.in_(ids), claimable))
+            .values(claimed_until=_claim_until(minutes))
+            .returning(Model.id)
+        )
+    ]
+    if not claimed_ids:
+        yield []
+        return
+
+    # Fetch the claimed resources
+    claimed = db.session.query(Model).filter(Model.id.in_(claimed_ids)).all()
+
+    # Give the resources to the caller.
+    with _held_until_released(Model, claimed_ids, hold_until, hold_on):
         yield claimed
-    finally:
-        # Release the claim.
-        db.session.query(Model).filter(Model.id == resource.id).filter(
-            Model.claimed_until != None
-        ).update({"claimed_until": None}, synchronize_session="fetch")
-        db.session.commit()
+
+
+def claim_many_for_update(Model, ids, minutes=30, limit=None):
+    """
+    Claim expiring holds on a batch of resources in a single statement.
+    Rows another transaction has locked are skipped rather than waited on, so
+    concurrent callers claim disjoint batches.
+
+    Args:
+        Model:      A SQLAlchemy model with a `claimed_until` column.
+        ids:        A query selecting the ids of the resources to claim.
+        minutes:    The maximum amount of time, in minutes, to hold the claims.
+        limit:      The most resources to claim.
+
+    Returns:
+        An (id, claimed_until) tuple for each resource claimed. Pass
+        claimed_until to claim_for_update to take the claim over.
+    """
+    claimable = (
+        db.session.query(Model.id)
+        .filter(Model.id.in_(ids.subquery()))
+        .filter(_unclaimed(Model))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claims = db.session.execute(
+        Model.__table__.update()
+        .where(Model.id.in_(claimable.subquery()))
+        .values(claimed_until=_claim_until(minutes))
+        .returning(Model.id, Model.claimed_until)
+    ).fetchall()
+    db.session.commit()
+
+    return [(id_, claimed_until) for id_, claimed_until in claims]
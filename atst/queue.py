@@ -19,7 +19,16 @@ def update_celery(celery, app):
             "task": "atst.jobs.dispatch_provision_user",
             "schedule": 60,
         },
+        "beat-maintain_audit_events": {
+            "task": "atst.jobs.maintain_audit_events",
+            "schedule": 60 * 60 * 24,
+        },
     }
+    if app.config.get("AUDIT_LOG_STREAM"):
+        celery.conf.CELERYBEAT_SCHEDULE["beat-write_audit_events"] = {
+            "task": "atst.jobs.write_audit_events",
+            "schedule": 10,
+        }
 
     class ContextTask(celery.Task):
         def __call__(self, *args, **kwargs):
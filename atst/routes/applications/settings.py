@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from flask import (
     redirect,
     render_template,
@@ -14,7 +16,6 @@ from atst.domain.application_roles import ApplicationRoles
 from atst.domain.audit_log import AuditLog
 from atst.domain.csp.cloud import GeneralCSPException
 from atst.domain.common import Paginator
-from atst.domain.environment_roles import EnvironmentRoles
 from atst.domain.invitations import ApplicationInvitations
 from atst.domain.portfolios import Portfolios
 from atst.forms.application_member import NewForm as NewMemberForm, UpdateMemberForm
@@ -26,11 +27,28 @@ from atst.models.permissions import Permissions
 from atst.domain.permission_sets import PermissionSets
 from atst.utils.flash import formatted_flash as flash
 from atst.utils.localization import translate
+from atst.utils.query_stats import query_budget
 from atst.jobs import send_mail
 from atst.routes.errors import log_error
 
 
-def get_environments_obj_for_app(application):
+def _members_by_environment(members):
+    """
+    Indexes each member and their role in an environment by environment id.
+    """
+    index = defaultdict(list)
+    for member in members:
+        for env_role in member.environment_roles:
+            index[env_role.environment_id].append((member, env_role))
+
+    return index
+
+
+def get_environments_obj_for_app(application, members=None):
+    if members is None:
+        members = ApplicationRoles.get_members(application.id)
+    members_by_environment = _members_by_environment(members)
+
     return sorted(
         [
             {
@@ -38,14 +56,14 @@ def get_environments_obj_for_app(application):
                 "name": env.name,
                 "pending": env.is_pending,
                 "edit_form": EditEnvironmentForm(obj=env),
-                "member_count": len(env.roles),
+                "member_count": len(members_by_environment[env.id]),
                 "members": sorted(
                     [
                         {
-                            "user_name": env_role.application_role.user_name,
+                            "user_name": member.user_name,
                             "status": env_role.status.value,
                         }
-                        for env_role in env.roles
+                        for member, env_role in members_by_environment[env.id]
                     ],
                     key=lambda env_role: env_role["user_name"],
                 ),
@@ -87,6 +105,7 @@ def filter_env_roles_data(roles):
 
 
 def filter_env_roles_form_data(member, environments):
+    env_roles = {role.environment_id: role for role in member.environment_roles}
     env_roles_form_data = []
     for env in environments:
         env_data = {
@@ -95,10 +114,9 @@ def filter_env_roles_form_data(member, environments):
             "role": NO_ACCESS,
             "disabled": False,
         }
-        env_roles_set = set(env.roles).intersection(set(member.environment_roles))
+        env_role = env_roles.get(env.id)
 
-        if len(env_roles_set) == 1:
-            (env_role,) = env_roles_set
+        if env_role:
             env_data["role"] = env_role.role
             env_data["disabled"] = env_role.disabled
 
@@ -107,12 +125,14 @@ def filter_env_roles_form_data(member, environments):
     return env_roles_form_data
 
 
-def get_members_data(application):
+def get_members_data(application, members=None):
+    if members is None:
+        members = ApplicationRoles.get_members(application.id)
+
     members_data = []
-    for member in application.members:
+    for member in members:
         permission_sets = filter_perm_sets_data(member)
-        roles = EnvironmentRoles.get_for_application_member(member.id)
-        environment_roles = filter_env_roles_data(roles)
+        environment_roles = filter_env_roles_data(member.environment_roles)
         env_roles_form_data = filter_env_roles_form_data(
             member, application.environments
         )
@@ -153,12 +173,13 @@ def get_new_member_form(application):
 
 
 def render_settings_page(application, **kwargs):
-    environments_obj = get_environments_obj_for_app(application=application)
+    app_members = ApplicationRoles.get_members(application.id)
+    environments_obj = get_environments_obj_for_app(application, members=app_members)
     new_env_form = EditEnvironmentForm()
     pagination_opts = Paginator.get_pagination_opts(http_request)
     audit_events = AuditLog.get_application_events(application, pagination_opts)
     new_member_form = get_new_member_form(application)
-    members = get_members_data(application)
+    members = get_members_data(application, members=app_members)
 
     if "application_form" not in kwargs:
         kwargs["application_form"] = NameAndDescriptionForm(
@@ -300,6 +321,7 @@ def handle_update_application(form, application_id=None, portfolio_id=None):
 
 
 @applications_bp.route("/applications/<application_id>/settings")
+@query_budget(20)
 @user_can(Permissions.VIEW_APPLICATION, message="view application edit form")
 def settings(application_id):
     application = Applications.get(application_id)
@@ -9,6 +9,16 @@ from atst.domain.portfolios import Portfolios
 from atst.models.permissions import Permissions
 from atst.domain.authz.decorator import user_can_access_decorator as user_can
 from atst.utils.flash import formatted_flash as flash
+from atst.utils.query_stats import query_budget
+
+
+@portfolios_bp.route("/portfolios")
+@query_budget(20)
+def portfolios():
+    return render_template(
+        "portfolios/index.html",
+        portfolio_summaries=Portfolios.summaries_for_user(g.current_user),
+    )
 
 
 @portfolios_bp.route("/portfolios/new")
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from enum import Enum
+import json
+from uuid import uuid4
+
+from redis.exceptions import RedisError, ResponseError
+
+
+def _dumps(event):
+    def _default(obj):
+        if isinstance(obj, Enum):
+            return obj.name
+        else:
+            return str(obj)
+
+    return json.dumps(event, default=_default)
+
+
+class AuditEventStream(object):
+    """
+    A Redis stream that audit events are added to as their transactions
+    commit, for the write_audit_events task to write to the database in
+    batches. Each writer reads through a consumer group under its own name,
+    so events one writer has read are not read by another, and events a
+    writer read but didn't acknowledge are read again when it next runs.
+    Events another writer read but hasn't acknowledged in CLAIM_IDLE_TIME
+    milliseconds, say because it crashed and was replaced under a new name,
+    are claimed and read again by whichever writer runs next.
+    """
+
+    KEY = "audit_events"
+    GROUP = "audit_event_writers"
+    CLAIM_IDLE_TIME = 5 * 60 * 1000
+
+    def __init__(self, redis, claim_idle_time=CLAIM_IDLE_TIME):
+        self.redis = redis
+        self.claim_idle_time = claim_idle_time
+
+    def available(self):
+        """Whether Redis can be reached to add events to the stream."""
+        try:
+            return self.redis.ping()
+        except RedisError:
+            return False
+
+    def add(self, events):
+        """
+        Adds the events to the stream, all or none of them. Each is stamped
+        with the current time, since it is written to the database later,
+        and with its id, so an event read again after it was written isn't
+        written twice.
+        """
+        time_created = datetime.now(timezone.utc)
+        pipeline = self.redis.pipeline()
+        for event in events:
+            event = {**event, "id": uuid4(), "time_created": time_created}
+            pipeline.xadd(self.KEY, {"event": _dumps(event)})
+        pipeline.execute()
+
+    def _create_group(self):
+        try:
+            self.redis.xgroup_create(self.KEY, self.GROUP, id="0", mkstream=True)
+        except ResponseError as err:
+            if not str(err).startswith("BUSYGROUP"):
+                raise
+
+    def _decode(self, messages):
+        # entries deleted since they were read are claimed without fields
+        return [
+            (id_, json.loads(fields[b"event"])) for id_, fields in messages if fields
+        ]
+
+    def _read(self, consumer, count, from_id):
+        entries = self.redis.xreadgroup(
+            self.GROUP, consumer, {self.KEY: from_id}, count=count
+        )
+        if not entries:
+            return []
+
+        [(_key, messages)] = entries
+        return self._decode(messages)
+
+    def _claim(self, consumer, count):
+        pending = self.redis.xpending_range(self.KEY, self.GROUP, "-", "+", count)
+        ids = [
+            entry["message_id"]
+            for entry in pending
+            if entry["consumer"].decode() != consumer
+            and entry["time_since_delivered"] >= self.claim_idle_time
+        ]
+        if not ids:
+            return []
+
+        return self._decode(
+            self.redis.xclaim(self.KEY, self.GROUP, consumer, self.claim_idle_time, ids)
+        )
+
+    def read(self, consumer, count):
+        """
+        Returns up to `count` (id, event) pairs for the consumer: the events
+        it has already read but not acknowledged if there are any, otherwise
+        ones other consumers have left unacknowledged for CLAIM_IDLE_TIME,
+        otherwise new ones.
+        """
+        self._create_group()
+        return (
+            self._read(consumer, count, "0")
+            or self._claim(consumer, count)
+            or self._read(consumer, count, ">")
+        )
+
+    def acknowledge(self, ids):
+        """Removes events that have been written from the stream."""
+        pipeline = self.redis.pipeline()
+        pipeline.xack(self.KEY, self.GROUP, *ids)
+        pipeline.xdel(self.KEY, *ids)
+        pipeline.execute()
@@ -1,23 +1,104 @@
 from flask import g
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased, joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
 from atst.database import db
-from atst.domain.authz import Authorization
+from atst.domain.authz.context import (
+    AuthorizationContext,
+    attach_context,
+    authorization_context,
+    context_for,
+)
 from atst.domain.exceptions import NotFoundError
 from atst.domain.portfolios.scopes import ScopedPortfolio
 from atst.models import (
     Application,
+    ApplicationRole,
     Environment,
     Permissions,
     Portfolio,
     PortfolioInvitation,
     PortfolioRole,
     TaskOrder,
+    User,
 )
 
 
-def get_resources_from_context(view_args):
+def _with_user_roles(query, user, application_query):
+    """
+    Extends a resource query to also return user, with their permission sets,
+    and their roles and permission sets on the queried portfolio and
+    application, so that authorizing the request needs no further queries.
+    """
+    portfolio_role = aliased(PortfolioRole)
+    query = (
+        query.add_entity(User)
+        .filter(User.id == user.id)
+        .outerjoin(
+            portfolio_role,
+            and_(
+                portfolio_role.portfolio_id == Portfolio.id,
+                portfolio_role.user_id == user.id,
+            ),
+        )
+        .add_entity(portfolio_role)
+        .options(
+            joinedload(User.permission_sets),
+            joinedload(portfolio_role.permission_sets),
+        )
+    )
+
+    if application_query:
+        application_role = aliased(ApplicationRole)
+        query = (
+            query.outerjoin(
+                application_role,
+                and_(
+                    application_role.application_id == Application.id,
+                    application_role.user_id == user.id,
+                    application_role.deleted == False,
+                ),
+            )
+            .add_entity(application_role)
+            .options(joinedload(application_role.permission_sets))
+        )
+
+    return query
+
+
+def _attach_scoped_context(user, resources, portfolio_role, application_role=None):
+    portfolio, application = resources[0], None
+    if isinstance(resources[-1], Application):
+        application = resources[-1]
+
+    context = AuthorizationContext.for_resource(
+        user,
+        portfolio.id,
+        portfolio_role,
+        application_id=application.id if application else None,
+        application_role=application_role,
+    )
+    # a context from the user's authorization snapshot keeps its other roles,
+    # but the ones just read are at least as fresh as the snapshot's
+    existing = context_for(user)
+    if existing is not None:
+        context = existing.merge(context)
+
+    attach_context(user, context)
+
+
+def get_resources_from_context(view_args, user=None):
+    """
+    Returns the portfolio and, if the route names one, the application or
+    task order the route is for.
+
+    If user is given, their roles on those resources are loaded by the same
+    query and attached to user as a scoped AuthorizationContext, or merged
+    into the context already attached to them.
+    """
     query = None
+    application_query = False
 
     if "portfolio_token" in view_args:
         query = (
@@ -41,6 +122,7 @@ def get_resources_from_context(view_args):
             .join(Application, Application.portfolio_id == Portfolio.id)
             .filter(Application.id == view_args["application_id"])
         )
+        application_query = True
 
     elif "environment_id" in view_args:
         query = (
@@ -49,6 +131,7 @@ def get_resources_from_context(view_args):
             .join(Environment, Environment.application_id == Application.id)
             .filter(Environment.id == view_args["environment_id"])
         )
+        application_query = True
 
     elif "task_order_id" in view_args:
         query = (
@@ -58,18 +141,29 @@ def get_resources_from_context(view_args):
         )
 
     if query:
+        resource_count = len(query.column_descriptions)
+        if user is not None:
+            query = _with_user_roles(query, user, application_query)
+
         try:
-            return query.only_return_tuples(True).one()
+            result = query.only_return_tuples(True).one()
         except NoResultFound:
             raise NotFoundError("portfolio")
 
+        resources = result[:resource_count]
+        if user is not None:
+            # the user entity follows the resources, then their roles
+            _attach_scoped_context(user, resources, *result[resource_count + 1 :])
+
+        return resources
+
 
 def assign_resources(view_args):
     g.portfolio = None
     g.application = None
     g.task_order = None
 
-    resources = get_resources_from_context(view_args)
+    resources = get_resources_from_context(view_args, user=g.current_user or None)
     if resources:
         for resource in resources:
             if isinstance(resource, Portfolio):
@@ -81,16 +175,21 @@ def assign_resources(view_args):
 
 
 def user_can_view(permission):
+    # templates call this many times per page, so look up the context once
+    # and check against it directly
     if g.application:
-        return Authorization.has_application_permission(
-            g.current_user, g.application, permission
+        application = g.application
+        context = authorization_context(
+            g.current_user, application.portfolio_id, application.id
         )
-    elif g.portfolio:
-        return Authorization.has_portfolio_permission(
-            g.current_user, g.portfolio, permission
+        return context.has_application_permission(
+            application.portfolio_id, application.id, permission
         )
+    elif g.portfolio:
+        context = authorization_context(g.current_user, g.portfolio.id)
+        return context.has_portfolio_permission(g.portfolio.id, permission)
     else:
-        return Authorization.has_atat_permission(g.current_user, permission)
+        return authorization_context(g.current_user).has_atat_permission(permission)
 
 
 def portfolio():
@@ -40,6 +40,8 @@ class JsonFormatter(logging.Formatter):
         ("severity", lambda r: r.levelname),
         ("tags", lambda r: r.__dict__.get("tags")),
         ("audit_event", lambda r: r.__dict__.get("audit_event")),
+        ("timings", lambda r: r.__dict__.get("timings")),
+        ("queries", lambda r: r.__dict__.get("queries")),
     ]
 
     def __init__(self, *args, source="atst", **kwargs):
@@ -1,5 +1,8 @@
 from contextlib import contextmanager
+import os
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 
 
@@ -13,15 +16,39 @@ class MailConnection(object):
 
 
 class SMTPConnection(MailConnection):
-    def __init__(self, server, port, username, password, use_tls=False):
+    """
+    Keeps up to `pool_size` logged in SMTP sessions open between messages, so
+    each message doesn't pay for a new connection, TLS handshake and login.
+    An idle session is checked with a NOOP before it is reused, and closed
+    once it has been idle for `idle_timeout` seconds.
+
+    Sessions belong to the process that opened them: a forked worker opens
+    its own rather than sharing its parent's sockets.
+    """
+
+    def __init__(
+        self,
+        server,
+        port,
+        username,
+        password,
+        use_tls=False,
+        pool_size=1,
+        idle_timeout=60,
+    ):
         self.server = server
         self.port = port
         self.username = username
         self.password = password
         self.use_tls = use_tls
-
-    @contextmanager
-    def _connected_host(self):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # (session, time it was last used) pairs, most recently used last
+        self._idle = []
+
+    def _connect(self):
         host = None
 
         if self.use_tls:
@@ -32,17 +59,88 @@ class SMTPConnection(MailConnection):
 
         host.login(self.username, self.password)
 
-        yield host
+        return host
+
+    def _disconnect(self, host):
+        try:
+            host.quit()
+        except (smtplib.SMTPException, OSError):
+            host.close()
+
+    def _is_alive(self, host):
+        try:
+            status, _ = host.noop()
+            return status == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _forget_parent_sessions(self):
+        # must be called holding the lock
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                self._forget_parent_sessions()
+                if not self._idle:
+                    break
+                host, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.idle_timeout and self._is_alive(
+                host
+            ):
+                return host
+
+            self._disconnect(host)
+
+        return self._connect()
+
+    def _checkin(self, host):
+        with self._lock:
+            self._forget_parent_sessions()
+            if len(self._idle) < self.pool_size:
+                self._idle.append((host, time.monotonic()))
+                return
+
+        self._disconnect(host)
+
+    @contextmanager
+    def _connected_host(self):
+        host = self._checkout()
+
+        try:
+            yield host
+        except Exception:
+            # the session may have been left mid-transaction, so it isn't reused
+            self._disconnect(host)
+            raise
+
+        self._checkin(host)
+
+    def close(self):
+        """Closes every idle session."""
+        with self._lock:
+            self._forget_parent_sessions()
+            idle, self._idle = self._idle, []
 
-        host.quit()
+        for host, _ in idle:
+            self._disconnect(host)
 
     @property
     def messages(self):
         return []
 
     def send(self, message):
-        with self._connected_host() as host:
-            host.send_message(message)
+        try:
+            with self._connected_host() as host:
+                host.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # the server dropped the session after its health check; try once
+            # more on a new one
+            with self._connected_host() as host:
+                host.send_message(message)
 
 
 class RedisConnection(MailConnection):
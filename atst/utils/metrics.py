@@ -0,0 +1,89 @@
+import re
+import socket
+import time
+
+
+class Metrics:
+    """
+    Discards everything it is given. Used when no metrics backend is
+    configured, so instrumented code does not have to check.
+    """
+
+    def timing(self, name, milliseconds, tags=None):
+        pass
+
+    def histogram(self, name, value, tags=None):
+        pass
+
+
+class StatsdMetrics(Metrics):
+    """
+    Sends timings and histograms to a statsd agent over UDP. Tags are appended in the
+    DogStatsD format, which the Datadog agent and Prometheus' statsd_exporter
+    both turn into labels; timings become histograms on the agent side.
+    Sends are fire-and-forget, so a missing agent never slows a request.
+    """
+
+    _TAG_UNSAFE = re.compile(r"[^\w.\-/]")
+
+    def __init__(self, host, port=8125, prefix="atat"):
+        try:
+            # resolve once rather than on every send
+            host = socket.gethostbyname(host)
+        except OSError:
+            pass
+
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def _format_tags(self, tags):
+        return ",".join(
+            "{}:{}".format(key, self._TAG_UNSAFE.sub("_", str(value)))
+            for key, value in sorted(tags.items())
+        )
+
+    def timing(self, name, milliseconds, tags=None):
+        self._send("{}.{}:{:.3f}|ms".format(self.prefix, name, milliseconds), tags)
+
+    def histogram(self, name, value, tags=None):
+        self._send("{}.{}:{}|h".format(self.prefix, name, value), tags)
+
+    def _send(self, line, tags):
+        if tags:
+            line = "{}|#{}".format(line, self._format_tags(tags))
+
+        try:
+            self._socket.sendto(line.encode(), self.address)
+        except OSError:
+            pass
+
+
+class StageTimer:
+    """
+    Records the time spent in each stage of an operation, in milliseconds.
+    Call mark() as each stage finishes and stop() when the operation does.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._started = self._last = time.perf_counter()
+        self._stopped = None
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = (now - self._last) * 1000
+        self._last = now
+
+    def stop(self):
+        self._stopped = time.perf_counter()
+
+    @property
+    def total(self):
+        return ((self._stopped or self._last) - self._started) * 1000
+
+    def report(self, metrics, name, tags=None):
+        for stage, milliseconds in self.stages.items():
+            metrics.timing("{}.{}".format(name, stage), milliseconds, tags=tags)
+        metrics.timing("{}.total".format(name), self.total, tags=tags)
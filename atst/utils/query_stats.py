@@ -0,0 +1,143 @@
+import time
+from collections import Counter
+
+from flask import current_app as app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceededError(Exception):
+    def __init__(self, endpoint, count, budget):
+        self.endpoint = endpoint
+        self.count = count
+        self.budget = budget
+
+    @property
+    def message(self):
+        return "{} issued {} SQL queries, over its budget of {}".format(
+            self.endpoint, self.count, self.budget
+        )
+
+    def __str__(self):
+        return self.message
+
+
+class RequestQueries:
+    """
+    The SQL statements issued while handling a request and the time spent
+    executing them, in milliseconds. Statements are counted by their text,
+    which SQLAlchemy renders with bound parameters, so loading the same
+    relationship once per row shows up as one statement repeated many times.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, milliseconds):
+        self.count += 1
+        self.duration += milliseconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Statements issued at least threshold times, most repeated first."""
+        if not threshold:
+            return []
+
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def query_budget(max_queries):
+    """
+    Overrides SQL_QUERY_BUDGET for a view that legitimately needs more, or
+    should be held to fewer, queries than the default.
+    """
+
+    def decorator(f):
+        f.query_budget = max_queries
+        return f
+
+    return decorator
+
+
+def _current_queries():
+    if has_request_context():
+        return g.get("queries")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if _current_queries() is not None:
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    queries = _current_queries()
+    started = conn.info.get("query_started_at")
+    if queries is not None and started:
+        queries.record(statement, (time.perf_counter() - started.pop()) * 1000)
+
+
+def _budget_for(endpoint):
+    view = app.view_functions.get(endpoint)
+    return getattr(view, "query_budget", app.config.get("SQL_QUERY_BUDGET"))
+
+
+def report_queries(queries):
+    endpoint = request.endpoint or "unknown"
+    tags = {"endpoint": endpoint}
+    app.metrics.timing("request.sql.duration", queries.duration, tags=tags)
+    app.metrics.histogram("request.sql.queries", queries.count, tags=tags)
+
+    budget = _budget_for(request.endpoint)
+    over_budget = bool(budget) and queries.count > budget
+    repeated = queries.repeated(app.config.get("SQL_REPEATED_QUERY_THRESHOLD"))
+    if over_budget or repeated:
+        app.logger.warning(
+            "{} issued {} SQL queries in {:.2f}ms".format(
+                endpoint, queries.count, queries.duration
+            ),
+            extra={
+                "queries": {
+                    "endpoint": endpoint,
+                    "count": queries.count,
+                    "duration": queries.duration,
+                    "budget": budget,
+                    "repeated": [
+                        {"statement": statement, "count": count}
+                        for statement, count in repeated
+                    ],
+                }
+            },
+        )
+
+    if over_budget and app.config.get("SQL_QUERY_BUDGET_ENFORCE"):
+        raise QueryBudgetExceededError(endpoint, queries.count, budget)
+
+
+def make_query_stats(app):
+    """
+    Counts the SQL queries each request issues and the time spent in them,
+    reports both as metrics and logs requests that go over their query
+    budget or repeat a statement SQL_REPEATED_QUERY_THRESHOLD or more times.
+
+    Should be registered before any other before_request hook so the queries
+    they issue are counted too.
+    """
+
+    @app.before_request
+    def _start_counting_queries():
+        g.queries = RequestQueries()
+
+    @app.after_request
+    def _report_queries(response):
+        queries = g.pop("queries", None)
+        if queries is not None:
+            report_queries(queries)
+        return response
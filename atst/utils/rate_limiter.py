@@ -0,0 +1,77 @@
+from redis.exceptions import RedisError
+
+
+# Refills the bucket for the time since it was last used, then takes `cost`
+# tokens if there are enough. Returns 0 when they were taken, otherwise the
+# seconds until there will be. A cost larger than the bucket can hold is
+# taken once the bucket is full, leaving it in debt, so later calls wait
+# until the whole cost has been refilled. Redis' clock is used so every
+# process agrees on how much time has passed.
+_TAKE_TOKEN = """
+redis.replicate_commands()
+
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local needed = math.min(cost, capacity)
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+
+local wait = 0
+if tokens >= needed then
+    tokens = tokens - cost
+else
+    wait = (needed - tokens) / rate
+end
+
+redis.call("HMSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RateLimiter(object):
+    """
+    Token buckets kept in Redis, so every worker shares them. Each named
+    bucket refills at its limit of tokens per minute and holds at most
+    `burst` tokens. Names without a limit are not throttled.
+
+    If Redis is unavailable, calls are let through rather than blocked.
+    """
+
+    KEY_PREFIX = "rate_limit"
+
+    def __init__(self, redis, limits, burst=1, logger=None):
+        self.redis = redis
+        self.limits = limits
+        self.burst = burst
+        self.logger = logger
+        self._take_token = redis.register_script(_TAKE_TOKEN)
+
+    def _bucket_key(self, name):
+        return "{}:{}".format(self.KEY_PREFIX, name)
+
+    def acquire(self, name, cost=1):
+        """
+        Takes `cost` tokens from the named bucket. Returns 0 if they were
+        taken, otherwise the number of seconds until they will be.
+        """
+        per_minute = self.limits.get(name)
+        if not per_minute:
+            return 0
+
+        try:
+            wait = self._take_token(
+                keys=[self._bucket_key(name)], args=[per_minute / 60, self.burst, cost],
+            )
+        except RedisError as err:
+            if self.logger:
+                self.logger.warning("Rate limiter unavailable: {}".format(err))
+            return 0
+
+        return float(wait)
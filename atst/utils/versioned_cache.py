@@ -0,0 +1,153 @@
+import json
+
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class VersionedCache(object):
+    """
+    Caches a JSON value per user in Redis.
+
+    Each user has a version counter, and there is one global epoch for
+    changes that affect everyone. A value records the version and epoch it
+    was built from and is only used while both still match, so a value
+    written by a request that raced with an invalidation is ignored rather
+    than served.
+
+    If an invalidation can't be sent, cached values are not used until it
+    has been, since the ones it should have invalidated are stale. It is
+    sent again with each value read.
+
+    Subclasses set KEY_PREFIX, VALUE_KEY, changed to ignore values cached in
+    an older format, and DESCRIPTION, for log messages.
+    """
+
+    KEY_PREFIX = None
+    VALUE_KEY = None
+    DESCRIPTION = None
+
+    def __init__(self, redis, ttl, logger=None):
+        self.redis = redis
+        self.ttl = ttl
+        self.logger = logger
+        # invalidations that failed to send, as (user_ids, everyone)
+        self._unsent = (set(), False)
+
+    @property
+    def _epoch_key(self):
+        return "{}:epoch".format(self.KEY_PREFIX)
+
+    def _value_key(self, user_id):
+        return "{}:{}:{}".format(self.KEY_PREFIX, self.VALUE_KEY, user_id)
+
+    def _version_key(self, user_id):
+        return "{}:version:{}".format(self.KEY_PREFIX, user_id)
+
+    def _load(self, user_id):
+        """
+        Returns the version a value for the user would be stored under and
+        the value cached for it, or None. The version is None if the cache
+        can't be used, in which case nothing should be stored either.
+        """
+        if self._has_unsent() and not self.invalidate():
+            return None, None
+
+        try:
+            version, epoch, payload = self.redis.mget(
+                self._version_key(user_id), self._epoch_key, self._value_key(user_id),
+            )
+        except RedisError as err:
+            self._log_error(err)
+            return None, None
+
+        version = (int(version or 0), int(epoch or 0))
+        cached = json.loads(payload) if payload else None
+        if cached is None or tuple(cached["version"]) != version:
+            return version, None
+
+        return version, cached["value"]
+
+    def _store(self, user_id, version, value):
+        try:
+            self.redis.setex(
+                name=self._value_key(user_id),
+                value=json.dumps({"version": version, "value": value}),
+                time=self.ttl,
+            )
+        except RedisError as err:
+            self._log_error(err)
+
+    def invalidate(self, user_ids=(), everyone=False):
+        """
+        Bumps the versions of the given users, or the global epoch, so their
+        cached values are no longer used, along with any invalidations that
+        failed before. Returns whether they were sent.
+        """
+        unsent_ids, unsent_everyone = self._unsent
+        user_ids = unsent_ids | set(user_ids)
+        everyone = unsent_everyone or everyone
+        try:
+            pipeline = self.redis.pipeline()
+            for user_id in user_ids:
+                pipeline.incr(self._version_key(user_id))
+                # outlive any value built from the previous version
+                pipeline.expire(self._version_key(user_id), self.ttl * 2)
+                pipeline.delete(self._value_key(user_id))
+            if everyone:
+                pipeline.incr(self._epoch_key)
+            pipeline.execute()
+        except RedisError as err:
+            self._log_error(err)
+            self._unsent = (user_ids, everyone)
+            return False
+
+        self._unsent = (set(), False)
+        return True
+
+    def _has_unsent(self):
+        user_ids, everyone = self._unsent
+        return bool(user_ids) or everyone
+
+    def _log_error(self, err):
+        if self.logger:
+            self.logger.warning("{} unavailable: {}".format(self.DESCRIPTION, err))
+
+
+def invalidate_on_commit(info_key, changes, invalidate, on_flush=None):
+    """
+    Listens to sessions for changes to cached values. After each flush,
+    `changes(session)` returns the ids of the users whose values changed and
+    whether everyone's did. Once the session's transaction commits, and the
+    changes are visible to the requests that rebuild the values, they are
+    passed to `invalidate(session, user_ids, everyone)`. They are passed to
+    `on_flush` as well, if given, as soon as they are flushed.
+    """
+
+    @event.listens_for(Session, "after_flush")
+    def _collect_invalidations(session, flush_context):
+        user_ids, everyone = changes(session)
+        if not user_ids and not everyone:
+            return
+
+        pending_ids, pending_everyone = session.info.get(info_key, (set(), False))
+        session.info[info_key] = (pending_ids | user_ids, pending_everyone or everyone)
+        if on_flush:
+            on_flush(session, user_ids, everyone)
+
+    @event.listens_for(Session, "after_commit")
+    def _invalidate_committed(session):
+        # releasing a savepoint doesn't make its changes visible
+        if session.transaction.nested:
+            return
+
+        pending = session.info.pop(info_key, None)
+        if pending:
+            invalidate(session, *pending)
+
+    @event.listens_for(Session, "after_transaction_end")
+    def _discard_pending_invalidations(session, transaction):
+        # invalidating too much is harmless, so a rolled back savepoint's
+        # changes stay pending until the whole transaction ends
+        if transaction.parent is None:
+            session.info.pop(info_key, None)
@@ -87,7 +87,7 @@ variable "administrator_login_password" {
 variable "postgres_version" {
   type        = string
   description = "Postgres version to use"
-  default     = "10"
+  default     = "11"
 }
 
 variable "ssl_enforcement" {
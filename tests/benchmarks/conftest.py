@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import statistics
+import time
+
+import pytest
+
+from atst.database import db as _db
+import tests.factories as factories
+from tests.benchmarks.seed import seed_dataset
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "../../.benchmarks/routes.json")
+WARMUP_ROUNDS = 3
+ROUNDS = 30
+# a route has regressed when its p95 is this many times its baseline p95
+TOLERANCE = 1.25
+
+
+def _bind_session(connection):
+    session = _db.create_scoped_session(options=dict(bind=connection, binds={}))
+    _db.session = session
+
+    for cls in factories.__dict__.values():
+        if isinstance(cls, type) and cls.__module__ == "tests.factories":
+            cls._meta.sqlalchemy_session = session
+            cls._meta.sqlalchemy_session_persistence = "commit"
+
+    return session
+
+
+@pytest.fixture(scope="session")
+def benchmark_connection(db):
+    """
+    A connection whose transaction lasts for every benchmark, so the dataset
+    is seeded once and rolled back at the end of the run.
+    """
+    connection = db.engine.connect()
+    transaction = connection.begin()
+
+    yield connection
+
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def dataset(benchmark_connection, request):
+    session = _bind_session(benchmark_connection)
+    dataset = seed_dataset(session, scale=request.config.getoption("--benchmark-scale"))
+    session.remove()
+    return dataset
+
+
+@pytest.fixture(autouse=True)
+def report_query_budgets(app, monkeypatch):
+    # the dataset is far larger than the rest of the suite's, so routes going
+    # over their query budget are logged rather than failed here
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_ENFORCE", False)
+
+
+@pytest.fixture(autouse=True)
+def session(benchmark_connection):
+    session = _bind_session(benchmark_connection)
+    yield session
+    session.remove()
+
+
+def percentile(timings, percent):
+    """Nearest-rank percentile of a list of timings."""
+    ordered = sorted(timings)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request):
+    results = {}
+
+    yield results
+
+    if request.config.getoption("--benchmark-save") and results:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        baseline = {
+            "scale": request.config.getoption("--benchmark-scale"),
+            "routes": results,
+        }
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope="session")
+def baselines(request):
+    if request.config.getoption("--benchmark-save"):
+        return {}
+
+    try:
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+    # timings against a differently sized dataset are not comparable
+    if baseline["scale"] != request.config.getoption("--benchmark-scale"):
+        return {}
+
+    return baseline["routes"]
+
+
+@pytest.fixture
+def benchmark_route(client, benchmark_results, baselines, capsys):
+    """
+    Requests a route as a user WARMUP_ROUNDS + ROUNDS times, starting each
+    request with an empty session as a real request would, and fails if its
+    p95 latency has regressed past the stored baseline.
+    """
+
+    def _benchmark_route(name, url, user_id):
+        with client.session_transaction() as client_session:
+            client_session["user_id"] = user_id
+
+        timings = []
+        for attempt in range(WARMUP_ROUNDS + ROUNDS):
+            _db.session.remove()
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            assert response.status_code == 200
+            if attempt >= WARMUP_ROUNDS:
+                timings.append(elapsed)
+
+        result = {
+            "p50": statistics.median(timings),
+            "p95": percentile(timings, 95),
+        }
+        benchmark_results[name] = result
+
+        with capsys.disabled():
+            print(
+                "\n{}: p50 {:.1f}ms, p95 {:.1f}ms".format(
+                    name, result["p50"], result["p95"]
+                )
+            )
+
+        baseline = baselines.get(name)
+        if baseline:
+            assert (
+                result["p95"] <= baseline["p95"] * TOLERANCE
+            ), "{} p95 of {:.1f}ms regressed from a baseline of {:.1f}ms".format(
+                name, result["p95"], baseline["p95"]
+            )
+
+        return result
+
+    return _benchmark_route
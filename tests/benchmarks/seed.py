@@ -0,0 +1,159 @@
+"""
+Seeds the dataset the route benchmarks run against.
+
+The records the benchmarks request directly, and the users who request
+them, are built with the test factories. The bulk of the dataset is
+generated in the database with generate_series: creating hundreds of
+thousands of rows through the ORM would take longer than the benchmarks
+themselves.
+"""
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import text
+
+from atst.models import ApplicationRoleStatus, PortfolioRoleStatus
+from tests.factories import (
+    ApplicationFactory,
+    ApplicationRoleFactory,
+    EnvironmentRoleFactory,
+    PortfolioFactory,
+    PortfolioRoleFactory,
+    TaskOrderFactory,
+    UserFactory,
+    random_defense_component,
+    random_past_date,
+)
+
+
+PORTFOLIOS = 5000
+APPLICATIONS_PER_PORTFOLIO = 2
+ENVIRONMENTS_PER_APPLICATION = 5
+AUDIT_EVENTS = 200000
+
+PORTFOLIO_APPLICATIONS = 25
+PORTFOLIO_MEMBERS = 20
+PORTFOLIO_TASK_ORDERS = 10
+APPLICATION_MEMBERS = 30
+
+
+@dataclass(frozen=True)
+class Dataset:
+    ccpo_id: UUID
+    owner_id: UUID
+    portfolio_id: UUID
+    application_id: UUID
+
+
+def _scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def _seed_portfolio(owner):
+    portfolio = PortfolioFactory.create(owner=owner)
+
+    for _ in range(PORTFOLIO_MEMBERS):
+        PortfolioRoleFactory.create(
+            portfolio=portfolio, status=PortfolioRoleStatus.ACTIVE
+        )
+
+    for _ in range(PORTFOLIO_TASK_ORDERS):
+        TaskOrderFactory.create(
+            portfolio=portfolio, signed_at=random_past_date(), create_clins=[{}, {}],
+        )
+
+    applications = [
+        ApplicationFactory.create(
+            portfolio=portfolio,
+            name="Application {}".format(i),
+            environments=[
+                {"name": "Environment {}".format(j), "creator": owner}
+                for j in range(ENVIRONMENTS_PER_APPLICATION)
+            ],
+        )
+        for i in range(PORTFOLIO_APPLICATIONS)
+    ]
+
+    application = applications[0]
+    for _ in range(APPLICATION_MEMBERS):
+        role = ApplicationRoleFactory.create(
+            application=application, status=ApplicationRoleStatus.ACTIVE
+        )
+        for environment in application.environments:
+            EnvironmentRoleFactory.create(
+                environment=environment, application_role=role
+            )
+
+    return portfolio, application
+
+
+def _seed_bulk(session, creator_id, scale):
+    session.execute(
+        text(
+            """
+            INSERT INTO portfolios (name, description, defense_component)
+            SELECT 'Benchmark Portfolio ' || n, 'Seeded for benchmarks', :component
+            FROM generate_series(1, :count) AS n
+            """
+        ),
+        {"count": _scaled(PORTFOLIOS, scale), "component": random_defense_component()},
+    )
+    session.execute(
+        text(
+            """
+            INSERT INTO applications (name, portfolio_id)
+            SELECT 'Benchmark Application ' || n, portfolios.id
+            FROM portfolios CROSS JOIN generate_series(1, :count) AS n
+            WHERE portfolios.name LIKE 'Benchmark Portfolio %'
+            """
+        ),
+        {"count": APPLICATIONS_PER_PORTFOLIO},
+    )
+    session.execute(
+        text(
+            """
+            INSERT INTO environments (name, application_id, creator_id)
+            SELECT 'Benchmark Environment ' || n, applications.id, :creator_id
+            FROM applications CROSS JOIN generate_series(1, :count) AS n
+            WHERE applications.name LIKE 'Benchmark Application %'
+            """
+        ),
+        {"count": ENVIRONMENTS_PER_APPLICATION, "creator_id": creator_id},
+    )
+    # spread the events over every portfolio, oldest first
+    portfolio_count = session.execute(text("SELECT count(*) FROM portfolios")).scalar()
+    session.execute(
+        text(
+            """
+            INSERT INTO audit_events (
+                portfolio_id, resource_type, resource_id, display_name, action,
+                time_created
+            )
+            SELECT
+                portfolios.id, 'portfolio', portfolios.id, portfolios.name,
+                'update', now() - n * interval '1 minute'
+            FROM portfolios CROSS JOIN generate_series(1, :count) AS n
+            """
+        ),
+        {"count": max(1, _scaled(AUDIT_EVENTS, scale) // portfolio_count)},
+    )
+
+
+def seed_dataset(session, scale=1.0):
+    """
+    Seeds a dataset of PORTFOLIOS portfolios, their applications and
+    environments, and AUDIT_EVENTS audit events, each count multiplied by
+    scale, and returns the ids the benchmarks request.
+    """
+    ccpo = UserFactory.create_ccpo()
+    owner = UserFactory.create()
+    portfolio, application = _seed_portfolio(owner)
+    _seed_bulk(session, owner.id, scale)
+    session.commit()
+
+    return Dataset(
+        ccpo_id=ccpo.id,
+        owner_id=owner.id,
+        portfolio_id=portfolio.id,
+        application_id=application.id,
+    )
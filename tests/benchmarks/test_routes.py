@@ -0,0 +1,52 @@
+import pytest
+from flask import url_for
+
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_portfolios_index(benchmark_route, dataset):
+    benchmark_route(
+        "portfolios.portfolios", url_for("portfolios.portfolios"), dataset.ccpo_id
+    )
+
+
+def test_portfolio_applications(benchmark_route, dataset):
+    benchmark_route(
+        "applications.portfolio_applications",
+        url_for(
+            "applications.portfolio_applications", portfolio_id=dataset.portfolio_id
+        ),
+        dataset.owner_id,
+    )
+
+
+def test_application_settings(benchmark_route, dataset):
+    benchmark_route(
+        "applications.settings",
+        url_for("applications.settings", application_id=dataset.application_id),
+        dataset.owner_id,
+    )
+
+
+def test_portfolio_admin(benchmark_route, dataset):
+    benchmark_route(
+        "portfolios.admin",
+        url_for("portfolios.admin", portfolio_id=dataset.portfolio_id),
+        dataset.owner_id,
+    )
+
+
+def test_portfolio_funding(benchmark_route, dataset):
+    benchmark_route(
+        "task_orders.portfolio_funding",
+        url_for("task_orders.portfolio_funding", portfolio_id=dataset.portfolio_id),
+        dataset.owner_id,
+    )
+
+
+def test_activity_history(benchmark_route, dataset, app, monkeypatch):
+    monkeypatch.setitem(app.config, "USE_AUDIT_LOG", True)
+    benchmark_route(
+        "ccpo.activity_history", url_for("ccpo.activity_history"), dataset.ccpo_id
+    )
@@ -25,6 +25,40 @@ from cryptography.x509.oid import NameOID
 dictConfig({"version": 1, "handlers": {"wsgi": {"class": "logging.NullHandler"}}})
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="run the route benchmarks in tests/benchmarks",
+    )
+    group.addoption(
+        "--benchmark-save",
+        action="store_true",
+        help="store this run's timings as the baseline later runs are compared to",
+    )
+    group.addoption(
+        "--benchmark-scale",
+        type=float,
+        default=1.0,
+        help="multiply the size of the dataset the benchmarks are seeded with",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """
+    Skip tests marked with 'benchmark' unless --benchmark is given. They seed
+    a large dataset, so this is decided before any fixtures are set up.
+    """
+    if config.getoption("--benchmark"):
+        return
+
+    skip = pytest.mark.skip(reason="pass --benchmark to run route benchmarks")
+    for item in items:
+        if item.get_closest_marker("benchmark"):
+            item.add_marker(skip)
+
+
 @pytest.fixture(scope="session")
 def app(request):
     config = make_config()
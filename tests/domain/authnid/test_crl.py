@@ -3,23 +3,29 @@ import pytest
 import re
 import os
 import shutil
+import time
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.serialization import Encoding
 from OpenSSL import crypto
 
 from atst.domain.authnid.crl import (
     CRLCache,
+    CRLResultCache,
     CRLRevocationException,
     CRLInvalidException,
     NoOpCRLCache,
 )
+import atst.domain.authnid.crl.index as crl_index
 from atst.domain.authnid.crl.util import (
     load_crl_locations_cache,
     serialize_crl_locations_cache,
     CRLParseError,
     JSON_CACHE,
+    REVOCATION_INDEX,
 )
 
+from atst.utils.metrics import Metrics
+
 from tests.mocks import FIXTURE_EMAIL_ADDRESS, DOD_CN
 from tests.utils import FakeLogger, parse_for_issuer_and_next_update, make_crl_list
 
@@ -109,6 +115,402 @@ def test_can_dynamically_update_crls(
         assert cache.crl_check(client_pem)
 
 
+class CountingX509Store(crypto.X509Store):
+    instances = 0
+
+    def __init__(self):
+        super().__init__()
+        CountingX509Store.instances += 1
+
+
+@pytest.fixture
+def crl_parses(monkeypatch):
+    parsed = []
+    original = crl_index.load_crl_serials
+
+    def _load_crl_serials(crl_location, *args, **kwargs):
+        parsed.append(crl_location)
+        return original(crl_location, *args, **kwargs)
+
+    monkeypatch.setattr(crl_index, "load_crl_serials", _load_crl_serials)
+    return parsed
+
+
+def test_reuses_store_and_index_until_crl_changes(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+    crl_parses,
+):
+    CountingX509Store.instances = 0
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list, store_class=CountingX509Store)
+
+    assert cache.crl_check(client_pem)
+    assert cache.crl_check(client_pem)
+    assert CountingX509Store.instances == 1
+    assert len(crl_parses) == 1
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+    assert CountingX509Store.instances == 1
+    assert len(crl_parses) == 2
+
+
+def test_loads_existing_revocation_index_without_parsing(
+    ca_key, ca_file, crl_file, rsa_key, make_x509, crl_parses
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert os.path.isfile(os.path.join(crl_dir, REVOCATION_INDEX))
+
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert cache.crl_check(client_pem)
+    assert len(crl_parses) == 1
+
+
+def test_unreadable_crl_is_not_reindexed_until_it_changes(
+    ca_key, ca_file, crl_file, rsa_key, make_x509, crl_parses
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    garbage_path = os.path.join(crl_dir, "garbage.crl")
+    with open(garbage_path, "wb") as garbage:
+        garbage.write(b"not a crl")
+    crl_list = make_crl_list(client_cert, crl_file) + [
+        ("garbage.crl", b"garbage".hex())
+    ]
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert len(crl_parses) == 2
+
+    # the index covers the unreadable CRL, so it is current and is shared
+    cache.refresh()
+    assert cache.crl_check(client_pem)
+    assert CRLCache(ca_file, crl_dir, crl_list=crl_list).crl_check(client_pem)
+    assert len(crl_parses) == 2
+
+    with open(garbage_path, "ab") as garbage:
+        garbage.write(b" still not a crl")
+    cache.refresh()
+    assert crl_parses[2:] == [garbage_path]
+
+
+def test_builds_index_in_memory_when_crl_dir_is_not_accessible(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+    monkeypatch,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    # as if the index were written by the sync job running as another user
+    CRLCache(ca_file, crl_dir, crl_list=crl_list)
+
+    def _denied(*args, **kwargs):
+        raise PermissionError("Permission denied")
+
+    monkeypatch.setattr(crl_index.RevocationIndex, "load", _denied)
+    monkeypatch.setattr("atst.domain.authnid.crl.revocation_index_lock", _denied)
+
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert cache.crl_check(client_pem)
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+
+
+def test_replacing_expired_crl_restores_checks(
+    app,
+    ca_key,
+    ca_file,
+    expired_crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_dir = os.path.dirname(expired_crl_file)
+    crl_list = make_crl_list(client_cert, expired_crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+
+    with pytest.raises(CRLInvalidException):
+        cache.crl_check(client_pem)
+
+    serialize_pki_object_to_disk(
+        make_crl(ca_key), expired_crl_file, encoding=Encoding.DER
+    )
+    assert cache.crl_check(client_pem)
+
+
+def test_rejects_crl_not_signed_by_trusted_issuer(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    forged_crl = make_crl(rsa_key())
+    serialize_pki_object_to_disk(forged_crl, crl_file, encoding=Encoding.DER)
+    crl_dir = os.path.dirname(crl_file)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+
+    with pytest.raises(CRLInvalidException):
+        cache.crl_check(client_pem)
+
+
+def test_refresh_only_reparses_changed_crls(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+    crl_parses,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert cache.crl_check(client_pem)
+
+    cache.refresh()
+    assert len(crl_parses) == 1
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+    cache.refresh()
+    assert len(crl_parses) == 2
+
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+    assert len(crl_parses) == 2
+
+
+def test_workers_share_a_single_reindex(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+    crl_parses,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    first_worker = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    second_worker = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert len(crl_parses) == 1
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+    first_worker.refresh()
+    second_worker.refresh()
+
+    assert len(crl_parses) == 2
+    assert first_worker.revocations.generation == second_worker.revocations.generation
+    with pytest.raises(CRLRevocationException):
+        second_worker.crl_check(client_pem)
+
+
+def test_refresh_picks_up_new_crl_locations(
+    ca_key, ca_file, crl_file, rsa_key, make_x509
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert cache.crl_check(client_pem)
+
+    serialize_crl_locations_cache(crl_dir, crl_list=[])
+    cache.refresh()
+
+    with pytest.raises(CRLInvalidException):
+        cache.crl_check(client_pem)
+
+
+def test_background_refresher_swaps_in_updated_crls(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list, refresh_interval=0.01)
+
+    try:
+        assert cache.crl_check(client_pem)
+
+        revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+        serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+
+        for _ in range(200):
+            try:
+                cache.crl_check(client_pem)
+            except CRLRevocationException:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("refresher did not pick up the updated CRL")
+    finally:
+        cache.stop_refresher()
+
+
+class CountingStoreContext(crypto.X509StoreContext):
+    verifications = 0
+
+    def verify_certificate(self):
+        CountingStoreContext.verifications += 1
+        return super().verify_certificate()
+
+
+@pytest.fixture
+def crl_verifications(monkeypatch):
+    CountingStoreContext.verifications = 0
+    monkeypatch.setattr(crypto, "X509StoreContext", CountingStoreContext)
+    return CountingStoreContext
+
+
+def test_result_cache_skips_repeat_verification_until_crl_changes(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+    crl_verifications,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(
+        ca_file, crl_dir, crl_list=crl_list, result_cache=CRLResultCache(60)
+    )
+
+    assert cache.crl_check(client_pem)
+    assert cache.crl_check(client_pem)
+    assert crl_verifications.verifications == 1
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+
+
+def test_result_cache_is_shared_between_workers(
+    app, ca_key, ca_file, crl_file, rsa_key, make_x509, crl_verifications
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    workers = [
+        CRLCache(
+            ca_file,
+            crl_dir,
+            crl_list=crl_list,
+            result_cache=CRLResultCache(60, redis=app.redis),
+        )
+        for _ in range(2)
+    ]
+
+    for worker in workers:
+        assert worker.crl_check(client_pem)
+    assert crl_verifications.verifications == 1
+
+
+class RecordingMetrics(Metrics):
+    def __init__(self):
+        self.timings = {}
+
+    def timing(self, name, milliseconds, tags=None):
+        self.timings[name] = tags
+
+
+def test_crl_check_reports_stage_timings(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    metrics = RecordingMetrics()
+    logger = FakeLogger()
+    cache = CRLCache(
+        ca_file, crl_dir, crl_list=crl_list, metrics=metrics, logger=logger
+    )
+
+    assert cache.crl_check(client_pem)
+    assert set(metrics.timings) == {
+        "crl_check.parse_cert",
+        "crl_check.load_crl",
+        "crl_check.store",
+        "crl_check.verify",
+        "crl_check.revocation_lookup",
+        "crl_check.total",
+    }
+    assert metrics.timings["crl_check.total"] == {
+        "issuer": "ATAT",
+        "outcome": "passed",
+    }
+    assert "total" in logger.extras[-1]["timings"]
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+    assert metrics.timings["crl_check.total"]["outcome"] == "revoked"
+
+
 def test_throws_error_for_missing_issuer(app):
     cache = CRLCache(
         "ssl/server-certs/ca-chain.pem", app.config["CRL_STORAGE_CONTAINER"]
@@ -127,11 +529,17 @@ def test_throws_error_for_missing_issuer(app):
 
 
 FIXTURE_CRL_CACHE = "tests/fixtures/chain/crl_locations.json"
+FIXTURE_REVOCATION_INDEX = "tests/fixtures/chain/{}".format(REVOCATION_INDEX)
 
 
 def setup_function(test_multistep_certificate_chain):
-    if os.path.isfile(FIXTURE_CRL_CACHE):
-        os.remove(FIXTURE_CRL_CACHE)
+    for fixture in [
+        FIXTURE_CRL_CACHE,
+        FIXTURE_REVOCATION_INDEX,
+        "{}.lock".format(FIXTURE_REVOCATION_INDEX),
+    ]:
+        if os.path.isfile(fixture):
+            os.remove(fixture)
 
 
 def test_multistep_certificate_chain():
@@ -0,0 +1,161 @@
+import os
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import Encoding
+from OpenSSL import crypto
+
+import atst.domain.authnid.crl.index as crl_index
+from atst.domain.authnid.crl.index import (
+    RevocationIndex,
+    RevocationIndexError,
+    load_crl_serials,
+    write_revocation_index,
+)
+
+
+@pytest.fixture
+def trusted_cas(make_x509, ca_key):
+    ca = crypto.X509.from_cryptography(make_x509(ca_key))
+    return {ca.get_subject().der(): ca}
+
+
+def _write_crl(crl, path, serialize_pki_object_to_disk):
+    serialize_pki_object_to_disk(crl, path, encoding=Encoding.DER)
+    return str(path)
+
+
+def _issuer(crl):
+    return crl.issuer.public_bytes(default_backend())
+
+
+def test_index_round_trip(ca_key, make_crl, tmpdir, serialize_pki_object_to_disk):
+    serials = [1, 255, 256, 2 ** 64, 2 ** 158 + 7]
+    crl = make_crl(ca_key, expired_serials=serials)
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+
+    write_revocation_index(index_path, {_issuer(crl): crl_path})
+    index = RevocationIndex.load(index_path)
+    entry = index.get(_issuer(crl))
+
+    assert entry.serial_count == len(serials)
+    assert entry.is_current(crl_path)
+    assert not entry.is_expired()
+    for serial in serials:
+        assert index.is_revoked(entry, serial)
+    for serial in [0, 2, 254, 257, 2 ** 64 + 1, 2 ** 200, -1]:
+        assert not index.is_revoked(entry, serial)
+
+
+def test_index_is_readable_by_other_users(
+    ca_key, make_crl, tmpdir, serialize_pki_object_to_disk
+):
+    crl = make_crl(ca_key)
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+
+    write_revocation_index(index_path, {_issuer(crl): crl_path})
+
+    assert os.stat(index_path).st_mode & 0o777 == 0o644
+
+
+def test_index_with_no_revocations(
+    ca_key, make_crl, tmpdir, serialize_pki_object_to_disk
+):
+    crl = make_crl(ca_key)
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+
+    write_revocation_index(index_path, {_issuer(crl): crl_path})
+    index = RevocationIndex.load(index_path)
+    entry = index.get(_issuer(crl))
+
+    assert entry.serial_count == 0
+    assert not index.is_revoked(entry, 1)
+
+
+def test_index_records_expired_crls(
+    ca_key, make_crl, tmpdir, serialize_pki_object_to_disk
+):
+    crl = make_crl(ca_key, last_update_days=-7, next_update_days=-1)
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+
+    write_revocation_index(index_path, {_issuer(crl): crl_path})
+
+    assert RevocationIndex.load(index_path).get(_issuer(crl)).is_expired()
+
+
+def test_unchanged_crls_are_copied_from_previous_index(
+    ca_key, make_crl, tmpdir, serialize_pki_object_to_disk, monkeypatch
+):
+    crl = make_crl(ca_key, expired_serials=[42])
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+    write_revocation_index(index_path, {_issuer(crl): crl_path})
+    previous = RevocationIndex.load(index_path)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("CRL should not have been parsed")
+
+    monkeypatch.setattr(crl_index, "load_crl_serials", _fail)
+    write_revocation_index(index_path, {_issuer(crl): crl_path}, previous=previous)
+    index = RevocationIndex.load(index_path)
+
+    assert index.is_revoked(index.get(_issuer(crl)), 42)
+    # the previous mapping stays readable after the file is replaced
+    assert previous.is_revoked(previous.get(_issuer(crl)), 42)
+
+
+def test_untrusted_and_unparseable_crls_are_recorded_as_failed(
+    ca_key, rsa_key, make_crl, tmpdir, serialize_pki_object_to_disk, trusted_cas
+):
+    forged = make_crl(rsa_key(), cn="FORGED")
+    forged_path = _write_crl(
+        forged, tmpdir.join("forged.crl"), serialize_pki_object_to_disk
+    )
+    garbage_path = tmpdir.join("garbage.crl")
+    garbage_path.write(b"not a crl")
+    good = make_crl(ca_key)
+    good_path = _write_crl(good, tmpdir.join("good.crl"), serialize_pki_object_to_disk)
+    index_path = str(tmpdir.join("index"))
+
+    write_revocation_index(
+        index_path,
+        {
+            _issuer(forged): forged_path,
+            b"garbage": str(garbage_path),
+            _issuer(good): good_path,
+            b"missing": None,
+        },
+        certificate_authorities=trusted_cas,
+    )
+
+    index = RevocationIndex.load(index_path)
+    assert index.issuers() == {_issuer(forged), b"garbage", _issuer(good)}
+    assert index.get(_issuer(forged)).failed
+    assert index.get(b"garbage").failed
+    assert index.get(b"garbage").is_current(str(garbage_path))
+    assert not index.get(_issuer(good)).failed
+
+
+def test_load_crl_serials_rejects_untrusted_signer(
+    rsa_key, make_crl, tmpdir, serialize_pki_object_to_disk, trusted_cas
+):
+    crl = make_crl(rsa_key())
+    crl_path = _write_crl(crl, tmpdir.join("ca.crl"), serialize_pki_object_to_disk)
+
+    with pytest.raises(RevocationIndexError):
+        load_crl_serials(crl_path, certificate_authorities=trusted_cas)
+
+
+def test_load_rejects_corrupt_index(tmpdir):
+    index_path = tmpdir.join("index")
+    index_path.write(b"")
+    with pytest.raises(RevocationIndexError):
+        RevocationIndex.load(str(index_path))
+
+    index_path.write(b"definitely not an index")
+    with pytest.raises(RevocationIndexError):
+        RevocationIndex.load(str(index_path))
@@ -0,0 +1,34 @@
+import time
+from uuid import uuid4
+
+from atst.domain.authnid.crl import CRLResultCache
+
+
+def test_remembers_results_until_they_expire():
+    cache = CRLResultCache(60)
+    cache.add("fresh")
+    cache.add("expired", expires_at=time.time() - 1)
+
+    assert cache.get("fresh")
+    assert not cache.get("expired")
+    assert not cache.get("unknown")
+
+
+def test_evicts_least_recently_used_results():
+    cache = CRLResultCache(60, maxsize=2)
+    cache.add("first")
+    cache.add("second")
+    assert cache.get("first")
+    cache.add("third")
+
+    assert cache.get("first")
+    assert not cache.get("second")
+    assert cache.get("third")
+
+
+def test_shares_results_through_redis(app):
+    key = uuid4().hex
+    CRLResultCache(60, redis=app.redis).add(key)
+
+    assert CRLResultCache(60, redis=app.redis).get(key)
+    assert 0 < app.redis.ttl("crl_check:{}".format(key)) <= 60
@@ -0,0 +1,259 @@
+import functools
+import json
+import os
+import shutil
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import Encoding
+
+import atst.domain.authnid.crl.index as crl_index
+from atst.domain.authnid.crl import CRLCache
+from atst.domain.authnid.crl.index import RevocationIndex
+from atst.domain.authnid.crl.util import (
+    JSON_CACHE,
+    crl_local_path,
+    load_certificate_authorities,
+    refresh_crl,
+    revocation_index_path,
+    sync_crls,
+)
+
+from tests.utils import FakeLogger
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def crl_server(tmpdir):
+    """
+    Serves the contents of a directory over HTTP as a local stand-in for the
+    DISA CRL host.
+    """
+    served = tmpdir.mkdir("served")
+    handler = functools.partial(QuietHandler, directory=str(served))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield served, "http://127.0.0.1:{}".format(server.server_address[1])
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def served_crls(crl_server, make_crl, rsa_key, serialize_pki_object_to_disk):
+    """
+    Serves three valid CRLs, each revoking serials 1 through 3, and lists a
+    fourth that is missing from the server. Also returns the issuers' keys.
+    """
+    served, base_url = crl_server
+    crl_list = []
+    keys = []
+    for name in ["ONE.crl", "TWO.crl", "THREE.crl"]:
+        key = rsa_key()
+        crl = make_crl(key, cn=name, expired_serials=[1, 2, 3])
+        serialize_pki_object_to_disk(crl, served.join(name), encoding=Encoding.DER)
+        issuer = crl.issuer.public_bytes(default_backend())
+        crl_list.append(("{}/{}".format(base_url, name), issuer.hex()))
+        keys.append(key)
+
+    crl_list.append(("{}/MISSING.crl".format(base_url), b"MISSING".hex()))
+    return served, crl_list, keys
+
+
+@pytest.fixture
+def ca_chain(served_crls, make_x509, tmpdir):
+    _, crl_list, keys = served_crls
+    chain = tmpdir.join("ca-chain.pem")
+    chain.write_binary(
+        b"".join(
+            make_x509(key, cn=name).public_bytes(Encoding.PEM)
+            for key, name in zip(keys, ["ONE.crl", "TWO.crl", "THREE.crl"])
+        )
+    )
+    return str(chain)
+
+
+@pytest.fixture
+def sync_dirs(tmpdir):
+    return str(tmpdir.mkdir("crl-tmp")), str(tmpdir.mkdir("crls"))
+
+
+def test_sync_crls_downloads_concurrently(served_crls, sync_dirs):
+    served, crl_list, _ = served_crls
+    tmp_dir, final_dir = sync_dirs
+    logger = FakeLogger()
+
+    results = sync_crls(
+        tmp_dir, final_dir, crl_list=crl_list, logger=logger, max_workers=4
+    )
+
+    assert [result.status for result in results] == [
+        "updated",
+        "updated",
+        "updated",
+        "failed",
+    ]
+    for (crl_uri, _), result in zip(crl_list[:3], results):
+        published = crl_local_path(final_dir, crl_uri)
+        with open(published, "rb") as crl_file:
+            assert (
+                crl_file.read() == served.join(os.path.basename(crl_uri)).read_binary()
+            )
+        assert result.bytes_written == os.path.getsize(published)
+        assert result.crl_path == published
+    assert os.listdir(tmp_dir) == []
+
+    with open(os.path.join(final_dir, JSON_CACHE)) as json_file:
+        locations = json.load(json_file)
+    assert locations[b"MISSING".hex()] is None
+    assert locations[crl_list[0][1]] == crl_local_path(final_dir, crl_list[0][0])
+    assert "Synced 4 CRLs" in logger.messages[-1]
+    assert "3 updated" in logger.messages[-1]
+
+
+def test_sync_crls_skips_unmodified_crls(served_crls, sync_dirs):
+    _, crl_list, _ = served_crls
+    tmp_dir, final_dir = sync_dirs
+    sync_crls(tmp_dir, final_dir, crl_list=crl_list, logger=FakeLogger())
+
+    results = sync_crls(tmp_dir, final_dir, crl_list=crl_list, logger=FakeLogger())
+
+    assert [result.status for result in results[:3]] == ["unchanged"] * 3
+    assert sum(result.bytes_written for result in results) == 0
+    assert os.listdir(tmp_dir) == []
+
+
+def test_sync_crls_rejects_invalid_crls(
+    served_crls, sync_dirs, ca_chain, make_crl, rsa_key, serialize_pki_object_to_disk
+):
+    served, crl_list, keys = served_crls
+    tmp_dir, final_dir = sync_dirs
+    logger = FakeLogger()
+    # a previously published copy of TWO that should outlive a bad update
+    previous_two = crl_local_path(final_dir, crl_list[1][0])
+    shutil.copyfile(str(served.join("TWO.crl")), previous_two)
+    os.utime(previous_two, (0, 0))
+    expired = make_crl(keys[1], cn="TWO.crl", last_update_days=-7, next_update_days=-1)
+    serialize_pki_object_to_disk(expired, served.join("TWO.crl"), encoding=Encoding.DER)
+    forged = make_crl(rsa_key(), cn="THREE.crl")
+    serialize_pki_object_to_disk(
+        forged, served.join("THREE.crl"), encoding=Encoding.DER
+    )
+
+    results = sync_crls(
+        tmp_dir,
+        final_dir,
+        crl_list=crl_list,
+        logger=logger,
+        certificate_authorities=load_certificate_authorities(ca_chain),
+    )
+
+    assert [result.status for result in results] == [
+        "updated",
+        "rejected",
+        "rejected",
+        "failed",
+    ]
+    assert results[1].crl_path == previous_two
+    assert results[2].crl_path is None
+    assert os.listdir(tmp_dir) == []
+    assert not os.path.exists(crl_local_path(final_dir, crl_list[2][0]))
+    assert "2 rejected" in logger.messages[-1]
+
+    index = RevocationIndex.load(revocation_index_path(final_dir))
+    assert index.issuers() == {
+        bytes.fromhex(crl_list[0][1]),
+        bytes.fromhex(crl_list[1][1]),
+    }
+    assert not index.get(bytes.fromhex(crl_list[1][1])).is_expired()
+
+
+def test_sync_crls_publishes_revocation_index(
+    served_crls, sync_dirs, ca_chain, monkeypatch
+):
+    _, crl_list, _ = served_crls
+    tmp_dir, final_dir = sync_dirs
+    sync_crls(
+        tmp_dir,
+        final_dir,
+        crl_list=crl_list,
+        logger=FakeLogger(),
+        certificate_authorities=load_certificate_authorities(ca_chain),
+    )
+
+    index = RevocationIndex.load(revocation_index_path(final_dir))
+    for _, issuer in crl_list[:3]:
+        entry = index.get(bytes.fromhex(issuer))
+        assert all(index.is_revoked(entry, serial) for serial in [1, 2, 3])
+        assert not index.is_revoked(entry, 4)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("workers should not parse published CRLs")
+
+    monkeypatch.setattr(crl_index, "load_crl_serials", _fail)
+    crl_cache = CRLCache(ca_chain, final_dir, crl_list=crl_list)
+
+    assert crl_cache.revocations.generation == index.generation
+
+
+class FlakySession:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def get(self, *args, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return requests.get(*args, **kwargs)
+
+
+def test_refresh_crl_retries_connection_errors(served_crls, sync_dirs):
+    _, crl_list, _ = served_crls
+    tmp_dir, final_dir = sync_dirs
+    session = FlakySession(failures=1)
+
+    result = refresh_crl(
+        tmp_dir,
+        final_dir,
+        crl_list[0][0],
+        FakeLogger(),
+        session=session,
+        retries=2,
+        retry_backoff=0,
+    )
+
+    assert result.status == "updated"
+    assert result.attempts == 2
+    assert os.path.isfile(crl_local_path(tmp_dir, crl_list[0][0]))
+
+
+def test_refresh_crl_gives_up_after_retries(served_crls, sync_dirs):
+    _, crl_list, _ = served_crls
+    tmp_dir, final_dir = sync_dirs
+    logger = FakeLogger()
+    session = FlakySession(failures=10)
+
+    result = refresh_crl(
+        tmp_dir,
+        final_dir,
+        crl_list[0][0],
+        logger,
+        session=session,
+        retries=2,
+        retry_backoff=0,
+    )
+
+    assert result.status == "failed"
+    assert result.attempts == 3
+    assert "Error downloading" in logger.messages[-1]
+    assert not os.path.exists(crl_local_path(tmp_dir, crl_list[0][0]))
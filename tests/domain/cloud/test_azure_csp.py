@@ -3,10 +3,14 @@ from unittest.mock import Mock
 
 from uuid import uuid4
 
-from atst.domain.csp.cloud import AzureCloudProvider
+from atst.domain.csp.cloud import AzureCloudProvider, UserProvisioningException
 
 from tests.mock_azure import mock_azure, AUTH_CREDENTIALS
-from tests.factories import EnvironmentFactory, ApplicationFactory
+from tests.factories import (
+    EnvironmentFactory,
+    EnvironmentRoleFactory,
+    ApplicationFactory,
+)
 
 
 # TODO: Directly test create subscription, provide all args √
@@ -115,3 +119,52 @@ def test_create_policy_definition_succeeds(mock_azure: AzureCloudProvider):
         policy_definition_name=properties.get("displayName"),
         parameters=mock_policy_definition,
     )
+
+
+def test_create_or_update_users(mock_azure: AzureCloudProvider):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    existing_user = EnvironmentRoleFactory.create(
+        environment=environment, csp_user_id="existing_csp_user_id"
+    )
+    new_user = EnvironmentRoleFactory.create(environment=environment)
+    graph_client = mock_azure.sdk.graphrbac.GraphRbacManagementClient.return_value
+    graph_client.users.create.return_value.object_id = "new_csp_user_id"
+
+    result = mock_azure.create_or_update_users(
+        AUTH_CREDENTIALS, [existing_user, new_user]
+    )
+
+    assert result == {
+        existing_user.id: "existing_csp_user_id",
+        new_user.id: "new_csp_user_id",
+    }
+    # The clients are created once for the whole batch
+    mock_azure.sdk.authorization.AuthorizationManagementClient.assert_called_once()
+    mock_azure.sdk.graphrbac.GraphRbacManagementClient.assert_called_once()
+    graph_client.users.create.assert_called_once()
+    auth_client = (
+        mock_azure.sdk.authorization.AuthorizationManagementClient.return_value
+    )
+    assert auth_client.role_assignments.create.call_count == 2
+
+
+def test_create_or_update_users_returns_failures(mock_azure: AzureCloudProvider):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    env_roles = [
+        EnvironmentRoleFactory.create(environment=environment, csp_user_id=str(i))
+        for i in range(2)
+    ]
+    auth_client = (
+        mock_azure.sdk.authorization.AuthorizationManagementClient.return_value
+    )
+    auth_client.role_assignments.create.side_effect = [
+        Mock(),
+        mock_azure.sdk.exceptions.CloudError(Mock(), error="Role not found."),
+    ]
+
+    result = mock_azure.create_or_update_users(AUTH_CREDENTIALS, env_roles)
+
+    assert result[env_roles[0].id] == "0"
+    failure = result[env_roles[1].id]
+    assert isinstance(failure, UserProvisioningException)
+    assert failure.reason == "Role not found."
@@ -36,5 +36,15 @@ def test_create_or_update_user(mock_csp: MockCloudProvider):
     assert isinstance(csp_user_id, str)
 
 
+def test_create_or_update_users(mock_csp: MockCloudProvider):
+    environment = EnvironmentFactory.create()
+    env_roles = [
+        EnvironmentRoleFactory.create(environment=environment) for _ in range(2)
+    ]
+    csp_user_ids = mock_csp.create_or_update_users(CREDENTIALS, env_roles)
+    assert set(csp_user_ids) == {env_role.id for env_role in env_roles}
+    assert all(isinstance(csp_user_id, str) for csp_user_id in csp_user_ids.values())
+
+
 def test_disable_user(mock_csp: MockCloudProvider):
     assert mock_csp.disable_user(CREDENTIALS, "csp_user_id")
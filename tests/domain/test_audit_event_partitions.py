@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+import gzip
+import json
+from uuid import uuid4
+
+from atst.domain.audit_event_partitions import AuditEventPartitions
+from atst.models import AuditEvent
+
+
+def _create_events(session, time_created, count):
+    events = [
+        AuditEvent(
+            resource_type="user",
+            resource_id=uuid4(),
+            action="create",
+            time_created=time_created,
+        )
+        for _ in range(count)
+    ]
+    session.add_all(events)
+    session.commit()
+    return events
+
+
+def _partition_of(session, event):
+    return session.execute(
+        "SELECT tableoid::regclass::text FROM audit_events WHERE id = :id",
+        {"id": event.id},
+    ).scalar()
+
+
+def test_create_upcoming(session):
+    now = datetime(2031, 11, 15, tzinfo=timezone.utc)
+
+    created = AuditEventPartitions.create_upcoming(now=now)
+
+    assert created == [
+        "audit_events_y2031m11",
+        "audit_events_y2031m12",
+        "audit_events_y2032m01",
+        "audit_events_y2032m02",
+    ]
+    assert AuditEventPartitions.create_upcoming(now=now) == []
+
+
+def test_create_moves_events_out_of_the_default_partition(session):
+    month = datetime(2031, 6, 1, tzinfo=timezone.utc)
+    [in_month] = _create_events(session, month.replace(day=20), 1)
+    [next_month] = _create_events(session, month.replace(month=7), 1)
+    assert _partition_of(session, in_month) == "audit_events_default"
+
+    AuditEventPartitions.create(month)
+
+    assert _partition_of(session, in_month) == "audit_events_y2031m06"
+    assert _partition_of(session, next_month) == "audit_events_default"
+
+
+def test_archive_expired(session, tmpdir):
+    month = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    AuditEventPartitions.create(month)
+    events = _create_events(session, month.replace(day=10), 3)
+    [recent] = _create_events(session, datetime.now(timezone.utc), 1)
+    event_ids = {str(event.id) for event in events}
+
+    [path] = AuditEventPartitions.archive_expired(str(tmpdir), retention_months=12)
+
+    with gzip.open(path, "rt") as archive:
+        archived = [json.loads(line) for line in archive]
+    assert {event["id"] for event in archived} == event_ids
+    assert archived[0]["time_created"].startswith("2000-01-10")
+    assert month not in AuditEventPartitions.months()
+    assert session.query(AuditEvent).filter(AuditEvent.id.in_(event_ids)).count() == 0
+    assert session.query(AuditEvent).filter_by(id=recent.id).count() == 1
+
+
+def test_expired_keeps_the_retention_period(session):
+    months = [datetime(2019, month, 1, tzinfo=timezone.utc) for month in (5, 6, 7)]
+    for month in months:
+        AuditEventPartitions.create(month)
+
+    now = datetime(2020, 6, 15, tzinfo=timezone.utc)
+    assert AuditEventPartitions.expired(12, now=now) == months[:1]
@@ -35,8 +35,12 @@ def test_paginate_audit_log():
     for _ in range(100):
         AuditLog.log_system_event(user, action="create")
 
-    events = AuditLog.get_all_events(pagination_opts={"per_page": 25, "page": 2})
+    first_page = AuditLog.get_all_events(pagination_opts={"per_page": 25})
+    events = AuditLog.get_all_events(
+        pagination_opts={"per_page": 25, "after": first_page.next_cursor}
+    )
     assert len(events) == 25
+    assert not set(event.id for event in events) & set(event.id for event in first_page)
 
 
 @pytest.mark.audit_log
@@ -48,10 +52,14 @@ def test_paginate_ws_audit_log():
             resource=application, action="create", portfolio=portfolio
         )
 
+    first_page = AuditLog.get_portfolio_events(
+        portfolio, pagination_opts={"per_page": 25}
+    )
     events = AuditLog.get_portfolio_events(
-        portfolio, pagination_opts={"per_page": 25, "page": 2}
+        portfolio, pagination_opts={"per_page": 25, "after": first_page.next_cursor},
     )
     assert len(events) == 25
+    assert events.has_prev and events.has_next
 
 
 @pytest.mark.audit_log
@@ -0,0 +1,155 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+from redis.exceptions import RedisError
+from sqlalchemy import event
+
+from atst.database import db
+from atst.domain.authz import Authorization
+from atst.domain.authz.snapshot import (
+    AuthorizationSnapshot,
+    AuthorizationSnapshots,
+    snapshot_for,
+)
+from atst.domain.permission_sets import PermissionSets
+from atst.domain.portfolio_roles import PortfolioRoles
+from atst.models.permissions import Permissions
+
+from tests.factories import (
+    ApplicationRoleFactory,
+    PortfolioFactory,
+    PortfolioRoleFactory,
+    UserFactory,
+)
+
+
+@pytest.fixture
+def snapshots(app):
+    return AuthorizationSnapshots(app.redis, 60)
+
+
+@pytest.fixture
+def count_queries():
+    statements = []
+
+    def _record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _record)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", _record)
+
+
+def test_get_user_serves_cached_snapshot_without_queries(snapshots, count_queries):
+    portfolio = PortfolioFactory.create()
+    user = portfolio.owner
+    app_role = ApplicationRoleFactory.create(
+        user=user, application__portfolio=portfolio
+    )
+    user_id, full_name = user.id, user.full_name
+    application = app_role.application
+    assert portfolio.id and application.id
+    snapshots.get_user(user_id)
+    db.session.expunge(user)
+    count_queries.clear()
+
+    cached = snapshots.get_user(user_id)
+
+    assert cached is not user
+    assert cached.id == user_id
+    assert cached.full_name == full_name
+    assert Authorization.has_portfolio_permission(
+        cached, portfolio, Permissions.EDIT_PORTFOLIO_NAME
+    )
+    assert Authorization.has_application_permission(
+        cached, application, Permissions.VIEW_APPLICATION
+    )
+    assert count_queries == []
+
+
+def test_role_changes_invalidate_snapshot(app, snapshots, monkeypatch):
+    user = UserFactory.create()
+    portfolio = PortfolioFactory.create()
+    cached = snapshots.get_user(user.id)
+    assert not Authorization.has_portfolio_permission(
+        cached, portfolio, Permissions.VIEW_PORTFOLIO
+    )
+
+    monkeypatch.setattr(app, "authz_snapshots", snapshots)
+    port_role = PortfolioRoleFactory.create(
+        user=user,
+        portfolio=portfolio,
+        permission_sets=[PermissionSets.get(PermissionSets.VIEW_PORTFOLIO)],
+    )
+    assert snapshot_for(cached) is None
+
+    assert Authorization.has_portfolio_permission(
+        snapshots.get_user(user.id), portfolio, Permissions.VIEW_PORTFOLIO
+    )
+
+    PortfolioRoles.disable(PortfolioRoles.get_by_id(port_role.id))
+    assert not Authorization.has_portfolio_permission(
+        snapshots.get_user(user.id), portfolio, Permissions.VIEW_PORTFOLIO
+    )
+
+
+def test_snapshots_from_an_older_version_are_ignored(app, snapshots):
+    user = UserFactory.create()
+    stale = snapshot_for(snapshots.get_user(user.id))
+    snapshots.invalidate([user.id])
+    snapshots._store(stale.user_id, stale.version, stale.to_dict())
+
+    fresh = snapshot_for(snapshots.get_user(user.id))
+
+    assert fresh.version != stale.version
+    assert fresh.version == snapshot_for(snapshots.get_user(user.id)).version
+
+
+def test_get_user_without_ttl_skips_the_cache(app):
+    user = UserFactory.create()
+
+    assert snapshot_for(AuthorizationSnapshots(app.redis, 0).get_user(user.id)) is None
+
+
+def test_snapshots_are_stored_as_json(snapshots):
+    portfolio = PortfolioFactory.create()
+    ApplicationRoleFactory.create(
+        user=portfolio.owner, application__portfolio=portfolio
+    )
+    snapshot = snapshot_for(snapshots.get_user(portfolio.owner.id))
+
+    cached = json.loads(snapshots.redis.get(snapshots._value_key(snapshot.user_id)))
+
+    assert cached["value"]["user_id"] == str(snapshot.user_id)
+    assert (
+        AuthorizationSnapshot.from_dict(cached["value"], tuple(cached["version"]))
+        == snapshot
+    )
+
+
+def test_snapshots_are_not_used_until_a_failed_invalidation_is_sent(
+    app, snapshots, monkeypatch
+):
+    port_role = PortfolioRoleFactory.create(
+        permission_sets=[PermissionSets.get(PermissionSets.VIEW_PORTFOLIO)]
+    )
+    user, portfolio = port_role.user, port_role.portfolio
+    assert Authorization.has_portfolio_permission(
+        snapshots.get_user(user.id), portfolio, Permissions.VIEW_PORTFOLIO
+    )
+
+    with monkeypatch.context() as outage:
+        outage.setattr(app, "authz_snapshots", snapshots)
+        outage.setattr(snapshots.redis, "pipeline", Mock(side_effect=RedisError))
+        PortfolioRoles.disable(PortfolioRoles.get_by_id(port_role.id))
+
+        assert not Authorization.has_portfolio_permission(
+            snapshots.get_user(user.id), portfolio, Permissions.VIEW_PORTFOLIO
+        )
+
+    # the invalidation is sent once Redis is back, so the stale snapshot
+    # cached before the role was disabled isn't served either
+    assert not Authorization.has_portfolio_permission(
+        snapshots.get_user(user.id), portfolio, Permissions.VIEW_PORTFOLIO
+    )
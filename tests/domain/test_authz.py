@@ -8,6 +8,7 @@ from tests.factories import (
     PortfolioRoleFactory,
 )
 from atst.domain.authz import Authorization, user_can_access
+from atst.domain.authz.context import authorization_context
 from atst.domain.authz.decorator import user_can_access_decorator
 from atst.domain.permission_sets import PermissionSets
 from atst.domain.exceptions import UnauthorizedError
@@ -100,6 +101,25 @@ def test_user_can_access():
         )
 
 
+def test_authorization_context_is_reused_until_roles_change():
+    port_role = PortfolioRoleFactory.create(
+        permission_sets=PermissionSets.get_many([PermissionSets.EDIT_PORTFOLIO_ADMIN])
+    )
+    user, portfolio = port_role.user, port_role.portfolio
+
+    context = authorization_context(user)
+    assert context.has_portfolio_permission(
+        portfolio.id, Permissions.EDIT_PORTFOLIO_NAME
+    )
+    assert authorization_context(user) is context
+
+    PortfolioRoles.disable(portfolio_role=port_role)
+    assert authorization_context(user) is not context
+    assert not Authorization.has_portfolio_permission(
+        user, portfolio, Permissions.EDIT_PORTFOLIO_NAME
+    )
+
+
 @pytest.fixture
 def set_current_user(request_ctx):
     def _set_current_user(user):
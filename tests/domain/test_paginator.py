@@ -0,0 +1,78 @@
+from atst.domain.audit_log import AuditLog
+from atst.domain.common import Paginator
+
+from tests.factories import UserFactory
+
+
+def log_events(count):
+    user = UserFactory.create()
+    for _ in range(count):
+        AuditLog.log_system_event(user, action="create")
+    return user
+
+
+def event_ids(page):
+    return [event.id for event in page]
+
+
+def test_paginate_forwards_and_backwards(session):
+    log_events(35)
+
+    first = AuditLog.get_all_events(pagination_opts={"per_page": 10})
+    assert not first.has_prev and first.has_next
+
+    second = AuditLog.get_all_events(
+        pagination_opts={"per_page": 10, "after": first.next_cursor}
+    )
+    assert second.has_prev and second.has_next
+    assert not set(event_ids(first)) & set(event_ids(second))
+
+    previous = AuditLog.get_all_events(
+        pagination_opts={"per_page": 10, "before": second.prev_cursor}
+    )
+    assert event_ids(previous) == event_ids(first)
+
+
+def test_last_page_does_not_overlap_the_page_before_it(session):
+    log_events(25)
+    total = session.execute("SELECT count(*) FROM audit_events").scalar()
+    assert total % 10
+
+    last = AuditLog.get_all_events(pagination_opts={"per_page": 10, "last": True})
+    # the last page is the oldest page's worth of events
+    oldest = session.execute(
+        "SELECT id FROM audit_events ORDER BY time_created, id LIMIT 10"
+    ).fetchall()
+    assert event_ids(last) == [id_ for id_, in reversed(oldest)]
+    assert last.has_prev and not last.has_next
+
+    before_last = AuditLog.get_all_events(
+        pagination_opts={"per_page": 10, "before": last.prev_cursor}
+    )
+    assert len(before_last) == 10
+    assert not set(event_ids(before_last)) & set(event_ids(last))
+    assert before_last.items[-1].time_created >= last.items[0].time_created
+
+
+def test_invalid_cursor_starts_from_the_first_page(session):
+    log_events(5)
+
+    events = AuditLog.get_all_events(
+        pagination_opts={"per_page": 10, "after": "not a cursor"}
+    )
+
+    assert not events.has_prev
+    assert isinstance(events, Paginator)
+
+
+def test_page_number_is_ignored(app, session):
+    log_events(15)
+
+    with app.test_request_context("/?page=7&perPage=10") as context:
+        opts = Paginator.get_pagination_opts(context.request)
+
+    assert "page" not in opts
+    events = AuditLog.get_all_events(pagination_opts=opts)
+    assert event_ids(events) == event_ids(
+        AuditLog.get_all_events(pagination_opts={"per_page": 10})
+    )
@@ -1,3 +1,4 @@
+import datetime
 import pytest
 import random
 from uuid import uuid4
@@ -22,7 +23,9 @@ from tests.factories import (
     UserFactory,
     PortfolioRoleFactory,
     PortfolioFactory,
+    TaskOrderFactory,
     get_all_portfolio_permission_sets,
+    random_past_date,
 )
 
 
@@ -254,3 +257,61 @@ def test_for_user_does_not_include_deleted_application_roles():
         status=ApplicationRoleStatus.ACTIVE, user=user2, application=app, deleted=True
     )
     assert len(Portfolios.for_user(user2)) == 0
+
+
+def test_summaries_for_user(portfolio, portfolio_owner):
+    ApplicationFactory.create(portfolio=portfolio)
+    ApplicationFactory.create(portfolio=portfolio)
+    ApplicationFactory.create(portfolio=portfolio, deleted=True)
+
+    today = datetime.date.today()
+    end_date = today + datetime.timedelta(days=30)
+    TaskOrderFactory.create(
+        portfolio=portfolio,
+        signed_at=random_past_date(),
+        create_clins=[{"start_date": today, "end_date": end_date}],
+    )
+    TaskOrderFactory.create(
+        portfolio=portfolio,
+        signed_at=random_past_date(),
+        create_clins=[{"start_date": today, "end_date": today}],
+    )
+    # unsigned and expired task orders are not active
+    TaskOrderFactory.create(
+        portfolio=portfolio, create_clins=[{"start_date": today, "end_date": end_date}]
+    )
+    TaskOrderFactory.create(
+        portfolio=portfolio,
+        signed_at=random_past_date(),
+        create_clins=[
+            {"start_date": random_past_date(), "end_date": random_past_date(1, 1)}
+        ],
+    )
+    PortfolioFactory.create()
+
+    (summary,) = Portfolios.summaries_for_user(portfolio_owner)
+
+    assert summary.id == portfolio.id
+    assert summary.name == portfolio.name
+    assert summary.application_count == 2
+    assert summary.active_task_order_count == 2
+    assert summary.funding_end_date == end_date
+    assert summary.active_task_order_count == len(portfolio.active_task_orders)
+
+
+def test_summaries_for_user_without_applications_or_funding(portfolio_owner):
+    PortfolioFactory.create(owner=portfolio_owner, applications=[])
+
+    (summary,) = Portfolios.summaries_for_user(portfolio_owner)
+
+    assert summary.application_count == 0
+    assert summary.active_task_order_count == 0
+    assert summary.funding_end_date is None
+
+
+def test_summaries_for_ccpo_include_all_portfolios(portfolio):
+    ccpo = UserFactory.create_ccpo()
+
+    assert portfolio.id in [
+        summary.id for summary in Portfolios.summaries_for_user(ccpo)
+    ]
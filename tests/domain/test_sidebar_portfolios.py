@@ -0,0 +1,104 @@
+import pytest
+from flask import g, render_template_string
+
+from atst.domain.portfolios import Portfolios
+from atst.models import ApplicationRoleStatus, PortfolioRoleStatus
+from atst.domain.portfolios.sidebar import PortfolioLink, SidebarPortfolios
+
+from tests.factories import (
+    ApplicationRoleFactory,
+    PortfolioFactory,
+    PortfolioRoleFactory,
+    UserFactory,
+)
+
+
+@pytest.fixture
+def sidebar(app, monkeypatch):
+    sidebar = SidebarPortfolios(app.redis, 60)
+    monkeypatch.setattr(app, "sidebar_portfolios", sidebar)
+    return sidebar
+
+
+def test_for_user_lists_portfolio_links(sidebar):
+    user = UserFactory.create()
+    owned = PortfolioFactory.create(owner=user, name="Alpha")
+    through_application = ApplicationRoleFactory.create(
+        user=user,
+        application__portfolio__name="Beta",
+        status=ApplicationRoleStatus.ACTIVE,
+    ).application.portfolio
+    PortfolioFactory.create()
+
+    assert sidebar.for_user(user) == [
+        PortfolioLink(owned.id, "Alpha"),
+        PortfolioLink(through_application.id, "Beta"),
+    ]
+
+
+def test_for_user_serves_cached_links(sidebar, monkeypatch):
+    user = UserFactory.create()
+    portfolio = PortfolioFactory.create(owner=user)
+    links = sidebar.for_user(user)
+
+    monkeypatch.setattr("atst.domain.portfolios.Portfolios.links_for_user", pytest.fail)
+
+    assert (
+        sidebar.for_user(user) == links == [PortfolioLink(portfolio.id, portfolio.name)]
+    )
+
+
+def test_role_changes_invalidate_cached_links(sidebar):
+    user = UserFactory.create()
+    assert sidebar.for_user(user) == []
+
+    portfolio = PortfolioFactory.create()
+    PortfolioRoleFactory.create(
+        user=user, portfolio=portfolio, status=PortfolioRoleStatus.ACTIVE
+    )
+
+    assert sidebar.for_user(user) == [PortfolioLink(portfolio.id, portfolio.name)]
+
+
+def test_portfolio_changes_invalidate_cached_links(sidebar):
+    ccpo = UserFactory.create_ccpo()
+    member = UserFactory.create()
+    portfolio = PortfolioFactory.create(owner=member)
+    assert PortfolioLink(portfolio.id, portfolio.name) in sidebar.for_user(ccpo)
+    assert sidebar.for_user(member) == [PortfolioLink(portfolio.id, portfolio.name)]
+
+    Portfolios.update(portfolio, {"name": "Renamed"})
+    new_portfolio = PortfolioFactory.create()
+
+    ccpo_links = sidebar.for_user(ccpo)
+    assert PortfolioLink(portfolio.id, "Renamed") in ccpo_links
+    assert PortfolioLink(new_portfolio.id, new_portfolio.name) in ccpo_links
+    assert sidebar.for_user(member) == [PortfolioLink(portfolio.id, "Renamed")]
+
+
+def test_for_user_without_ttl_skips_the_cache(app, monkeypatch):
+    user = UserFactory.create()
+    portfolio = PortfolioFactory.create(owner=user)
+    monkeypatch.setattr(app.redis, "mget", pytest.fail)
+
+    assert SidebarPortfolios(app.redis, 0).for_user(user) == [
+        PortfolioLink(portfolio.id, portfolio.name)
+    ]
+
+
+def test_sidebar_is_loaded_once_per_request(app, sidebar, monkeypatch):
+    user = UserFactory.create()
+    PortfolioFactory.create(owner=user)
+    calls = []
+    for_user = sidebar.for_user
+    monkeypatch.setattr(sidebar, "for_user", lambda u: calls.append(u) or for_user(u))
+
+    with app.test_request_context():
+        app.preprocess_request()
+        # g outlives the request here, as it shares the tests' app context
+        monkeypatch.setattr(g, "current_user", user, raising=False)
+        # as an activity log does, rendering a template for each event
+        for _ in range(3):
+            render_template_string("{{ portfolios | length }}")
+
+    assert calls == [user]
@@ -55,6 +55,7 @@ def mock_policy():
 
 class MockAzureSDK(object):
     def __init__(self):
+        import msrestazure.azure_exceptions as exceptions
         from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
 
         self.subscription = mock_subscription()
@@ -63,6 +64,8 @@ class MockAzureSDK(object):
         self.graphrbac = mock_graphrbac()
         self.credentials = mock_credentials()
         self.policy = mock_policy()
+        # real exception classes, so they can be raised and caught
+        self.exceptions = exceptions
         # may change to a JEDI cloud
         self.cloud = AZURE_PUBLIC_CLOUD
 
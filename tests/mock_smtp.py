@@ -0,0 +1,83 @@
+import smtplib
+import socket
+import socketserver
+import threading
+
+import pytest
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def _read_data(self):
+        lines = []
+        for line in self.rfile:
+            if line == b".\r\n":
+                break
+            lines.append(line)
+        return b"".join(lines).decode()
+
+    def handle(self):
+        self.server.connections.append(self.connection)
+        self._reply("220 localhost SMTP stand-in")
+
+        for line in self.rfile:
+            verb = line.decode().split(" ")[0].strip().upper()
+            if verb == "EHLO":
+                self._reply("250-localhost")
+                self._reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                self.server.logins += 1
+                self._reply("235 Authentication successful")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.messages.append(self._read_data())
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("250 OK")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    """
+    A plaintext SMTP server that accepts any login and keeps the messages it
+    is sent, for testing connection handling against.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), _SMTPHandler)
+        self.connections = []
+        self.logins = 0
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_connections(self):
+        """Closes every open session from the server's end."""
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # the stand-in doesn't speak TLS
+    monkeypatch.setattr(smtplib, "SMTP_SSL", smtplib.SMTP)
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -1,6 +1,14 @@
+import pytest
+from unittest.mock import Mock
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from atst.database import db
+from atst.jobs import write_audit_events
+from atst.models import AuditEvent
 from tests.factories import UserFactory
-from atst.models.mixins.auditable import AuditableMixin
+from atst.models.mixins.auditable import AuditableMixin, PENDING_AUDIT_EVENTS
 from atst.domain.users import Users
 
 
@@ -51,3 +59,172 @@ def test_logging_audit_event_on_update(mock_logger):
     assert event_log["action"] == "update"
 
     assert "update" in mock_logger.extras[1]["tags"]
+
+
+@pytest.fixture
+def audit_log(app, monkeypatch):
+    monkeypatch.setitem(app.config, "USE_AUDIT_LOG", True)
+
+
+@pytest.fixture
+def audit_event_inserts(session):
+    inserts = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO audit_events"):
+            inserts.append(statement)
+
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", _record)
+    yield inserts
+    event.remove(connection, "before_cursor_execute", _record)
+
+
+@pytest.fixture
+def audit_event_stream(app, monkeypatch):
+    monkeypatch.setitem(app.config, "AUDIT_LOG_STREAM", True)
+    stream = app.audit_event_stream
+    app.redis.delete(stream.KEY)
+    yield stream
+    app.redis.delete(stream.KEY)
+
+
+def test_audit_events_are_written_together_on_commit(
+    audit_log, session, audit_event_inserts
+):
+    users = [UserFactory.build() for _ in range(3)]
+    session.add_all(users)
+    session.flush()
+    assert not audit_event_inserts
+
+    session.commit()
+
+    assert len(audit_event_inserts) == 1
+    assert session.query(AuditEvent).filter(
+        AuditEvent.resource_id.in_([user.id for user in users])
+    ).count() == len(users)
+
+
+def test_rolled_back_audit_events_are_discarded(audit_log, db):
+    # a session of its own, so rolling it back doesn't end the test's transaction
+    connection = db.engine.connect()
+    session = Session(bind=connection)
+
+    session.add(UserFactory.build())
+    session.flush()
+    assert session.info[PENDING_AUDIT_EVENTS]
+
+    session.rollback()
+    assert PENDING_AUDIT_EVENTS not in session.info
+
+    session.close()
+    connection.close()
+
+
+def test_audit_events_of_a_rolled_back_savepoint_are_discarded(audit_log, session):
+    kept = UserFactory.build()
+    session.add(kept)
+    savepoint = session.begin_nested()
+    discarded = UserFactory.build()
+    session.add(discarded)
+    session.flush()
+    savepoint.rollback()
+
+    released = session.begin_nested()
+    also_kept = UserFactory.build()
+    session.add(also_kept)
+    released.commit()
+    session.commit()
+
+    logged = {
+        event.resource_id
+        for event in session.query(AuditEvent).filter(
+            AuditEvent.resource_id.in_([kept.id, discarded.id, also_kept.id])
+        )
+    }
+    assert logged == {kept.id, also_kept.id}
+
+
+def test_audit_events_are_streamed_and_written_in_batches(
+    app, audit_log, audit_event_stream, session, monkeypatch
+):
+    users = [UserFactory.create() for _ in range(3)]
+    user_ids = [user.id for user in users]
+    assert (
+        not session.query(AuditEvent)
+        .filter(AuditEvent.resource_id.in_(user_ids))
+        .count()
+    )
+    assert app.redis.xlen(audit_event_stream.KEY) == len(users)
+
+    monkeypatch.setitem(app.config, "AUDIT_LOG_STREAM_BATCH_SIZE", 2)
+    write_audit_events.run()
+
+    assert session.query(AuditEvent).filter(
+        AuditEvent.resource_id.in_(user_ids)
+    ).count() == len(users)
+    assert app.redis.xlen(audit_event_stream.KEY) == 0
+
+
+def test_audit_events_read_again_are_written_once(
+    app, audit_log, audit_event_stream, session, monkeypatch
+):
+    user = UserFactory.create()
+    acknowledge = audit_event_stream.acknowledge
+    monkeypatch.setattr(audit_event_stream, "acknowledge", Mock(side_effect=RedisError))
+    with pytest.raises(RedisError):
+        write_audit_events.run()
+
+    monkeypatch.setattr(audit_event_stream, "acknowledge", acknowledge)
+    write_audit_events.run()
+
+    assert session.query(AuditEvent).filter_by(resource_id=user.id).count() == 1
+    assert app.redis.xlen(audit_event_stream.KEY) == 0
+
+
+def test_audit_events_are_written_directly_when_the_stream_is_down(
+    app, audit_log, audit_event_stream, session, monkeypatch
+):
+    stream = Mock(**{"available.return_value": False})
+    monkeypatch.setattr(app, "audit_event_stream", stream)
+
+    user = UserFactory.create()
+
+    assert session.query(AuditEvent).filter_by(resource_id=user.id).count() == 1
+    stream.add.assert_not_called()
+
+
+def test_audit_events_are_written_directly_when_the_stream_fails_after_commit(
+    app, audit_log, audit_event_stream, session, monkeypatch
+):
+    monkeypatch.setattr(
+        app,
+        "audit_event_stream",
+        Mock(**{"available.return_value": True, "add.side_effect": RedisError}),
+    )
+
+    user = UserFactory.create()
+
+    assert session.query(AuditEvent).filter_by(resource_id=user.id).count() == 1
+
+
+def test_audit_events_are_not_streamed_when_the_commit_fails(
+    app, audit_log, audit_event_stream, db
+):
+    connection = db.engine.connect()
+    session = Session(bind=connection)
+
+    def _fail(session):
+        raise RuntimeError("commit failed")
+
+    session.add(UserFactory.build())
+    event.listen(session, "before_commit", _fail)
+    with pytest.raises(RuntimeError):
+        session.commit()
+    session.rollback()
+
+    assert app.redis.xlen(audit_event_stream.KEY) == 0
+    assert not session.info
+
+    session.close()
+    connection.close()
@@ -274,6 +274,29 @@ def test_can_list_all_permissions():
     assert expected_perms == expected_perms
 
 
+def test_permissions_are_memoized_until_permission_sets_change(session):
+    funding = PermissionSets.get(PermissionSets.VIEW_PORTFOLIO_FUNDING)
+    reports = PermissionSets.get(PermissionSets.VIEW_PORTFOLIO_REPORTS)
+    port_role = PortfolioRoleFactory.create(permission_sets=[funding])
+
+    permissions = port_role.permissions
+    assert permissions == frozenset(funding.permissions)
+    assert port_role.permissions is permissions
+
+    port_role.permission_sets.append(reports)
+    assert port_role.permissions == frozenset(funding.permissions + reports.permissions)
+
+    port_role.permission_sets.remove(funding)
+    assert port_role.permissions == frozenset(reports.permissions)
+
+    PortfolioRoles.update(port_role, [PermissionSets.EDIT_PORTFOLIO_FUNDING])
+    edit_funding = PermissionSets.get(PermissionSets.EDIT_PORTFOLIO_FUNDING)
+    assert set(edit_funding.permissions) <= port_role.permissions
+
+    session.expire(port_role)
+    assert set(edit_funding.permissions) <= port_role.permissions
+
+
 def test_has_permission_set():
     perm_sets = PermissionSets.get_many(
         [PermissionSets.VIEW_PORTFOLIO_FUNDING, PermissionSets.VIEW_PORTFOLIO_REPORTS]
@@ -4,9 +4,11 @@ from unittest.mock import Mock
 import datetime
 from werkzeug.datastructures import ImmutableMultiDict
 import pytest
+from sqlalchemy import event
 
 from tests.factories import *
 
+from atst.database import db
 from atst.domain.applications import Applications
 from atst.domain.application_roles import ApplicationRoles
 from atst.domain.environment_roles import EnvironmentRoles
@@ -219,6 +221,46 @@ def test_get_members_data(app, client, user_session):
         assert isinstance(member["form"], UpdateMemberForm)
 
 
+def test_settings_queries_do_not_grow_with_members(app, client, user_session):
+    application = ApplicationFactory.create(
+        environments=[{"name": "Naboo"}, {"name": "Endor"}, {"name": "Hoth"}]
+    )
+    user_session(application.portfolio.owner)
+    url = url_for("applications.settings", application_id=application.id)
+
+    def add_members(count):
+        for _ in range(count):
+            app_role = ApplicationRoleFactory.create(application=application)
+            ApplicationInvitationFactory.create(role=app_role)
+            for environment in application.environments:
+                EnvironmentRoleFactory.create(
+                    environment=environment, application_role=app_role
+                )
+
+    def count_queries():
+        statements = []
+
+        def _record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.expire_all()
+        event.listen(db.engine, "before_cursor_execute", _record)
+        try:
+            assert client.get(url).status_code == 200
+        finally:
+            event.remove(db.engine, "before_cursor_execute", _record)
+
+        return len(statements)
+
+    add_members(1)
+    # warm the per-user caches the page reads, such as the sidebar
+    count_queries()
+    with_one_member = count_queries()
+    add_members(4)
+
+    assert count_queries() == with_one_member
+
+
 def test_user_with_permission_can_update_application(client, user_session):
     owner = UserFactory.create()
     portfolio = PortfolioFactory.create(
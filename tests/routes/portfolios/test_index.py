@@ -84,3 +84,21 @@ def test_portfolio_reports_with_mock_portfolio(client, user_session):
     response = client.get(url_for("portfolios.reports", portfolio_id=portfolio.id))
     assert response.status_code == 200
     assert portfolio.name in response.data.decode()
+
+
+def test_portfolios_lists_only_users_portfolios(client, user_session):
+    user = UserFactory.create()
+    portfolio = PortfolioFactory.create(owner=user)
+    ApplicationFactory.create(portfolio=portfolio)
+    other_portfolio = PortfolioFactory.create()
+    user_session(user)
+
+    response = client.get(url_for("portfolios.portfolios"))
+
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert (
+        url_for("applications.portfolio_applications", portfolio_id=portfolio.id)
+        in body
+    )
+    assert str(other_portfolio.id) not in body
@@ -1,13 +1,26 @@
+from datetime import datetime, timezone
+import os
+
 import pendulum
 import pytest
+from flask import current_app as app
 from uuid import uuid4
 from unittest.mock import Mock
 from threading import Thread
 
-from atst.domain.csp.cloud import MockCloudProvider
+from celery.exceptions import Ignore
+
+from atst.domain.audit_event_partitions import AuditEventPartitions
+from atst.domain.csp.cloud import (
+    GeneralCSPException,
+    MockCloudProvider,
+    UserProvisioningException,
+)
 from atst.jobs import (
     RecordEnvironmentFailure,
     RecordEnvironmentRoleFailure,
+    do_work,
+    retry_delay,
     do_create_environment,
     do_create_atat_admin_user,
     dispatch_create_environment,
@@ -15,8 +28,10 @@ from atst.jobs import (
     create_environment,
     dispatch_provision_user,
     do_provision_user,
+    do_provision_users,
+    maintain_audit_events,
 )
-from atst.models.utils import claim_for_update
+from atst.models.utils import claim_for_update, claim_many_for_update
 from atst.domain.exceptions import ClaimFailedException
 from tests.factories import (
     EnvironmentFactory,
@@ -24,7 +39,7 @@ from tests.factories import (
     PortfolioFactory,
     ApplicationRoleFactory,
 )
-from atst.models import EnvironmentRole, ApplicationRoleStatus
+from atst.models import Environment, EnvironmentRole, ApplicationRoleStatus
 
 
 @pytest.fixture(autouse=True, scope="function")
@@ -123,9 +138,75 @@ def test_dispatch_create_environment(session, monkeypatch):
     # When dispatch_create_environment is called
     dispatch_create_environment.run()
 
-    # It should cause the create_environment task to be called once with the
-    # non-deleted environment
-    mock.delay.assert_called_once_with(environment_id=e1.id)
+    # It should claim the non-deleted environment and cause the
+    # create_environment task to be called once with it and its claim
+    session.refresh(e1)
+    assert e1.claimed_until
+    mock.delay.assert_called_once_with(
+        environment_id=e1.id, claimed_until=e1.claimed_until
+    )
+
+    # The claimed environment is not dispatched again while the task runs
+    mock.reset_mock()
+    dispatch_create_environment.run()
+    mock.delay.assert_not_called()
+
+
+def test_dispatch_create_environment_claims_a_batch(session, monkeypatch):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {}, {}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    monkeypatch.setitem(app.config, "PROVISIONING_BATCH_SIZE", 2)
+    mock = Mock()
+    monkeypatch.setattr("atst.jobs.create_environment", mock)
+
+    dispatch_create_environment.run()
+    assert mock.delay.call_count == 2
+
+    dispatch_create_environment.run()
+    assert mock.delay.call_count == 3
+
+    dispatched = {call[1]["environment_id"] for call in mock.delay.call_args_list}
+    assert dispatched == {e.id for e in portfolio.applications[0].environments}
+
+
+def test_create_environment_takes_over_dispatched_claim(session, csp):
+    environment = EnvironmentFactory.create()
+    [(environment_id, claimed_until)] = claim_many_for_update(
+        Environment, session.query(Environment.id).filter_by(id=environment.id)
+    )
+
+    do_create_environment(
+        csp, environment_id=environment_id, claimed_until=claimed_until
+    )
+    session.refresh(environment)
+
+    assert environment.cloud_id
+    assert environment.claimed_until is None
+
+
+def test_create_environment_fails_with_someone_elses_claim(session, csp):
+    environment = EnvironmentFactory.create()
+    claim_many_for_update(
+        Environment, session.query(Environment.id).filter_by(id=environment.id)
+    )
+
+    with pytest.raises(ClaimFailedException):
+        do_create_environment(
+            csp, environment_id=environment.id, claimed_until=pendulum.now()
+        )
+
+    csp.create_environment.assert_not_called()
 
 
 def test_dispatch_create_atat_admin_user(session, monkeypatch):
@@ -150,7 +231,10 @@ def test_dispatch_create_atat_admin_user(session, monkeypatch):
 
     dispatch_create_atat_admin_user.run()
 
-    mock.delay.assert_called_once_with(environment_id=environment.id)
+    session.refresh(environment)
+    mock.delay.assert_called_once_with(
+        environment_id=environment.id, claimed_until=environment.claimed_until
+    )
 
 
 def test_create_environment_no_dupes(session, celery_app, celery_worker):
@@ -275,13 +359,46 @@ def test_dispatch_provision_user(csp, session, celery_app, celery_worker, monkey
     )
 
     mock = Mock()
-    monkeypatch.setattr("atst.jobs.provision_user", mock)
+    monkeypatch.setattr("atst.jobs.provision_users", mock)
 
     # When I dispatch the user provisioning task
     dispatch_provision_user.run()
 
     # I expect it to dispatch only one call, to EnvironmentRole D
-    mock.delay.assert_called_once_with(environment_role_id=er_d.id)
+    session.refresh(er_d)
+    mock.delay.assert_called_once_with(
+        environment_role_ids=[er_d.id], claimed_until=er_d.claimed_until
+    )
+
+
+def test_dispatch_provision_user_batches_by_environment(session, monkeypatch):
+    environments = [
+        EnvironmentFactory.create(cloud_id="cloud_id", root_user_info={})
+        for _ in range(2)
+    ]
+    roles = {
+        environment.id: [
+            EnvironmentRoleFactory.create(
+                environment=environment,
+                application_role=ApplicationRoleFactory(
+                    status=ApplicationRoleStatus.ACTIVE
+                ),
+            )
+            for _ in range(2)
+        ]
+        for environment in environments
+    }
+
+    mock = Mock()
+    monkeypatch.setattr("atst.jobs.provision_users", mock)
+    dispatch_provision_user.run()
+
+    assert mock.delay.call_count == 2
+    batches = [
+        sorted(call[1]["environment_role_ids"]) for call in mock.delay.call_args_list
+    ]
+    for environment_roles in roles.values():
+        assert sorted(role.id for role in environment_roles) in batches
 
 
 def test_do_provision_user(csp, session):
@@ -306,3 +423,251 @@ def test_do_provision_user(csp, session):
     )
     # I expect that the EnvironmentRole now has a csp_user_id
     assert environment_role.csp_user_id
+
+
+def test_do_provision_users(csp, session):
+    credentials = MockCloudProvider(())._auth_credentials
+    provisioned_environment = EnvironmentFactory.create(
+        cloud_id="cloud_id", root_user_info={"credentials": credentials}
+    )
+    environment_roles = [
+        EnvironmentRoleFactory.create(
+            environment=provisioned_environment, status=EnvironmentRole.Status.PENDING,
+        )
+        for _ in range(3)
+    ]
+    claims = claim_many_for_update(
+        EnvironmentRole,
+        session.query(EnvironmentRole.id).filter(
+            EnvironmentRole.environment_id == provisioned_environment.id
+        ),
+    )
+    [claimed_until] = {claimed_until for _, claimed_until in claims}
+
+    do_provision_users(
+        csp=csp,
+        environment_role_ids=[role.id for role in environment_roles],
+        claimed_until=claimed_until,
+        task_id="task_id",
+    )
+
+    # The CSP is called once for the whole batch
+    csp.create_or_update_users.assert_called_once()
+    assert csp.create_or_update_users.call_args[0][0] == credentials
+    for environment_role in environment_roles:
+        session.refresh(environment_role)
+        assert environment_role.csp_user_id
+        assert environment_role.status == EnvironmentRole.Status.COMPLETED
+        assert environment_role.claimed_until is None
+
+
+def test_do_provision_users_records_failed_users(session):
+    provisioned_environment = EnvironmentFactory.create(
+        cloud_id="cloud_id", root_user_info={}
+    )
+    provisioned, failed = [
+        EnvironmentRoleFactory.create(
+            environment=provisioned_environment, status=EnvironmentRole.Status.PENDING,
+        )
+        for _ in range(2)
+    ]
+    csp = Mock()
+    csp.create_or_update_users.return_value = {
+        provisioned.id: "csp_user_id",
+        failed.id: UserProvisioningException(
+            provisioned_environment.id, failed.application_role.user_id, "failed"
+        ),
+    }
+
+    do_provision_users(
+        csp=csp, environment_role_ids=[provisioned.id, failed.id], task_id="task_id"
+    )
+
+    session.refresh(provisioned)
+    session.refresh(failed)
+    assert provisioned.csp_user_id == "csp_user_id"
+    assert provisioned.status == EnvironmentRole.Status.COMPLETED
+    # The failed role is left pending to be dispatched again after a backoff
+    assert failed.csp_user_id is None
+    assert failed.status == EnvironmentRole.Status.PENDING
+    assert [failure.task_id for failure in failed.job_failures] == ["task_id"]
+    assert provisioned.claimed_until is None
+    assert failed.claimed_until is not None
+
+
+def test_environment_role_that_keeps_failing_stops_being_dispatched(
+    session, monkeypatch
+):
+    monkeypatch.setitem(app.config, "PROVISIONING_MAX_ATTEMPTS", 3)
+    environment_role = EnvironmentRoleFactory.create(
+        environment=EnvironmentFactory.create(cloud_id="cloud_id", root_user_info={}),
+        application_role=ApplicationRoleFactory(status=ApplicationRoleStatus.ACTIVE),
+    )
+    csp = Mock()
+    csp.create_or_update_users.return_value = {
+        environment_role.id: UserProvisioningException(
+            environment_role.environment_id, environment_role.id, "failed"
+        )
+    }
+    provision = Mock(
+        side_effect=lambda **kwargs: do_provision_users(
+            csp=csp, task_id="task_id", **kwargs
+        )
+    )
+    monkeypatch.setattr("atst.jobs.provision_users", Mock(delay=provision))
+
+    for _ in range(5):
+        dispatch_provision_user.run()
+        # as if the backoff had passed
+        session.query(EnvironmentRole).update({"claimed_until": None})
+        session.commit()
+
+    assert provision.call_count == 3
+    assert len(environment_role.job_failures) == 3
+    session.refresh(environment_role)
+    assert environment_role.status == EnvironmentRole.Status.PENDING
+
+
+def test_do_provision_users_skips_roles_claimed_elsewhere(csp, session):
+    environment_role = EnvironmentRoleFactory.create(
+        environment=EnvironmentFactory.create(cloud_id="cloud_id", root_user_info={}),
+        status=EnvironmentRole.Status.PENDING,
+    )
+    claim_many_for_update(
+        EnvironmentRole,
+        session.query(EnvironmentRole.id).filter(
+            EnvironmentRole.id == environment_role.id
+        ),
+    )
+
+    do_provision_users(
+        csp=csp, environment_role_ids=[environment_role.id], task_id="task_id"
+    )
+
+    csp.create_or_update_users.assert_not_called()
+    session.refresh(environment_role)
+    assert environment_role.status == EnvironmentRole.Status.PENDING
+    assert environment_role.claimed_until is not None
+
+
+@pytest.fixture
+def task():
+    task = Mock(
+        spec=["name", "request", "retry", "signature_from_request", "max_retries"]
+    )
+    task.name = "atst.jobs.create_environment"
+    task.max_retries = 3
+    task.request.retries = 2
+    task.request.kwargs = {"environment_id": "id"}
+    task.retry.side_effect = lambda **kwargs: Exception("retry")
+    return task
+
+
+def test_throttled_work_is_reenqueued_without_counting_a_retry(app, monkeypatch, task):
+    monkeypatch.setattr(app, "csp_rate_limiter", Mock(**{"acquire.return_value": 5}))
+    fn = Mock()
+
+    with pytest.raises(Ignore):
+        do_work(fn, task, Mock(), environment_id="id")
+
+    fn.assert_not_called()
+    app.csp_rate_limiter.acquire.assert_called_once_with(task.name, cost=1)
+    options = task.signature_from_request.call_args[1]
+    assert options["retries"] == 2
+    assert 5 <= options["countdown"] <= 10
+    task.signature_from_request.return_value.apply_async.assert_called_once()
+
+
+def test_batches_take_a_token_per_user_from_the_shared_limit(app, monkeypatch, task):
+    monkeypatch.setattr(app, "csp_rate_limiter", Mock(**{"acquire.return_value": 0}))
+    task.name = "atst.jobs.provision_users"
+
+    do_work(Mock(), task, Mock(), rate_limit_cost=3, environment_role_ids=[1, 2, 3])
+
+    app.csp_rate_limiter.acquire.assert_called_once_with(
+        "atst.jobs.provision_user", cost=3
+    )
+
+
+def test_failed_work_is_retried_with_backoff(app, monkeypatch, task):
+    monkeypatch.setitem(app.config, "CSP_RETRY_BASE_DELAY", 10)
+    monkeypatch.setitem(app.config, "CSP_RETRY_MAX_DELAY", 600)
+    fn = Mock(side_effect=GeneralCSPException)
+
+    with pytest.raises(Exception, match="retry"):
+        do_work(fn, task, Mock(), environment_id="id")
+
+    options = task.retry.call_args[1]
+    assert isinstance(options["exc"], GeneralCSPException)
+    assert 0 <= options["countdown"] <= 40
+
+
+def test_failed_work_keeps_the_claim_for_the_retry(session, csp, task):
+    environment = EnvironmentFactory.create()
+    [(environment_id, claimed_until)] = claim_many_for_update(
+        Environment, session.query(Environment.id).filter_by(id=environment.id)
+    )
+    task.request.kwargs = {
+        "environment_id": environment_id,
+        "claimed_until": claimed_until,
+    }
+    csp.create_environment.side_effect = GeneralCSPException
+
+    with pytest.raises(Exception, match="retry"):
+        do_work(
+            do_create_environment,
+            task,
+            csp,
+            environment_id=environment_id,
+            claimed_until=claimed_until,
+        )
+
+    retry_claimed_until = task.retry.call_args[1]["kwargs"]["claimed_until"]
+    session.refresh(environment)
+    assert environment.claimed_until == retry_claimed_until
+    # the dispatcher doesn't enqueue it again while the retry is waiting
+    assert not claim_many_for_update(
+        Environment, session.query(Environment.id).filter_by(id=environment.id)
+    )
+
+    csp.create_environment.side_effect = None
+    do_create_environment(
+        csp, environment_id=environment_id, claimed_until=retry_claimed_until
+    )
+    session.refresh(environment)
+    assert environment.cloud_id
+    assert environment.claimed_until is None
+
+
+def test_failed_work_releases_the_claim_on_the_last_try(session, csp, task):
+    environment = EnvironmentFactory.create()
+    task.request.retries = task.max_retries
+    csp.create_environment.side_effect = GeneralCSPException
+
+    with pytest.raises(Exception, match="retry"):
+        do_work(do_create_environment, task, csp, environment_id=environment.id)
+
+    session.refresh(environment)
+    assert environment.claimed_until is None
+
+
+def test_retry_delay_is_capped(app, monkeypatch):
+    monkeypatch.setitem(app.config, "CSP_RETRY_BASE_DELAY", 10)
+    monkeypatch.setitem(app.config, "CSP_RETRY_MAX_DELAY", 60)
+
+    assert all(0 <= retry_delay(retries) <= 10 for retries in [0] * 20)
+    assert all(0 <= retry_delay(retries) <= 60 for retries in [10] * 20)
+
+
+def test_maintain_audit_events(app, monkeypatch, tmpdir):
+    monkeypatch.setitem(app.config, "AUDIT_LOG_ARCHIVE_DIR", str(tmpdir))
+    monkeypatch.setitem(app.config, "AUDIT_LOG_RETENTION_MONTHS", 12)
+    expired_month = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    AuditEventPartitions.create(expired_month)
+
+    maintain_audit_events.run()
+
+    months = AuditEventPartitions.months()
+    assert expired_month not in months
+    assert len(months) >= AuditEventPartitions.MONTHS_AHEAD + 1
+    assert os.listdir(str(tmpdir)) == ["audit_events_y2000m01.jsonl.gz"]
@@ -0,0 +1,49 @@
+import pytest
+from uuid import uuid4
+
+from atst.utils.audit_event_stream import AuditEventStream
+
+
+@pytest.fixture
+def stream(app):
+    stream = AuditEventStream(app.redis)
+    app.redis.delete(stream.KEY)
+    yield stream
+    app.redis.delete(stream.KEY)
+
+
+def test_read_returns_added_events(stream):
+    resource_id = uuid4()
+    stream.add([{"resource_id": resource_id, "action": "create"}])
+
+    [(_id, event)] = stream.read("writer", 10)
+
+    assert event["resource_id"] == str(resource_id)
+    assert event["action"] == "create"
+    assert event["time_created"]
+
+
+def test_unacknowledged_events_are_read_again(stream):
+    stream.add([{"action": "create"}, {"action": "update"}])
+
+    first_read = stream.read("writer", 10)
+    # another writer doesn't get the events this one is working on
+    assert stream.read("other_writer", 10) == []
+    assert stream.read("writer", 10) == first_read
+
+    stream.acknowledge([id_ for id_, _ in first_read])
+    assert stream.read("writer", 10) == []
+
+
+def test_idle_events_are_claimed_from_other_writers(app, stream):
+    stream.add([{"action": "create"}, {"action": "update"}])
+    crashed_read = stream.read("crashed_writer", 10)
+
+    # the events aren't claimed while the writer might still be working on them
+    assert stream.read("new_writer", 10) == []
+
+    recovering = AuditEventStream(app.redis, claim_idle_time=0)
+    assert recovering.read("new_writer", 10) == crashed_read
+
+    recovering.acknowledge([id_ for id_, _ in crashed_read])
+    assert recovering.read("crashed_writer", 10) == []
@@ -1,10 +1,15 @@
 from unittest.mock import Mock
 
 import pytest
+from sqlalchemy import event
 
+from atst.database import db
+from atst.domain.authz import Authorization
+from atst.domain.authz.snapshot import AuthorizationSnapshots
 from atst.domain.permission_sets import PermissionSets
 from atst.models import Permissions
 from atst.utils.context_processors import (
+    assign_resources,
     get_resources_from_context,
     user_can_view,
     portfolio as portfolio_context,
@@ -80,3 +85,75 @@ def test_portfolio_with_user(set_g):
     set_g("current_user", user)
     set_g("portfolio", None)
     assert portfolio_context() != {}
+
+
+def test_get_resources_from_context_loads_user_roles(monkeypatch):
+    user = UserFactory.create()
+    portfolio = PortfolioFactory.create()
+    application = ApplicationFactory.create(portfolio=portfolio)
+    ApplicationRoleFactory.create(
+        user=user,
+        application=application,
+        permission_sets=PermissionSets.get_many([PermissionSets.VIEW_APPLICATION]),
+    )
+    other_portfolio = PortfolioFactory.create(owner=user)
+    db.session.expire_all()
+
+    assert get_resources_from_context(
+        {"application_id": application.id}, user=user
+    ) == (portfolio, application)
+
+    full_builds = []
+    monkeypatch.setattr(
+        "atst.domain.authz.context.AuthorizationContext.from_user",
+        lambda user: full_builds.append(user),
+    )
+    assert Authorization.has_application_permission(
+        user, application, Permissions.VIEW_APPLICATION
+    )
+    assert not Authorization.has_portfolio_permission(
+        user, portfolio, Permissions.VIEW_PORTFOLIO_FUNDING
+    )
+    assert not full_builds
+
+    monkeypatch.undo()
+    assert Authorization.has_portfolio_permission(
+        user, other_portfolio, Permissions.VIEW_PORTFOLIO_FUNDING
+    )
+
+
+def test_assign_resources_merges_roles_into_the_snapshot(app, set_g, monkeypatch):
+    user = UserFactory.create()
+    other_portfolio = PortfolioFactory.create(owner=user)
+    application = ApplicationFactory.create()
+    snapshots = AuthorizationSnapshots(app.redis, 60)
+    snapshots.get_user(user.id)
+
+    # a role granted while the snapshot cache couldn't be invalidated
+    monkeypatch.setattr(app, "authz_snapshots", Mock())
+    ApplicationRoleFactory.create(
+        user=user,
+        application=application,
+        permission_sets=PermissionSets.get_many([PermissionSets.VIEW_APPLICATION]),
+    )
+    user_id = user.id
+    assert other_portfolio.id and application.id
+    db.session.expunge(user)
+    cached = snapshots.get_user(user_id)
+    set_g("current_user", cached)
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        assign_resources({"application_id": application.id})
+        assert Authorization.has_application_permission(
+            cached, application, Permissions.VIEW_APPLICATION
+        )
+        assert Authorization.has_portfolio_permission(
+            cached, other_portfolio, Permissions.EDIT_PORTFOLIO_NAME
+        )
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    assert len(statements) == 1
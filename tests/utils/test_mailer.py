@@ -1,5 +1,13 @@
 import pytest
-from atst.utils.mailer import Mailer, Mailer, MailConnection, RedisConnection
+from atst.utils.mailer import (
+    Mailer,
+    Mailer,
+    MailConnection,
+    RedisConnection,
+    SMTPConnection,
+)
+
+from tests.mock_smtp import smtp_server
 
 
 class MockConnection(MailConnection):
@@ -46,3 +54,42 @@ def test_redis_mailer_can_save_messages(app):
     assert message_data["recipients"][0] in message
     assert message_data["subject"] in message
     assert message_data["body"] in message
+
+
+def smtp_mailer(server, **kwargs):
+    connection = SMTPConnection(
+        "localhost", server.port, "test@atat.com", "password", **kwargs
+    )
+    return Mailer(connection, "test@atat.com")
+
+
+def test_smtp_mailer_reuses_its_session(smtp_server):
+    mailer = smtp_mailer(smtp_server)
+    for _ in range(3):
+        mailer.send(["ben@tattoine.org"], "help", "you're my only hope")
+    mailer.connection.close()
+
+    assert len(smtp_server.messages) == 3
+    assert len(smtp_server.connections) == 1
+    assert smtp_server.logins == 1
+
+
+def test_smtp_mailer_reconnects_when_its_session_is_dropped(smtp_server):
+    mailer = smtp_mailer(smtp_server)
+    mailer.send(["ben@tattoine.org"], "help", "you're my only hope")
+    smtp_server.drop_connections()
+    mailer.send(["ben@tattoine.org"], "help", "you're my only hope")
+    mailer.connection.close()
+
+    assert len(smtp_server.messages) == 2
+    assert len(smtp_server.connections) == 2
+
+
+def test_smtp_mailer_closes_idle_sessions(smtp_server):
+    mailer = smtp_mailer(smtp_server, idle_timeout=0)
+    for _ in range(2):
+        mailer.send(["ben@tattoine.org"], "help", "you're my only hope")
+    mailer.connection.close()
+
+    assert len(smtp_server.messages) == 2
+    assert len(smtp_server.connections) == 2
@@ -0,0 +1,62 @@
+import socket
+
+import pytest
+
+from atst.utils.metrics import Metrics, StageTimer, StatsdMetrics
+
+
+@pytest.fixture
+def statsd_agent():
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(("127.0.0.1", 0))
+    agent.settimeout(2)
+    yield agent
+    agent.close()
+
+
+def test_statsd_metrics_sends_tagged_timings(statsd_agent):
+    host, port = statsd_agent.getsockname()
+    metrics = StatsdMetrics(host, port=port, prefix="atat")
+
+    metrics.timing(
+        "crl_check.verify", 1.5, tags={"issuer": "DOD ID CA-59", "outcome": "passed"}
+    )
+
+    assert (
+        statsd_agent.recv(1024)
+        == b"atat.crl_check.verify:1.500|ms|#issuer:DOD_ID_CA-59,outcome:passed"
+    )
+
+
+class RecordingMetrics(Metrics):
+    def __init__(self):
+        self.timings = []
+
+    def timing(self, name, milliseconds, tags=None):
+        self.timings.append((name, milliseconds, tags))
+
+
+def test_stage_timer_reports_each_stage_and_total():
+    metrics = RecordingMetrics()
+    timer = StageTimer()
+    timer.mark("first")
+    timer.mark("second")
+    timer.stop()
+
+    timer.report(metrics, "operation", tags={"kind": "test"})
+
+    names = [name for name, _, _ in metrics.timings]
+    assert names == ["operation.first", "operation.second", "operation.total"]
+    assert all(tags == {"kind": "test"} for _, _, tags in metrics.timings)
+    assert timer.total >= sum(timer.stages.values())
+
+
+def test_statsd_metrics_sends_histograms(statsd_agent):
+    host, port = statsd_agent.getsockname()
+    metrics = StatsdMetrics(host, port=port, prefix="atat")
+
+    metrics.histogram("request.sql.queries", 12, tags={"endpoint": "atst.home"})
+
+    assert (
+        statsd_agent.recv(1024) == b"atat.request.sql.queries:12|h|#endpoint:atst.home"
+    )
@@ -0,0 +1,64 @@
+import pytest
+from flask import url_for
+
+from atst.utils.query_stats import QueryBudgetExceededError, RequestQueries
+
+from tests.factories import PortfolioFactory
+
+
+def test_request_queries_flags_repeated_statements():
+    queries = RequestQueries()
+    for _ in range(3):
+        queries.record("SELECT * FROM users WHERE users.id = %(id)s", 1.0)
+    queries.record("SELECT * FROM portfolios", 2.5)
+
+    assert queries.count == 4
+    assert queries.duration == 5.5
+    assert queries.repeated(3) == [("SELECT * FROM users WHERE users.id = %(id)s", 3)]
+    assert queries.repeated(4) == []
+    assert queries.repeated(0) == []
+
+
+def test_request_over_query_budget_fails(app, client, user_session, monkeypatch):
+    portfolio = PortfolioFactory.create()
+    user_session(portfolio.owner)
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET", 1)
+
+    with pytest.raises(QueryBudgetExceededError):
+        client.get(
+            url_for("applications.portfolio_applications", portfolio_id=portfolio.id)
+        )
+
+
+def test_request_over_query_budget_is_logged(
+    app, client, user_session, monkeypatch, mock_logger
+):
+    portfolio = PortfolioFactory.create()
+    user_session(portfolio.owner)
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET", 1)
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_ENFORCE", False)
+
+    response = client.get(
+        url_for("applications.portfolio_applications", portfolio_id=portfolio.id)
+    )
+
+    assert response.status_code == 200
+    queries = mock_logger.extras[-1]["queries"]
+    assert queries["endpoint"] == "applications.portfolio_applications"
+    assert queries["budget"] == 1
+    assert queries["count"] > 1
+
+
+def test_view_query_budget_overrides_default(
+    app, client, user_session, monkeypatch, mock_logger
+):
+    user_session(PortfolioFactory.create().owner)
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET", 1)
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_ENFORCE", False)
+
+    response = client.get(url_for("portfolios.portfolios"))
+
+    assert response.status_code == 200
+    # the listing is held to the budget set with @query_budget
+    assert app.view_functions["portfolios.portfolios"].query_budget == 20
+    assert not any("queries" in extras for extras in mock_logger.extras)
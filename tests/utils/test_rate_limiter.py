@@ -0,0 +1,60 @@
+import time
+from unittest.mock import Mock
+from uuid import uuid4
+
+from redis import Redis
+from redis.exceptions import ConnectionError
+
+from atst.utils.rate_limiter import RateLimiter
+
+
+def test_rate_limiter_allows_a_burst_then_throttles(app):
+    name = str(uuid4())
+    limiter = RateLimiter(app.redis, {name: 60}, burst=2)
+
+    assert limiter.acquire(name) == 0
+    assert limiter.acquire(name) == 0
+    assert 0 < limiter.acquire(name) <= 1
+
+
+def test_rate_limiter_refills_over_time(app):
+    name = str(uuid4())
+    limiter = RateLimiter(app.redis, {name: 6000}, burst=1)
+
+    assert limiter.acquire(name) == 0
+    assert limiter.acquire(name) > 0
+    time.sleep(0.02)
+    assert limiter.acquire(name) == 0
+
+
+def test_rate_limiter_takes_the_cost_in_tokens(app):
+    name = str(uuid4())
+    limiter = RateLimiter(app.redis, {name: 60}, burst=3)
+
+    assert limiter.acquire(name, cost=2) == 0
+    assert 0 < limiter.acquire(name, cost=2) <= 1
+
+
+def test_rate_limiter_takes_costs_over_the_burst_as_debt(app):
+    name = str(uuid4())
+    limiter = RateLimiter(app.redis, {name: 60}, burst=2)
+
+    assert limiter.acquire(name, cost=10) == 0
+    # the next call waits for the debt to be refilled as well as its own token
+    assert 8 < limiter.acquire(name) <= 9
+
+
+def test_rate_limiter_does_not_throttle_unlimited_names(app):
+    name = str(uuid4())
+    limiter = RateLimiter(app.redis, {name: 0}, burst=1)
+
+    assert all(limiter.acquire(name) == 0 for _ in range(5))
+    assert limiter.acquire("unknown") == 0
+
+
+def test_rate_limiter_lets_calls_through_without_redis():
+    redis = Mock(spec=Redis)
+    redis.register_script.return_value = Mock(side_effect=ConnectionError)
+    limiter = RateLimiter(redis, {"operation": 1}, burst=1)
+
+    assert limiter.acquire("operation") == 0
@@ -0,0 +1,58 @@
+from unittest.mock import Mock
+from uuid import uuid4
+
+import pytest
+from redis.exceptions import RedisError
+
+from atst.utils.versioned_cache import VersionedCache
+
+
+class Cache(VersionedCache):
+    KEY_PREFIX = "test_versioned_cache"
+    VALUE_KEY = "value"
+    DESCRIPTION = "Test cache"
+
+
+@pytest.fixture
+def cache(app):
+    cache = Cache(app.redis, 60)
+    yield cache
+    for key in app.redis.scan_iter("{}:*".format(Cache.KEY_PREFIX)):
+        app.redis.delete(key)
+
+
+def test_values_are_used_until_invalidated(cache):
+    user_id = uuid4()
+    version, value = cache._load(user_id)
+    assert value is None
+    cache._store(user_id, version, {"cached": True})
+
+    assert cache._load(user_id) == (version, {"cached": True})
+
+    cache.invalidate([user_id])
+    assert cache._load(user_id)[1] is None
+
+
+def test_epoch_invalidates_everyone(cache):
+    user_id = uuid4()
+    version, _ = cache._load(user_id)
+    cache._store(user_id, version, "cached")
+
+    cache.invalidate(everyone=True)
+
+    assert cache._load(user_id)[1] is None
+
+
+def test_values_are_not_used_until_a_failed_invalidation_is_sent(cache, monkeypatch):
+    user_id = uuid4()
+    version, _ = cache._load(user_id)
+    cache._store(user_id, version, "stale")
+
+    with monkeypatch.context() as outage:
+        outage.setattr(cache.redis, "pipeline", Mock(side_effect=RedisError))
+        assert not cache.invalidate([user_id])
+        # nor stored, since the version they would be stored under is stale
+        assert cache._load(user_id) == (None, None)
+
+    assert cache._load(user_id)[1] is None
+    assert not cache._has_unsent()